@@ -1,9 +1,14 @@
 import os
 import sys
+import argparse
 from collections import defaultdict
 import json
 
-def combine_files_in_directory(origin_dir, destination_dir):
+# The clock offsets are read and applied by the ML pipeline module that estimates them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ml_pipeline'))
+from clock_alignment import load_clock_offsets, correct_entries
+
+def combine_files_in_directory(origin_dir, destination_dir, offsets=None):
     # Dictionary to hold lists of file contents by base name
     combined_files = defaultdict(list)
 
@@ -18,6 +23,8 @@ def combine_files_in_directory(origin_dir, destination_dir):
                 # Load the JSON content
                 try:
                     content = json.load(f)
+                    if offsets:
+                        correct_entries(content, offsets)
                     combined_files[prefix].extend(content)  # Extend the list with the content
                 except json.JSONDecodeError:
                     print(f"Error decoding JSON from file: {file_path}")
@@ -31,12 +38,14 @@ def combine_files_in_directory(origin_dir, destination_dir):
         print(f"Combined file created: {output_file}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python combine_files.py <origin_directory> <destination_directory>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Combine the converted tracer files of every process into one file sorted by timestamp')
+    parser.add_argument('origin_dir', type=str, help='Folder with the converted tracer files')
+    parser.add_argument('destination_dir', type=str, help='Folder for the combined files')
+    parser.add_argument('--session_metadata', type=str, help='session_metadata.json with the clock offsets of the nodes to apply')
+    args = parser.parse_args()
 
-    origin_dir = sys.argv[1]
-    destination_dir = sys.argv[2]
+    origin_dir = args.origin_dir
+    destination_dir = args.destination_dir
 
     if not os.path.exists(origin_dir):
         print(f"Origin directory '{origin_dir}' does not exist.")
@@ -45,5 +54,7 @@ if __name__ == "__main__":
     if not os.path.exists(destination_dir):
         os.makedirs(destination_dir)
 
+    offsets = load_clock_offsets(args.session_metadata) if args.session_metadata else None
+
     # Call the function with both the origin and destination directories
-    combine_files_in_directory(origin_dir, destination_dir)
\ No newline at end of file
+    combine_files_in_directory(origin_dir, destination_dir, offsets)
\ No newline at end of file
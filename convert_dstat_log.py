@@ -1,99 +1,373 @@
 import os
+import csv
 import json
+import functools
 import sys
 import re
-from datetime import datetime, timezone
-
-def convert_nanoseconds_to_iso(nanoseconds):
-    # Convert nanoseconds to seconds
-    seconds = nanoseconds / 1_000_000_000
-    # Create a datetime object from the seconds
-    dt = datetime.fromtimestamp(seconds, tz=timezone.utc)
-    # Convert to ISO 8601 format
-    return dt.isoformat()
-
-def parse_number(value_str):
-    value_str = value_str.strip().replace(',', '')  # Remove commas
-    if not value_str:
-        return 0
-    # Extract numeric part and suffix
-    match = re.match(r'^([\d.]+)([kMGB]?)(B?)$', value_str)
-    if not match:
-        return 0
-    number, suffix, is_bytes = match.groups()
-    number = float(number) if '.' in number else int(number)
-    multiplier = {
-        'k': 1024,
-        'M': 1024**2,
-        'G': 1024**3,
-        'B': 1,
-        '': 1
-    }.get(suffix.upper(), 1)
-    return int(number * multiplier) if suffix else number
-
-def parse_log_file(log_file, output_json):
-    entries = []
-    
-    with open(log_file, 'r') as infile:
-        # Skip the first two header lines
-        next(infile)
-        next(infile)
-
-        node_name = os.path.splitext(os.path.basename(log_file))[0].split('_')[2]
-        
-        for line in infile:
-            line = line.strip()
-            if re.match(r'^\d+\|', line):
-                parts = line.split('|')
-                if len(parts) < 8:
-                    continue
-                
-                # Extract components from each section
-                entry = {
-                    "timestamp": convert_nanoseconds_to_iso(int(parts[0].strip())),
-                    "node": node_name,
-                    "usr": int(parts[1].split()[0].strip()),
-                    "sys": int(parts[1].split()[1].strip()),
-                    "idl": int(parts[1].split()[2].strip()),
-                    "wai": int(parts[1].split()[3].strip()),
-                    "stl": int(parts[1].split()[4].strip()),
-                    "dsk_read": parse_number(parts[2].split()[0].strip()),
-                    "dsk_writ": parse_number(parts[2].split()[1].strip()),
-                    "io_read": float(parts[3].split()[0].strip()),
-                    "io_writ": float(parts[3].split()[1].strip()),
-                    "net_recv": parse_number(parts[4].split()[0].strip()),
-                    "net_send": parse_number(parts[4].split()[1].strip()),
-                    "used": parse_number(parts[5].split()[0].strip()),
-                    "free": parse_number(parts[5].split()[1].strip()),
-                    "buff": parse_number(parts[5].split()[2].strip()),
-                    "cach": parse_number(parts[5].split()[3].strip()),
-                    "paging_in": int(parts[6].split()[0].strip()),
-                    "paging_out": int(parts[6].split()[1].strip()),
-                    "ib_recv": parse_number(parts[7].split()[0].strip()),
-                    "ib_send": parse_number(parts[7].split()[1].strip())
-                }
-                entries.append(entry)
-    
-    with open(output_json, 'w') as outfile:
-        json.dump(entries, outfile, indent=2)
-
-def process_logs(input_folder, output_folder):
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+
+#### Numbers of the text logs, parsed with numpy over whole columns
+
+def byte_class(characters):
+    # Lookup table over the 256 byte values, table[chars] instead of np.isin on whole texts
+    table = np.zeros(256, dtype=bool)
+    table[np.frombuffer(characters, dtype=np.uint8)] = True
+    return table
+
+UNITS = byte_class(b'kMGB')
+DIGITS = byte_class(b'0123456789.')
+
+def parse_numbers(tokens):
+    # Values of an array of byte strings (<number>[kMGB]?B?, commas ignored, 0 when unreadable) as float64,
+    # and which of them are floats (no unit suffix and a decimal point), the others are ints.
+    # The 'k' suffix has no multiplier, as in the scalar parser this replaced.
+    tokens = np.asarray(tokens, dtype=np.bytes_)
+    if len(tokens):
+        # Cut the width down to the longest token, a column of short values is often split from long ones
+        tokens = tokens.astype(f'S{max(int(np.char.str_len(tokens).max()), 1)}')
+    if not len(tokens) or tokens.dtype.itemsize == 0:
+        return np.zeros(len(tokens)), np.zeros(len(tokens), dtype=bool)
+    chars = tokens.view(np.uint8).reshape(len(tokens), tokens.dtype.itemsize)
+    if (chars == ord(',')).any():
+        tokens = np.array([token.replace(b',', b'') for token in tokens.tolist()], dtype=tokens.dtype)
+        chars = tokens.view(np.uint8).reshape(len(tokens), tokens.dtype.itemsize)
+
+    rows = np.arange(len(tokens))
+    lengths = (chars != 0).sum(axis=1)
+    last = chars[rows, np.maximum(lengths - 1, 0)]
+    before = chars[rows, np.maximum(lengths - 2, 0)]
+
+    # <number>[kMGB]?B?
+    has_unit = (lengths > 0) & UNITS[last]
+    has_bytes = has_unit & (last == ord('B')) & (lengths > 1) & UNITS[before]
+    suffix = np.where(has_bytes, before, np.where(has_unit, last, 0))
+    number_lengths = lengths - has_unit - has_bytes
+
+    in_number = np.arange(chars.shape[1]) < number_lengths[:, None]
+    valid = (number_lengths > 0) & (DIGITS[chars] | ~in_number).all(axis=1)
+    has_point = ((chars == ord('.')) & in_number).any(axis=1)
+
+    numbers = np.zeros(len(tokens))
+    digits = np.where(in_number & valid[:, None], chars, 0).astype(np.uint8)
+    numbers[valid] = digits[valid].view(tokens.dtype).ravel().astype(np.float64)
+
+    multipliers = np.where(suffix == ord('M'), 1024**2, np.where(suffix == ord('G'), 1024**3, 1))
+    values = np.where(suffix > 0, np.trunc(numbers * multipliers), numbers)
+    return values, valid & has_point & (suffix == 0)
+
+#### Column schema: the (group, nick, segment, position) of every column, read from the header of the log
+
+# JSON key of the dstat columns, by (group, nick)
+DSTAT_FIELDS = {
+    ('total cpu usage', 'usr'): 'usr',
+    ('total cpu usage', 'sys'): 'sys',
+    ('total cpu usage', 'idl'): 'idl',
+    ('total cpu usage', 'wai'): 'wai',
+    ('total cpu usage', 'stl'): 'stl',
+    ('dsk/total', 'read'): 'dsk_read',
+    ('dsk/total', 'writ'): 'dsk_writ',
+    ('io/total', 'read'): 'io_read',
+    ('io/total', 'writ'): 'io_writ',
+    ('net/total', 'recv'): 'net_recv',
+    ('net/total', 'send'): 'net_send',
+    ('memory usage', 'used'): 'used',
+    ('memory usage', 'free'): 'free',
+    ('memory usage', 'buff'): 'buff',
+    ('memory usage', 'cach'): 'cach',
+    ('paging', 'in'): 'paging_in',
+    ('paging', 'out'): 'paging_out',
+    ('ib/total', 'recv'): 'ib_recv',
+    ('ib/total', 'send'): 'ib_send',
+}
+
+# Columns of the dstat gpu plugin (groups gpu/<index>), named like the nvidia-smi log keys
+GPU_FIELDS = {
+    'temp': 'temperature_gpu',
+    'util': 'utilization_gpu',
+    'mutl': 'utilization_memory',
+    'total': 'memory_total_mib',
+    'free': 'memory_free_mib',
+    'used': 'memory_used_mib',
+}
+
+# Written as floats even when dstat shows them without a decimal point
+FLOAT_FIELDS = {'io_read', 'io_writ'}
+
+# Group of the time plugin, its column is the timestamp of the entries
+TIME_GROUP = 'epoch_ns'
+
+def field_key(group, nick):
+    if (group, nick) in DSTAT_FIELDS:
+        return DSTAT_FIELDS[(group, nick)]
+    if group.startswith('gpu/') and nick in GPU_FIELDS:
+        return f"gpu{group[4:]}_{GPU_FIELDS[nick]}"
+    # Columns of any other plugin are kept as <group>_<nick>
+    return re.sub(r'[^0-9a-z]+', '_', f"{group}_{nick}".lower()).strip('_')
+
+def text_schema(title, subtitle):
+    # dstat stdout header: the title has one name per group (spaces replaced by dashes, which also pad
+    # the names), separated by spaces, the subtitle has the nicks of each group, the groups separated by
+    # '|' (between plugins) or ':' (between the names of a plugin). None if the lines are not a header.
+    names = title.decode(errors='replace').strip().rstrip('>').split()
+    groups = re.split(r'[|:]', subtitle.decode(errors='replace').rstrip().rstrip('>'))
+    if not names or len(names) != len(groups):
+        return None
+    schema = []
+    for segment, (name, nicks) in enumerate(zip(names, groups)):
+        group = name.strip('-').replace('-', ' ')
+        schema.extend((group, nick, segment, position) for position, nick in enumerate(nicks.split()))
+    return tuple(schema) or None
+
+def csv_schema(title, subtitle):
+    # dstat CSV header (--output, or stdout in the headless mode): the group names in the first cell of
+    # their columns, then one nick per cell ("<name>:<nick>" for the plugins with several names)
+    names = next(csv.reader([title.decode(errors='replace')]))
+    nicks = next(csv.reader([subtitle.decode(errors='replace')]))
+    schema = []
+    group = ''
+    for segment, nick in enumerate(nicks):
+        if segment < len(names) and names[segment]:
+            group = names[segment]
+        if nick.startswith(group + ':'):
+            nick = nick[len(group) + 1:]
+        schema.append((group, nick, segment, 0))
+    return tuple(schema) or None
+
+#### Parsers compiled per schema
+
+# A data line starts with a number (the values of the first plugin)
+DATA_LINE = re.compile(rb'^[ \t\r\x0b\x0c]*\d[^\n]*$', re.M)
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+class LogParser:
+    # Parser of the data lines of one schema: a line is cut into segments at the separators, the segments
+    # into whitespace tokens, and each column is the token at its (segment, position)
+
+    def __init__(self, schema, separators):
+        self.size = len(schema)
+        self.segments = max(segment for _, _, segment, _ in schema) + 1
+        self.width = max(position for _, _, _, position in schema) + 1
+        time_columns = [column for column, (group, _, _, _) in enumerate(schema) if group == TIME_GROUP]
+        if not time_columns:
+            raise ValueError(f"The dstat header has no {TIME_GROUP} column")
+        self.time_column = time_columns[0]
+        self.columns = [(column, field_key(group, nick)) for column, (group, nick, _, _) in enumerate(schema)
+                        if group != TIME_GROUP]
+
+        # Table column of every (segment, position), -1 for the tokens that are not in the schema
+        self.cell_columns = np.full(self.segments * self.width, -1)
+        for column, (_, _, segment, position) in enumerate(schema):
+            self.cell_columns[segment * self.width + position] = column
+
+        # '>' ends the lines dstat cut at the terminal width
+        self.is_segment_end = byte_class(separators)
+        self.is_token_end = byte_class(WHITESPACE + separators + b'>')
+        self.to_space = bytes.maketrans(separators + b'>', b' ' * (len(separators) + 1))
+
+    def tokenize(self, text):
+        # Whitespace tokens of the data lines of text, laid out as a (lines, columns) table of token indexes
+        # (-1 where a line has no such token), and the number of segments of each line
+        lines = DATA_LINE.findall(text)
+        body = b'\n'.join(lines) + b'\n'
+        tokens = np.array(body.translate(self.to_space).split(), dtype=np.bytes_)
+
+        chars = np.frombuffer(body, dtype=np.uint8)
+        is_newline = chars == ord('\n')
+        is_segment_end = self.is_segment_end[chars]
+        line_ids = np.cumsum(is_newline, dtype=np.int32) - is_newline
+        ends_before = np.cumsum(is_segment_end, dtype=np.int32) - is_segment_end
+        line_starts = np.r_[0, np.flatnonzero(is_newline)[:-1] + 1]
+        segments = ends_before - ends_before[line_starts][line_ids]
+
+        # Same token boundaries as bytes.split() on the translated body
+        in_token = ~self.is_token_end[chars]
+        starts = np.flatnonzero(in_token & ~np.r_[False, in_token[:-1]])
+        token_lines, token_segments = line_ids[starts], segments[starts]
+
+        # Position of each token in its (line, segment)
+        index = np.arange(len(starts))
+        first = np.r_[True, (token_lines[1:] != token_lines[:-1]) | (token_segments[1:] != token_segments[:-1])]
+        positions = index - np.maximum.accumulate(np.where(first, index, 0))
+
+        keys = token_segments * self.width + positions
+        selected = np.flatnonzero((positions < self.width) & (keys < len(self.cell_columns)))
+        token_columns = self.cell_columns[keys[selected]]
+        selected, token_columns = selected[token_columns >= 0], token_columns[token_columns >= 0]
+
+        table = np.full((len(lines), self.size), -1, dtype=np.int64)
+        table[token_lines[selected], token_columns] = selected
+        return tokens, table, np.bincount(line_ids[is_segment_end], minlength=len(lines)) + 1
+
+    def parse(self, text):
+        # Returns the timestamps (ns) and the (key, values, is_float) of every other column
+        tokens, table, segments = self.tokenize(text)
+        # Lines of another plugin set and lines missing one of the values are skipped
+        table = table[(segments == self.segments) & (table >= 0).all(axis=1)]
+        timestamps = tokens[table[:, self.time_column]].astype(np.int64)
+
+        columns = []
+        for column, key in self.columns:
+            values, is_float = parse_numbers(tokens[table[:, column]])
+            if key in FLOAT_FIELDS:
+                is_float = np.ones(len(values), dtype=bool)
+            columns.append((key, values, is_float))
+        return timestamps, columns
+
+# One parser per schema, logs of the same plugin set reuse it
+@functools.lru_cache(maxsize=None)
+def compile_parser(schema, separators):
+    return LogParser(schema, separators)
+
+#### Text logs (dstat stdout, header then one line per sample) and CSV logs
+
+# Title and subtitle lines, looked for at every line start so that a stray line before a header is skipped
+TEXT_HEADER = re.compile(rb'^(?=(?![ \t]*\d)([^|\n]*[^|\s][^|\n]*)\n(?![ \t]*\d)([^\n]*\S[^\n]*)$)', re.M)
+CSV_HEADER = re.compile(rb'^(?=("(?!Dstat |Author:"|Host:"|Cmdline:")[^\n]*)\n("[^\n]*)$)', re.M)
+CSV_HOST = re.compile(rb'^"Host:","([^"\n]*)"', re.M)
+
+def log_sections(text, header, read_schema):
+    # (schema, data lines) of every header of the log. dstat repeats its header on every screen and an
+    # appended --output file gets a new one, headers of the same schema as the previous one go on its section.
+    # Headers without the time plugin are left out, their samples have no timestamp.
+    sections = []
+    for match in header.finditer(text):
+        schema = read_schema(match.group(1), match.group(2))
+        if schema is None or TIME_GROUP not in (group for group, _, _, _ in schema):
+            continue
+        if sections and sections[-1][0] == schema:
+            continue
+        if sections:
+            sections[-1][2] = match.start()
+        sections.append([schema, match.end(2), len(text)])
+    return [(schema, text[start:end]) for schema, start, end in sections]
+
+def merge_sections(parsed):
+    # Sections with other plugin sets are put together by key, NaN where a section does not have a column
+    if len(parsed) == 1:
+        return parsed[0]
+    timestamps = np.concatenate([np.empty(0, dtype=np.int64)] + [section_timestamps for section_timestamps, _ in parsed])
+    keys = list(dict.fromkeys(key for _, columns in parsed for key, _, _ in columns))
+    merged = []
+    for key in keys:
+        parts = [next(((values, is_float) for column_key, values, is_float in columns if column_key == key),
+                      (np.full(len(section_timestamps), np.nan), np.ones(len(section_timestamps), dtype=bool)))
+                 for section_timestamps, columns in parsed]
+        merged.append((key, np.concatenate([values for values, _ in parts]), np.concatenate([is_float for _, is_float in parts])))
+    return timestamps, merged
+
+def node_from_filename(log_file):
+    # srun_dstat_<node>.log
+    parts = os.path.splitext(os.path.basename(log_file))[0].split('_')
+    return parts[2] if len(parts) > 2 else parts[-1]
+
+def read_log_file(log_file):
+    # Returns the node, the timestamps (ns) and the (key, values, is_float) of every column
+    with open(log_file, 'rb') as infile:
+        text = infile.read()
+
+    node_name = None
+    if text.lstrip().startswith(b'"'):
+        sections = [(compile_parser(schema, b','), body) for schema, body in log_sections(text, CSV_HEADER, csv_schema)]
+        host = CSV_HOST.search(text)
+        if host:
+            node_name = host.group(1).decode(errors='replace')
+    else:
+        sections = [(compile_parser(schema, b'|:'), body) for schema, body in log_sections(text, TEXT_HEADER, text_schema)]
+
+    timestamps, columns = merge_sections([parser.parse(body) for parser, body in sections])
+    return node_name or node_from_filename(log_file), timestamps, columns
+
+def parse_log_file(log_file, output_path, output_format='json'):
+    node_name, timestamps, columns = read_log_file(log_file)
+    write_entries(output_path, node_name, timestamps, columns, output_format)
+
+#### Binary logs
+
+# Binary records written by dstat.py --output-bin: magic, header length, JSON header, then
+# fixed-size records (int64 timestamp in ns + one float64 per column), little-endian
+BINARY_MAGIC = b'DSTATBIN'
+
+def is_binary_log(log_file):
+    with open(log_file, 'rb') as infile:
+        return infile.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def read_dstat_binary(log_file):
+    # Returns the header and the records as a numpy structured array ('timestamp_ns', then 'group:nick' fields)
+    with open(log_file, 'rb') as infile:
+        if infile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{log_file} is not a dstat binary log")
+        header_length, = struct.unpack('<I', infile.read(4))
+        header = json.loads(infile.read(header_length))
+        data = infile.read()
+
+    names = ['timestamp_ns'] + [f"{column['group']}:{column['nick']}" for column in header['columns']]
+    dtype = np.dtype({'names': names, 'formats': ['<i8'] + ['<f8'] * len(header['columns'])})
+    # A record cut short by a killed collector is dropped
+    complete = len(data) - len(data) % dtype.itemsize
+    return header, np.frombuffer(data[:complete], dtype=dtype)
+
+def parse_binary_file(log_file, output_path, output_format='json'):
+    header, records = read_dstat_binary(log_file)
+    # Values are kept unrounded, so all of them are floats
+    columns = [(field_key(column['group'], column['nick']), records[f"{column['group']}:{column['nick']}"],
+                np.ones(len(records), dtype=bool)) for column in header['columns']]
+    write_entries(output_path, header['host'], records['timestamp_ns'], columns, output_format)
+
+#### Output: json (list of entries), ndjson (one entry per line) or parquet
+
+OUTPUT_FORMATS = ('json', 'ndjson', 'parquet')
+
+def iso_timestamps(timestamps):
+    # UTC datetimes as ISO strings rounded to the microsecond, without the fraction when it is zero
+    text = timestamps.dt.round('us').dt.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+    return text.str.replace('.000000+', '+', regex=False)
+
+def write_frame(frame, output_path, output_format='json'):
+    # frame has a UTC 'timestamp' column, kept as datetimes in Parquet, NaN values are written as null in JSON
+    if output_format == 'parquet':
+        frame.to_parquet(output_path, index=False)
+        return
+    lines = output_format == 'ndjson'
+    if lines and frame.empty:
+        # to_json would write a blank line
+        open(output_path, 'w').close()
+        return
+    frame = frame.assign(timestamp=iso_timestamps(frame['timestamp']))
+    frame.to_json(output_path, orient='records', lines=lines, indent=None if lines else 2, double_precision=15)
+
+def entries_frame(node_name, timestamps, columns):
+    frame = pd.DataFrame({'timestamp': pd.to_datetime(np.asarray(timestamps, dtype=np.int64), unit='ns', utc=True)})
+    frame['node'] = node_name
+    for key, values, is_float in columns:
+        frame[key] = values if is_float.any() else values.astype(np.int64)
+    return frame
+
+def write_entries(output_path, node_name, timestamps, columns, output_format='json'):
+    write_frame(entries_frame(node_name, timestamps, columns), output_path, output_format)
+
+def process_logs(input_folder, output_folder, output_format='json'):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    
+
     for filename in os.listdir(input_folder):
         input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, f"{filename}.json")
-        
+        output_path = os.path.join(output_folder, f"{filename}.{output_format}")
+
         if os.path.isfile(input_path):
-            parse_log_file(input_path, output_path)
-            print(f"Converted {filename} to JSON.")
+            if is_binary_log(input_path):
+                parse_binary_file(input_path, output_path, output_format)
+            else:
+                parse_log_file(input_path, output_path, output_format)
+            print(f"Converted {filename} to {output_format.upper()}.")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python convert_dstat_log.py <input_folder> <output_folder>")
-        sys.exit(1)
-    
-    input_folder = sys.argv[1]
-    output_folder = sys.argv[2]
-    process_logs(input_folder, output_folder)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Convert dstat logs (text or --output-bin) to JSON, NDJSON or Parquet')
+    parser.add_argument('input_folder', type=str, help='Folder with the srun_dstat_<node> logs')
+    parser.add_argument('output_folder', type=str, help='Folder for the converted files')
+    parser.add_argument('-f', '--format', type=str, choices=OUTPUT_FORMATS, default='json', help='Output format')
+    args = parser.parse_args()
+
+    process_logs(args.input_folder, args.output_folder, args.format)
@@ -1,16 +1,9 @@
 import os
-import json
-import sys
 import re
-from datetime import datetime, timezone
-
-def convert_nanoseconds_to_iso(milliseconds):
-    # Convert milliseconds to seconds
-    seconds = milliseconds / 1000  # Change this line to divide by 1000
-    # Create a datetime object from the seconds
-    dt = datetime.fromtimestamp(seconds, tz=timezone.utc)
-    # Convert to ISO 8601 format
-    return dt.isoformat()
+import argparse
+import numpy as np
+import pandas as pd
+from convert_dstat_log import OUTPUT_FORMATS, write_frame
 
 def sanitize_key(key):
     """Convert header names to valid JSON keys"""
@@ -18,69 +11,116 @@ def sanitize_key(key):
     key = re.sub(r'_+', '_', key)
     return key.rstrip('_')
 
-def parse_gpu_log_file(log_file, output_json):
-    """Process a single NVIDIA-SMI log file"""
-    entries = []
-    
+# Timestamp column written by the awk filter of the run scripts (epoch in ms)
+TIMESTAMP_KEY = 'timestamp_ms'
+
+# Without nounits nvidia-smi writes the unit after the value ("45 %", "1234 MiB", "250.00 W", "1410 MHz")
+VALUE_WITH_UNIT = r'^([-+]?(?:\d+(?:\.\d*)?|\.\d+))\s*(%|KiB|MiB|GiB|W|MHz)?$'
+
+def resolve_column(raw_key, text):
+    """Key, values and float mask of a column, the unit suffixes removed. Columns without any number
+    (name, uuid, ...) are kept as strings, with a None float mask"""
+    numbers = pd.to_numeric(text, errors='coerce')
+    unit = None
+    # Only the values pandas could not read go through the regex
+    pending = numbers.isna().to_numpy()
+    if pending.any():
+        parts = text[pending].str.extract(VALUE_WITH_UNIT)
+        numbers[pending] = pd.to_numeric(parts[0], errors='coerce')
+        units = parts[1].dropna().unique()
+        if len(units):
+            unit = units[0]
+    if numbers.isna().all() and text.notna().any():
+        return sanitize_key(raw_key), text.to_numpy(dtype=object), None
+
+    # The unit goes in the key, as for the header units ("memory.total [MiB]" -> memory_total_mib)
+    if unit is not None and '[' not in raw_key:
+        raw_key = f"{raw_key} [{unit}]"
+    values = numbers.to_numpy(dtype=np.float64)
+    # Values are ints unless nvidia-smi wrote a decimal point, missing values ([N/A]) are NaN
+    is_float = text.str.contains('.', regex=False).to_numpy(dtype=bool) | np.isnan(values)
+    return sanitize_key(raw_key), values, is_float
+
+def read_gpu_log(log_file):
+    """Read a NVIDIA-SMI log: returns the node, the timestamps (ms), the GPU index of every line and the
+    (key, values, is_float) of the other columns, or None for an empty file"""
+    # Extract node name from filename (srun_nvidia_<node>.log -> <node>)
+    node_name = os.path.splitext(os.path.basename(log_file))[0].split('_')[2]
+
     with open(log_file, 'r') as infile:
-        # Extract node name from filename (nvidia_<node>.csv -> <node>)
-        
-        node_name = os.path.splitext(os.path.basename(log_file))[0].split('_')[2]
-        
-        # Process header line
         header = infile.readline().strip()
         if not header:
-            return  # Empty file
-        
+            return None  # Empty file
         raw_keys = [col.strip() for col in header.split(',')]
-        keys = [sanitize_key(k) for k in raw_keys]
-        
-        # Process data lines
-        for line in infile:
-            line = line.strip()
-            if not line:
-                continue
-                
-            values = [v.strip() for v in line.split(',')]
-            if len(values) != len(keys):
-                continue  # Skip malformed lines
-                
-            entry = {'node': node_name}
-            for key, value in zip(keys, values):
-                if key == 'timestamp_ms':
-                    entry['timestamp'] = convert_nanoseconds_to_iso(int(value))
-                else:
-                    try:
-                        entry[key] = float(value) if '.' in value else int(value)
-                    except ValueError:
-                        entry[key] = value
-                        
-            entries.append(entry)
-    
-    with open(output_json, 'w') as outfile:
-        json.dump(entries, outfile, indent=2)
-
-def process_logs(input_folder, output_folder):
+        # Lines with too many values are skipped by read_csv, the ones with too few (a line cut short,
+        # an error message of nvidia-smi) have missing cells and are dropped below
+        frame = pd.read_csv(infile, header=None, names=range(len(raw_keys)), dtype=str, skipinitialspace=True,
+                            on_bad_lines='skip', engine='c')
+    frame = frame.apply(lambda column: column.str.strip())
+
+    keys = [sanitize_key(k) for k in raw_keys]
+    if TIMESTAMP_KEY not in keys:
+        raise ValueError(f"{log_file}: no '{TIMESTAMP_KEY}' column in the header")
+    timestamp_index = keys.index(TIMESTAMP_KEY)
+    timestamps = pd.to_numeric(frame[timestamp_index], errors='coerce')
+    frame = frame[frame.notna().all(axis=1).to_numpy() & timestamps.notna().to_numpy()].reset_index(drop=True)
+    timestamps = pd.to_numeric(frame[timestamp_index]).to_numpy(dtype=np.int64)
+
+    columns = [resolve_column(raw_key, frame[i]) for i, raw_key in enumerate(raw_keys) if i != timestamp_index]
+
+    # nvidia-smi writes one line per GPU at every timestamp, in index order, unless the index is queried
+    queried = [values for key, values, is_float in columns if key == 'index' and is_float is not None]
+    if queried:
+        gpus = queried[0].astype(np.int64)
+        columns = [column for column in columns if column[0] != 'index']
+    else:
+        lines = np.arange(len(timestamps))
+        first = np.r_[True, timestamps[1:] != timestamps[:-1]]
+        gpus = lines - np.maximum.accumulate(np.where(first, lines, 0))
+    return node_name, timestamps, gpus, columns
+
+def write_gpu_entries(output_path, node_name, timestamps, gpus, columns, output_format='json'):
+    """Write the entries as a JSON list, one JSON entry per line (ndjson) or a Parquet table"""
+    # Timestamps in ns like the dstat tables, so that both can be joined on the timestamp
+    frame = pd.DataFrame({'node': node_name,
+                          'timestamp': pd.to_datetime(timestamps * 1_000_000, unit='ns', utc=True),
+                          'gpu': gpus})
+    for key, values, is_float in columns:
+        if is_float is None or is_float.any():
+            frame[key] = values
+        else:
+            frame[key] = values.astype(np.int64)
+    write_frame(frame, output_path, output_format)
+
+def parse_gpu_log_file(log_file, output_path, output_format='json'):
+    """Process a single NVIDIA-SMI log file"""
+    parsed = read_gpu_log(log_file)
+    if parsed is None:
+        return  # Empty file
+    node_name, timestamps, gpus, columns = parsed
+    write_gpu_entries(output_path, node_name, timestamps, gpus, columns, output_format)
+
+def process_logs(input_folder, output_folder, output_format='json'):
     """Process all log files in input folder"""
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    
+
     for filename in os.listdir(input_folder):
         if filename.startswith('.'):
             continue  # Skip hidden files
-        
+
         input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, f"{os.path.splitext(filename)[0]}.json")
-        
+        output_path = os.path.join(output_folder, f"{os.path.splitext(filename)[0]}.{output_format}")
+
         if os.path.isfile(input_path):
-            parse_gpu_log_file(input_path, output_path)
-            print(f"Converted {filename} to JSON")
+            parse_gpu_log_file(input_path, output_path, output_format)
+            print(f"Converted {filename} to {output_format.upper()}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python convert_nvidia_logs.py <input_folder> <output_folder>")
-        sys.exit(1)
-    
-    input_folder = sys.argv[1]
-    output_folder = sys.argv[2]
-    process_logs(input_folder, output_folder)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Convert NVIDIA-SMI logs to JSON, NDJSON or Parquet')
+    parser.add_argument('input_folder', type=str, help='Folder with the srun_nvidia_<node> logs')
+    parser.add_argument('output_folder', type=str, help='Folder for the converted files')
+    parser.add_argument('-f', '--format', type=str, choices=OUTPUT_FORMATS, default='json', help='Output format')
+    args = parser.parse_args()
+
+    process_logs(args.input_folder, args.output_folder, args.format)
@@ -0,0 +1,291 @@
+import os
+import json
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+
+#### Clock alignment across the nodes of a session
+# Each node stamps its traces and dstat samples with its own clock. The offset of every node to a
+# reference node is estimated from anchors the nodes share:
+#   - bursts: barrier-like phases make all the nodes issue syscalls at the same moment, the lag that best
+#     lines up the per-node event rates (cross-correlation over FFT) is the offset. It is estimated on
+#     several segments of the run and a line fitted through them also gives the drift.
+#   - start: srun starts the collectors together, so the first dstat sample (or the first traced event)
+#     of every node marks the same instant. Periodic bursts (a barrier every second) correlate at every
+#     multiple of their period, so among the near-maximal correlation peaks the one nearest the start
+#     offset is taken. The start offset is used alone when the bursts do not correlate or no burst peak
+#     agrees with it.
+# offset = node clock - reference clock, and the corrected timestamp is timestamp - offset(timestamp).
+# The offsets are kept in the session_metadata.json of the run folder and applied on loading.
+
+SESSION_METADATA = 'session_metadata.json'
+
+BURST_RESOLUTION_NS = 10 * 10**6   # Event rates are counted in 10 ms bins
+MAX_OFFSET_NS = 5 * 10**9          # Lags searched on each side
+MIN_CORRELATION = 0.3              # Below it a segment does not count as a shared burst
+SEGMENT_NS = 600 * 10**9           # One offset estimate every 10 min of run for the drift
+MAX_SEGMENTS = 6
+NEAR_PEAK = 0.8                    # Correlation peaks above NEAR_PEAK * highest peak are candidates
+MAX_START_DISAGREEMENT_NS = 500 * 10**6  # Further from the start offset a burst offset is not trusted
+
+
+def short_node(name):
+    return str(name).split('.', 1)[0]
+
+
+# int64 ns since the epoch from ISO strings, datetimes or raw ns
+def to_nanoseconds(values):
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.int64)
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values, format='ISO8601', utc=True)
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+#### Estimation
+
+def event_rate(timestamps, start, bins, resolution):
+    positions = (timestamps[(timestamps >= start) & (timestamps < start + bins * resolution)] - start) // resolution
+    return np.bincount(positions, minlength=bins).astype(np.float64)
+
+
+# Lag (in bins, sub-bin by parabolic interpolation) of signal against reference and the normalized
+# correlation at that lag, None when one of them is flat. With an expected lag, the near-maximal peak
+# nearest to it is taken instead of the highest one.
+def correlation_lag(reference, signal, max_lag, expected=None):
+    reference = reference - reference.mean()
+    signal = signal - signal.mean()
+    norm = np.sqrt((reference ** 2).sum() * (signal ** 2).sum())
+    if norm == 0:
+        return None, 0.0
+
+    # Padded so that lags up to max_lag do not wrap around: corr[k] = sum_t reference[t] * signal[t + k]
+    size = 1 << int(np.ceil(np.log2(len(reference) + max_lag + 1)))
+    corr = np.fft.irfft(np.fft.rfft(signal, size) * np.conj(np.fft.rfft(reference, size)), size)
+    lags = np.arange(-max_lag, max_lag + 1)
+    values = corr[lags]
+    best = np.argmax(values)
+    if expected is not None:
+        peaks = np.flatnonzero((values >= NEAR_PEAK * values[best])
+                               & (values >= np.r_[-np.inf, values[:-1]]) & (values >= np.r_[values[1:], -np.inf]))
+        best = peaks[np.argmin(np.abs(lags[peaks] - expected))]
+    lag = lags[best]
+
+    before, peak, after = corr[lag - 1], corr[lag], corr[(lag + 1) % size]
+    curvature = before - 2 * peak + after
+    refinement = 0.5 * (before - after) / curvature if curvature < 0 else 0.0
+    return lag + refinement, peak / norm
+
+
+# (middle of the segment, offset, correlation) of every segment both nodes have events in
+def segment_offsets(reference, timestamps, resolution=BURST_RESOLUTION_NS, max_offset=MAX_OFFSET_NS, expected_offset=None):
+    start, end = max(reference[0], timestamps[0]), min(reference[-1], timestamps[-1])
+    if end - start < 2 * max_offset:
+        return []
+
+    expected = expected_offset / resolution if expected_offset is not None else None
+    count = int(np.clip((end - start) // SEGMENT_NS, 1, MAX_SEGMENTS))
+    edges = np.linspace(start, end, count + 1).astype(np.int64)
+    results = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        bins = int((high - low) // resolution)
+        lag, correlation = correlation_lag(event_rate(reference, low, bins, resolution),
+                                           event_rate(timestamps, low, bins, resolution), max_offset // resolution, expected)
+        if lag is not None:
+            results.append(((low + high) // 2, lag * resolution, correlation))
+    return results
+
+
+# events: {node: sorted int64 ns timestamps}, starts: {node: first sample ns} (defaults to the first event)
+def estimate_clock_offsets(events, starts=None, reference=None, resolution=BURST_RESOLUTION_NS,
+                           max_offset=MAX_OFFSET_NS, min_correlation=MIN_CORRELATION, debug=False):
+    starts = dict(starts or {})
+    for node, timestamps in events.items():
+        if node not in starts and len(timestamps):
+            starts[node] = int(timestamps[0])
+    nodes = sorted(set(events) | set(starts))
+    if not nodes:
+        return {'reference_node': None, 'offsets': {}}
+    if reference is None:
+        reference = max(nodes, key=lambda node: len(events.get(node, ())))
+
+    offsets = {reference: {'offset_ns': 0, 'anchor_ns': starts.get(reference, 0), 'drift_ppm': 0.0, 'method': 'reference'}}
+    for node in nodes:
+        if node == reference:
+            continue
+        start_offset = starts[node] - starts[reference] if node in starts and reference in starts else None
+
+        segments = []
+        if len(events.get(node, ())) and len(events.get(reference, ())):
+            segments = [s for s in segment_offsets(events[reference], events[node], resolution, max_offset, start_offset)
+                        if s[2] >= min_correlation]
+        # A burst peak far from the start offset lines up the wrong bursts
+        if start_offset is not None:
+            segments = [s for s in segments if abs(s[1] - start_offset) <= MAX_START_DISAGREEMENT_NS]
+
+        if segments:
+            times = np.array([s[0] for s in segments], dtype=np.int64)
+            values = np.array([s[1] for s in segments])
+            anchor = int(times[0])
+            if len(segments) > 1:
+                drift, offset = np.polyfit((times - anchor).astype(np.float64), values, 1)
+            else:
+                drift, offset = 0.0, values[0]
+            offsets[node] = {'offset_ns': int(round(offset)), 'anchor_ns': anchor, 'drift_ppm': float(drift * 1e6),
+                             'method': 'bursts', 'correlation': float(np.mean([s[2] for s in segments])),
+                             'segments': len(segments), 'start_offset_ns': start_offset}
+        elif start_offset is not None:
+            offsets[node] = {'offset_ns': int(start_offset), 'anchor_ns': int(starts[node]), 'drift_ppm': 0.0, 'method': 'start'}
+        else:
+            offsets[node] = {'offset_ns': 0, 'anchor_ns': 0, 'drift_ppm': 0.0, 'method': 'none'}
+
+        if debug:
+            logging.info(f"Clock offset of {node} to {reference}: {offsets[node]['offset_ns'] / 1e6:.3f} ms "
+                         f"({offsets[node]['method']}, drift {offsets[node]['drift_ppm']:.2f} ppm)")
+
+    return {'reference_node': reference, 'resolution_ns': resolution, 'max_offset_ns': max_offset, 'offsets': offsets}
+
+
+#### Session metadata
+
+def session_metadata_path(path):
+    return os.path.join(path, SESSION_METADATA) if os.path.isdir(path) else path
+
+
+def save_clock_offsets(path, alignment):
+    path = session_metadata_path(path)
+    metadata = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            metadata = json.load(f)
+    metadata['clock_alignment'] = dict(alignment, created=pd.Timestamp.now(tz='UTC').isoformat())
+    with open(path, 'w') as f:
+        json.dump(metadata, f, indent=4)
+    return path
+
+
+# Offsets by node from a session_metadata.json (or the run folder holding it), {} when there are none
+def load_clock_offsets(path):
+    path = session_metadata_path(path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f).get('clock_alignment', {}).get('offsets', {})
+
+
+#### Correction
+
+# Offset (ns) of every row at its own timestamp, 0 for the nodes without one
+def clock_offsets_ns(nodes, timestamps, offsets):
+    known = {short_node(node): model for node, model in offsets.items()}
+    nodes = pd.Series(nodes).astype('category')
+    models = [known.get(short_node(node), {}) for node in nodes.cat.categories] + [{}]
+    base, anchor, drift = (np.array([model.get(key, 0) for model in models], dtype=dtype)
+                           for key, dtype in (('offset_ns', np.int64), ('anchor_ns', np.int64), ('drift_ppm', np.float64)))
+
+    # Code -1 (missing node) picks the empty model appended at the end
+    codes = nodes.cat.codes.to_numpy()
+    correction = base[codes]
+    drifting = drift[codes] != 0
+    if drifting.any():
+        elapsed = (timestamps[drifting] - anchor[codes][drifting]).astype(np.float64)
+        correction[drifting] += np.rint(drift[codes][drifting] * 1e-6 * elapsed).astype(np.int64)
+    return correction
+
+
+def apply_clock_offsets(df, offsets, column='timestamp'):
+    if not offsets or df.empty or 'node' not in df.columns:
+        return df
+    values = df[column]
+    tz = values.dt.tz if pd.api.types.is_datetime64_any_dtype(values) else None
+    timestamps = to_nanoseconds(values)
+    corrected = pd.to_datetime(timestamps - clock_offsets_ns(df['node'], timestamps, offsets), unit='ns')
+    df[column] = corrected.tz_localize('UTC').tz_convert(tz) if tz is not None else corrected
+    return df
+
+
+# Trace entries (dicts with an ISO 'timestamp' and a 'node', as in the converted tracer files) corrected
+# in place, the timestamps written back in the same ISO format (us precision, UTC offset)
+def correct_entries(entries, offsets):
+    stamped = [entry for entry in entries if entry.get('timestamp')]
+    if not offsets or not stamped:
+        return entries
+    frame = pd.DataFrame({'timestamp': [entry['timestamp'] for entry in stamped],
+                          'node': [entry.get('node') for entry in stamped]})
+    corrected = apply_clock_offsets(frame, offsets)['timestamp'].dt.round('us').dt.tz_localize('UTC')
+    for entry, timestamp in zip(stamped, corrected):
+        entry['timestamp'] = timestamp.isoformat()
+    return entries
+
+
+#### Readers for the converted logs of a run
+
+def read_trace_timestamps(folder):
+    frames = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith('.json'):
+            with open(os.path.join(folder, filename), 'r') as f:
+                frames.append(pd.DataFrame(json.load(f), columns=['timestamp', 'node']))
+    if not frames:
+        return {}
+    events = pd.concat(frames, ignore_index=True).dropna()
+    timestamps = to_nanoseconds(events['timestamp'])
+    nodes = events['node'].map(short_node).to_numpy()
+    return {node: np.sort(timestamps[nodes == node]) for node in pd.unique(nodes)}
+
+
+# First sample of every node in the converted dstat logs (Parquet, NDJSON or JSON)
+def read_first_samples(folder):
+    starts = {}
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if filename.endswith('.parquet'):
+            samples = pd.read_parquet(path, columns=['timestamp', 'node'])
+        elif filename.endswith('.ndjson'):
+            samples = pd.read_json(path, lines=True, convert_dates=False, dtype=False)
+        elif filename.endswith('.json'):
+            with open(path, 'r') as f:
+                samples = pd.DataFrame(json.load(f), columns=['timestamp', 'node'])
+        else:
+            continue
+        if samples.empty:
+            continue
+        timestamps = to_nanoseconds(samples['timestamp'])
+        for node, first in pd.Series(timestamps).groupby(samples['node'].map(short_node).to_numpy()).min().items():
+            starts[node] = min(starts.get(node, first), int(first))
+    return starts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate the clock offsets of the nodes of a run and store them in its session metadata')
+    parser.add_argument('run_dir', type=str, help='Converted run folder (with tracer and dstat subfolders)')
+    parser.add_argument('--tracer', type=str, help='Converted tracer folder (default: <run_dir>/tracer)')
+    parser.add_argument('--dstat', type=str, help='Converted dstat folder (default: <run_dir>/dstat)')
+    parser.add_argument('--reference', type=str, help='Reference node (default: the node with most events)')
+    parser.add_argument('--resolution_ms', type=float, default=BURST_RESOLUTION_NS / 1e6, help='Bin size of the event rates')
+    parser.add_argument('--max_offset_ms', type=float, default=MAX_OFFSET_NS / 1e6, help='Largest offset searched')
+    parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    tracer_dir = args.tracer or os.path.join(args.run_dir, 'tracer')
+    dstat_dir = args.dstat or os.path.join(args.run_dir, 'dstat')
+    events = read_trace_timestamps(tracer_dir) if os.path.isdir(tracer_dir) else {}
+    starts = read_first_samples(dstat_dir) if os.path.isdir(dstat_dir) else {}
+
+    alignment = estimate_clock_offsets(events, starts, short_node(args.reference) if args.reference else None,
+                                       int(args.resolution_ms * 1e6), int(args.max_offset_ms * 1e6), debug=args.debug)
+    path = save_clock_offsets(args.run_dir, alignment)
+    for node, model in alignment['offsets'].items():
+        logging.info(f"{node}: {model['offset_ns'] / 1e6:.3f} ms ({model['method']})")
+    logging.info(f"Clock offsets written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,12 +16,17 @@ from model_evaluation import *
 def prepare_encoded_matrix(app, case, run, situation, type_enc, app_enc, label_enc, num_predictions, debug, is_train):
     
     if is_train:
-        data = load_training_data(base_dir, app, case, run, situation, debug, ALL_APPLICATIONS)
+        data = load_training_data(base_dir, app, case, run, situation, debug, N, ALL_APPLICATIONS, type_enc, app_enc, label_enc)
     else:
         data = load_timeseries_data(base_dir, app, case, run, debug)
     
     data = preprocessing(data, N, type_enc, app_enc, label_enc)
-    data = data.sort_values(by='relative_time')
+
+    # Add relative_time column (in seconds), grouped by run_number
+    data['relative_time'] = data.groupby('run_number')['timestamp'].transform(
+        lambda x: (x - x.min()).dt.total_seconds().astype(int)
+    )
+    data = data.sort_values(by=['run_number', 'relative_time'], kind='stable')
 
     if debug:
         logging.info("Build systemcall matrix")
@@ -63,6 +68,8 @@ def main():
     parser.add_argument('-n', '--num_predictions', type=int, required=True)
     parser.add_argument('-o', '--output', type=str, help='Output prefix for plot and CSV')
     parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('-t', '--tables_only', action='store_true', help='Only write the follow-up tables, no plots')
+    parser.add_argument('-w', '--plot_workers', type=int, default=None, help='Processes rendering the plots (default: all CPUs)')
 
     args = parser.parse_args()
 
@@ -83,8 +90,6 @@ def main():
     train_decoded_matrix = prepare_encoded_matrix(app_base, case_base, run_base, situation_base, type_enc, app_enc, label_enc, num_predictions, debug_base, True)
     test_decoded_matrix = prepare_encoded_matrix(app_base, case_base, run_base, situation_base, type_enc, app_enc, label_enc, num_predictions, debug_base, False)
     
-    unique_sequences_by_type = {}
-
     for type_matrix,decoded_matrix in [('train',train_decoded_matrix), ('test',test_decoded_matrix)]:
         
         # Plot and save
@@ -92,28 +97,35 @@ def main():
             logging.info("Save results")
         save_decoded_matrix(decoded_matrix, output_folder, type_matrix)
 
-        for call in ALL_SYSTEMCALLS:
-            plot_syscall_followups(decoded_matrix, call, output_folder, type_matrix)
+        plot_all_syscall_followups(decoded_matrix, ALL_SYSTEMCALLS, output_folder, type_matrix,
+                                   workers=args.plot_workers, tables_only=args.tables_only)
 
 
         if debug_base:
             logging.info("Get unique next 10 sequences")
-        unique_next10_seqs = get_unique_next10_sequences(decoded_matrix, type_matrix, output_folder)
-        unique_sequences_by_type[type_matrix] = unique_next10_seqs
+        get_unique_next10_sequences(decoded_matrix, type_matrix, output_folder)
         
     
-    # Compare test vs train
-    test_only_sequences = unique_sequences_by_type['test'] - unique_sequences_by_type['train']
+    # Compare test vs train on one index per matrix, sharing the syscall vocabulary
+    pred_cols = sorted([col for col in test_decoded_matrix.columns if col.startswith('pred_') and col != 'pred_0'])
+    (train_index, test_index), labels = index_matrices([train_decoded_matrix, test_decoded_matrix], pred_cols)
+    test_only, _ = test_index.difference(train_index)
+    test_only_sequences = set(map(tuple, labels[test_only].tolist()))
 
     if debug_base:
         logging.info("\nSequences in TEST but not in TRAIN:")
         logging.info(f"Count: {len(test_only_sequences)}")
+        logging.info(f"Test windows covered by train: {test_index.coverage(train_index):.4f}")
 
     res_path = os.path.join(output_folder, f"squences_in_test_but_not_in_train.txt")
     with open(res_path, 'w') as f:
         for seq in sorted(test_only_sequences):
             f.write(f"{seq}\n")
 
+    # Frequencies of the unique sequences of each matrix
+    for type_matrix, index in [('train', train_index), ('test', test_index)]:
+        index.to_frame(labels).to_csv(os.path.join(output_folder, f"sequence_counts_{type_matrix}.csv"), index=False)
+
 
 if __name__ == "__main__":
     main()
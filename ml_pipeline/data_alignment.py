@@ -0,0 +1,203 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import logging
+from data_gathering import *
+
+
+#### As-of join of the syscall traces with the dstat and GPU samples of the same run
+# Every event (or aggregated window) gets the last sample taken at or before its timestamp on its node.
+# Both sides are sorted by timestamp (the converters already write them in order, so the sort is
+# skipped) and joined with one pd.merge_asof pass per source, linear in events + samples.
+
+# dstat and nvidia-smi sample every second, an older sample means the collector stopped
+SAMPLE_TOLERANCE = pd.Timedelta(seconds=5)
+
+# Converted logs, when one log was converted to several formats the first one is read
+SAMPLE_FORMATS = ('.parquet', '.ndjson', '.json')
+
+
+def _naive_timestamps(values):
+    values = pd.Series(values)
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.to_numpy(dtype='datetime64[ns]')
+
+
+# Host names without the domain, so "c204-001" and "c204-001.frontera.tacc.utexas.edu" are the same node
+def _short_node_names(nodes):
+    nodes = pd.Series(nodes).astype('category')
+    names = nodes.cat.categories.astype(str).str.split('.', n=1).str[0].to_numpy(dtype=object)
+    # Code -1 (missing node) picks the None appended at the end
+    return np.append(names, None)[nodes.cat.codes.to_numpy()]
+
+
+#### Loaders for the converted dstat (convert_dstat_log.py) and nvidia (convert_nvidia_to_json.py) logs
+
+def read_sample_file(path):
+    if path.endswith('.parquet'):
+        frame = pd.read_parquet(path)
+    elif path.endswith('.ndjson'):
+        frame = pd.read_json(path, lines=True, convert_dates=False, dtype=False)
+    else:
+        with open(path, 'r') as file:
+            frame = pd.DataFrame(json.load(file))
+
+    if not frame.empty:
+        frame['timestamp'] = parse_timestamps(frame['timestamp'])
+    return frame
+
+
+def load_samples(folder, debug=False):
+    files = {}
+    for filename in sorted(os.listdir(folder)):
+        stem, extension = os.path.splitext(filename)
+        if extension in SAMPLE_FORMATS:
+            files.setdefault(stem, []).append(filename)
+
+    frames = []
+    for stem, names in files.items():
+        filename = min(names, key=lambda name: SAMPLE_FORMATS.index(os.path.splitext(name)[1]))
+        frame = read_sample_file(os.path.join(folder, filename))
+        if frame.empty:
+            continue
+        frames.append(frame)
+        if debug:
+            logging.info(f"Loaded {len(frame)} samples from {filename}")
+
+    if not frames:
+        return pd.DataFrame(columns=['timestamp', 'node'])
+    samples = pd.concat(frames, ignore_index=True)
+    return samples.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+# One row per node and sample, the numeric dstat columns
+def load_dstat_samples(folder, debug=False):
+    samples = load_samples(folder, debug)
+    columns = [c for c in samples.columns if c not in ('timestamp', 'node') and pd.api.types.is_numeric_dtype(samples[c])]
+    return samples[['timestamp', 'node'] + columns]
+
+
+# One row per node and sample, the GPUs side by side (gpu0_utilization_gpu, gpu1_utilization_gpu, ...)
+def load_gpu_samples(folder, debug=False):
+    samples = load_samples(folder, debug)
+    if samples.empty:
+        return samples
+
+    # JSON converted before the gpu index existed: the GPUs of a timestamp are written in index order
+    if 'gpu' not in samples.columns:
+        samples['gpu'] = samples.groupby(['node', 'timestamp'], sort=False).cumcount()
+    fields = [c for c in samples.columns if c not in ('timestamp', 'node', 'gpu') and pd.api.types.is_numeric_dtype(samples[c])]
+
+    samples = samples.drop_duplicates(['node', 'timestamp', 'gpu'], keep='last')
+    wide = samples.set_index(['node', 'timestamp', 'gpu'])[fields].unstack('gpu')
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([fields, sorted(samples['gpu'].unique())]))
+    wide = wide[sorted(wide.columns, key=lambda column: (column[1], fields.index(column[0])))]
+    wide.columns = [f'gpu{gpu}_{field}' for field, gpu in wide.columns]
+    wide = wide.reset_index()
+    return wide.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+# Samples on the same clock as load_timeseries_data: the offsets of the session metadata are applied too
+def load_run_samples(base_dir, base_app, case_name, run_number, debug=False, clock_correction=True):
+    run_dir = os.path.join(base_dir, base_app, case_name, str(run_number))
+    dstat_dir, nvidia_dir = os.path.join(run_dir, 'dstat'), os.path.join(run_dir, 'nvidia')
+    dstat = load_dstat_samples(dstat_dir, debug) if os.path.isdir(dstat_dir) else None
+    gpu = load_gpu_samples(nvidia_dir, debug) if os.path.isdir(nvidia_dir) else None
+
+    offsets = load_clock_offsets(run_dir) if clock_correction else {}
+    for samples in (dstat, gpu):
+        if offsets and samples is not None and not samples.empty:
+            apply_clock_offsets(samples, offsets)
+            samples.sort_values('timestamp', kind='stable', inplace=True, ignore_index=True)
+    return dstat, gpu
+
+
+#### Join engine
+
+# Columns of the last sample of the same node taken at or before each event, as a frame with the index
+# of events. age_column (seconds since that sample) lets the caller filter stale context.
+def asof_samples(events, samples, prefix='', tolerance=SAMPLE_TOLERANCE, by_node=True, age_column=None):
+    sample_columns = [c for c in samples.columns if c not in ('timestamp', 'node')]
+    names = {c: prefix + c for c in sample_columns}
+
+    left = pd.DataFrame({'timestamp': _naive_timestamps(events['timestamp']), '_row': np.arange(len(events))})
+    right = samples[['timestamp'] + sample_columns].rename(columns=names)
+    right['timestamp'] = _naive_timestamps(right['timestamp'])
+    right['_sample_time'] = right['timestamp']
+
+    by = None
+    if by_node:
+        # Both sides share one integer code per node, events of a node without samples get nothing
+        codes, _ = pd.factorize(np.concatenate([_short_node_names(events['node']), _short_node_names(samples['node'])]))
+        left['_node'], right['_node'] = codes[:len(left)], codes[len(left):]
+        right = right[right['_node'] >= 0]
+        by = '_node'
+
+    # merge_asof refuses null keys: events without a timestamp get no sample, samples without one are dropped
+    unstamped_events, unstamped_samples = left['timestamp'].isna(), right['timestamp'].isna()
+    if unstamped_events.any():
+        logging.warning(f"{unstamped_events.sum()} events without a timestamp left out of the {prefix or 'sample'} join")
+        left = left[~unstamped_events]
+    if unstamped_samples.any():
+        logging.warning(f"{unstamped_samples.sum()} samples without a timestamp left out of the {prefix or 'sample'} join")
+        right = right[~unstamped_samples]
+
+    if not left['timestamp'].is_monotonic_increasing:
+        left = left.sort_values('timestamp', kind='stable')
+    if not right['timestamp'].is_monotonic_increasing:
+        right = right.sort_values('timestamp', kind='stable')
+
+    merged = pd.merge_asof(left, right, on='timestamp', by=by, direction='backward', tolerance=tolerance)
+    if len(merged) == len(events) and merged['_row'].is_monotonic_increasing:
+        attached = merged
+    else:
+        attached = merged.set_index('_row').reindex(np.arange(len(events)))
+    result = pd.DataFrame({names[c]: attached[names[c]].to_numpy() for c in sample_columns}, index=events.index)
+    if age_column is not None:
+        result[age_column] = (attached['timestamp'] - attached['_sample_time']).dt.total_seconds().to_numpy()
+    return result
+
+
+# Events (syscalls or windows that have a node) with the dstat and GPU context of their node
+def align_events(events, dstat=None, gpu=None, tolerance=SAMPLE_TOLERANCE, debug=False):
+    parts = [events]
+    if dstat is not None and not dstat.empty:
+        parts.append(asof_samples(events, dstat, 'dstat_', tolerance, age_column='dstat_age_s'))
+    if gpu is not None and not gpu.empty:
+        parts.append(asof_samples(events, gpu, '', tolerance, age_column='gpu_age_s'))
+    aligned = pd.concat(parts, axis=1)
+
+    if debug:
+        for column in ('dstat_age_s', 'gpu_age_s'):
+            if column in aligned.columns:
+                logging.info(f"{column}: {aligned[column].notna().mean() * 100:.1f}% of the events have a sample")
+    return aligned
+
+
+# Windows aggregated over all the nodes (aggregate_windows output): for every node the last sample before
+# the end of the window, averaged over the nodes
+def align_windows(windows, window_size_sec, dstat=None, gpu=None, tolerance=SAMPLE_TOLERANCE, debug=False):
+    if 'node' in windows.columns:
+        return align_events(windows, dstat, gpu, tolerance, debug)
+
+    ends = _naive_timestamps(windows['timestamp']) + (pd.Timedelta(seconds=window_size_sec) - pd.Timedelta(1, 'ns')).to_timedelta64()
+    parts = [windows]
+    for samples, prefix, age_column in ((dstat, 'dstat_', 'dstat_age_s'), (gpu, '', 'gpu_age_s')):
+        if samples is None or samples.empty:
+            continue
+        nodes = pd.unique(_short_node_names(samples['node']))
+        grid = pd.DataFrame({
+            'timestamp': np.repeat(ends, len(nodes)),
+            'node': np.tile(nodes, len(windows)),
+        })
+        attached = asof_samples(grid, samples, prefix, tolerance, age_column=age_column)
+        attached = attached.select_dtypes('number')
+        means = attached.groupby(np.repeat(np.arange(len(windows)), len(nodes))).mean()
+        parts.append(means.reindex(np.arange(len(windows))).set_axis(windows.index))
+    aligned = pd.concat(parts, axis=1)
+
+    if debug:
+        logging.info(f"Aligned {len(windows)} windows with {len(aligned.columns) - len(windows.columns)} context columns")
+    return aligned
@@ -1,31 +1,111 @@
 import pandas as pd
+import numpy as np
 import os
 import logging
 import json
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
 from data_preprocessing import *
+from clock_alignment import load_clock_offsets, apply_clock_offsets
 
 
-#### Auxiliary function to standardize the timestep format
-def standardize_timestamp(ts):
-    # Check if the timestamp has fractional seconds
-    if '+' in ts:
-        # Split the timestamp into the main part and the timezone part
-        main_part, tz_part = ts.split('+')
-        # Check if there are fractional seconds
-        if '.' not in main_part:
-            # Add '.000000' to the main part if missing
-            main_part += '.000000'
-        # Reconstruct the timestamp
-        return main_part + '+' + tz_part
-    return ts  # Return as is if it already has the correct format
+#### Vectorized timestamp ingestion
+# Accepts ISO 8601 strings with or without fractional seconds and raw int nanoseconds (also mixed
+# in one column) and returns timezone-naive UTC datetime64[ns]
+def parse_timestamps(values):
+    values = pd.Series(values)
+
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_datetime(values, unit='ns').astype('datetime64[ns]')
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        timestamps = values
+    else:
+        as_text = values.astype(str)
+        is_numeric = as_text.str.fullmatch(r'\d+')
+        timestamps = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns, UTC]')
+        if is_numeric.any():
+            timestamps[is_numeric] = pd.to_datetime(as_text[is_numeric].astype(np.int64), unit='ns', utc=True)
+        if not is_numeric.all():
+            timestamps[~is_numeric] = pd.to_datetime(values[~is_numeric], format='ISO8601', utc=True)
+
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    return timestamps.astype('datetime64[ns]')
+
+
+#### Typed loading schema, keeps the traces small in memory
+# Low-cardinality strings are stored as categoricals
+CATEGORICAL_COLUMNS = ['systemcall', 'type', 'node', 'application']
+# Paths and return values (ints mixed with strings) repeat a lot, categoricals intern them into one dictionary per column
+INTERNED_COLUMNS = ['path', 'new_path', 'file_path', 'return_value']
+# Integer fields are downcast to the smallest dtype that holds them
+INTEGER_COLUMNS = ['tid', 'pid', 'descriptor', 'offset', 'size', 'node_index', 'run_number']
+
+
+def downcast_integer_column(series):
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+
+    # Integer fields with missing values are loaded as float64, float32 is exact up to 2**24
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna()
+        if values.empty or (values.abs() < 2**24).all():
+            return series.astype(np.float32)
+
+    return series
+
+
+def apply_trace_schema(df):
+    for column in CATEGORICAL_COLUMNS + INTERNED_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = downcast_integer_column(df[column])
+
+    return df
+
+
+#### Concatenate typed frames without losing the categorical dtypes
+def concat_trace_frames(frames):
+    frames = list(frames)
+
+    categorical_columns = {column for df in frames for column in df.columns
+                           if isinstance(df[column].dtype, pd.CategoricalDtype)}
+
+    # pd.concat falls back to object when categories differ, so align them first
+    for column in categorical_columns:
+        categories = None
+        for df in frames:
+            if column in df.columns:
+                column_categories = df[column].astype('category').cat.categories
+                categories = column_categories if categories is None else categories.union(column_categories)
+        for df in frames:
+            if column in df.columns:
+                df[column] = df[column].astype('category').cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+#### Memory report for one stage of the loading pipeline
+def log_memory_usage(df, stage):
+    memory = df.memory_usage(deep=True).sum()
+    per_event = memory / len(df) if len(df) else 0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logging.info(f"[memory] {stage}: {memory / 1024**2:.1f} MiB for {len(df)} events "
+                 f"({per_event:.0f} bytes/event), peak RSS {peak_rss:.0f} MiB")
 
 
 #### Auxiliary setup function to load time series data
-def load_timeseries_data(base_dir, base_app, case_name, run_number, debug=False):
+def load_timeseries_data(base_dir, base_app, case_name, run_number, debug=False, clock_correction=True):
     if debug:
         logging.info(f"Running {base_app} case {case_name} run number {run_number}")
 
-    tracer_dir = os.path.join(base_dir, base_app, case_name, str(run_number), 'tracer')
+    run_dir = os.path.join(base_dir, base_app, case_name, str(run_number))
+    tracer_dir = os.path.join(run_dir, 'tracer')
     data_files = [f for f in os.listdir(tracer_dir) if f.endswith('.json')]
     if not data_files:
         raise ValueError(f"No JSON files found in {tracer_dir}")
@@ -49,27 +129,42 @@ def load_timeseries_data(base_dir, base_app, case_name, run_number, debug=False)
 
             node_set.update(df['node'].unique())
 
-            df['timestamp'] = df['timestamp'].apply(standardize_timestamp)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            df['timestamp'] = parse_timestamps(df['timestamp'])
             df['application'] = base_app
 
+            df = df.dropna(axis=1, how='all')
+            if debug:
+                log_memory_usage(df, f"{f} raw")
+            df = apply_trace_schema(df)
+
             all_series.append(df)
 
             if debug:
                 logging.info(f"Loaded {len(df)} records from {f}")
-        
+                log_memory_usage(df, f"{f} typed")
 
-    all_series = [df.dropna(axis=1, how='all') for df in all_series]
-    combined_df = pd.concat(all_series, ignore_index=True)
+    combined_df = concat_trace_frames(all_series)
+
+    # Node clocks brought to the reference node with the offsets of the session metadata (clock_alignment.py)
+    offsets = load_clock_offsets(run_dir) if clock_correction else {}
+    if offsets:
+        combined_df = apply_clock_offsets(combined_df, offsets)
+        if debug:
+            logging.info(f"Applied the clock offsets of {len(offsets)} nodes")
 
     # combined_df = combined_df.sort_values('timestamp').reset_index(drop=True)
 
     node_list = list(node_set)
     node_mapping = {node: index for index, node in enumerate(node_list)}
-    combined_df['node_index'] = combined_df['node'].map(node_mapping)
+    combined_df['node_index'] = combined_df['node'].map(node_mapping).astype(np.int64)
 
     combined_df['run_number'] = run_number
 
+    combined_df = apply_trace_schema(combined_df)
+
+    if debug:
+        log_memory_usage(combined_df, f"{base_app} case {case_name} run {run_number}")
+
     return combined_df
 
 
@@ -85,35 +180,70 @@ def should_skip(app, case, run, app_base, case_base, run_base, situation_base):
         return True
     return False
 
-def load_training_data(base_dir, app_base, case_base, run_base, situation_base, debug_base, N, ALL_APPLICATIONS, type_enc, app_enc, label_enc):
-    train_data = pd.DataFrame()
-
+def discover_training_units(base_dir, app_base, case_base, run_base, situation_base, ALL_APPLICATIONS):
     if situation_base in ("only", "app"):
-        app = app_base
-        main_folder = os.path.join(base_dir, app)
-        all_cases = get_all_cases(main_folder)
+        apps = [app_base]
+    elif situation_base == "all":
+        apps = ALL_APPLICATIONS
+    else:
+        return []
 
-        for case in all_cases:
+    units = []
+    for app in apps:
+        main_folder = os.path.join(base_dir, app)
+        for case in get_all_cases(main_folder):
             for run in range(1, 4):
                 if should_skip(app, case, run, app_base, case_base, run_base, situation_base):
                     continue
-                data = preprocessing(load_timeseries_data(base_dir, app, case, run, debug=debug_base), N, type_enc, app_enc, label_enc)
-                train_data = pd.concat(
-                    [train_data, data],
-                    ignore_index=True
-                )
+                units.append((app, case, run))
+    return units
 
-    elif situation_base == "all":
-        for app in ALL_APPLICATIONS:
-            main_folder = os.path.join(base_dir, app)
-            all_cases = get_all_cases(main_folder)
-            for case in all_cases:
-                for run in range(1, 4):
-                    if should_skip(app, case, run, app_base, case_base, run_base, situation_base):
-                        continue
-                    train_data = pd.concat(
-                        [train_data, load_timeseries_data(base_dir, app, case, run, debug=debug_base)],
-                        ignore_index=True
-                    )
-
-    return train_data
\ No newline at end of file
+
+#### Worker that loads (and optionally preprocesses) a single (app, case, run) unit
+def load_training_unit(base_dir, unit, debug, N, type_enc, app_enc, label_enc, preprocess):
+    app, case, run = unit
+    start = time.perf_counter()
+
+    data = load_timeseries_data(base_dir, app, case, run, debug=debug)
+    if preprocess:
+        data = preprocessing(data, N, type_enc, app_enc, label_enc)
+
+    elapsed = time.perf_counter() - start
+    memory = data.memory_usage(deep=True).sum()
+    return data, label_enc, elapsed, memory
+
+
+def load_training_data(base_dir, app_base, case_base, run_base, situation_base, debug_base, N, ALL_APPLICATIONS, type_enc, app_enc, label_enc, workers=None):
+    units = discover_training_units(base_dir, app_base, case_base, run_base, situation_base, ALL_APPLICATIONS)
+    if not units:
+        return pd.DataFrame()
+
+    # Only the single-application situations are preprocessed per unit, "all" returns the raw traces
+    preprocess = situation_base in ("only", "app")
+    args = [(base_dir, unit, debug_base, N, type_enc, app_enc, label_enc, preprocess) for unit in units]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(units)))
+
+    if workers == 1:
+        results = [load_training_unit(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load_training_unit, *zip(*args)))
+
+    for (app, case, run), (data, _, elapsed, memory) in zip(units, results):
+        logging.info(f"Loaded {app} case {case} run {run}: {len(data)} rows in {elapsed:.2f}s ({memory / 1024**2:.1f} MiB)")
+
+    # Workers fit their own copy of the label encoder, keep the last one as the serial loop did
+    fitted_enc = results[-1][1]
+    if hasattr(fitted_enc, 'classes_'):
+        label_enc.classes_ = fitted_enc.classes_
+
+    train_data = concat_trace_frames(data for data, _, _, _ in results)
+
+    if debug_base:
+        logging.info(f"Training data: {len(train_data)} rows from {len(units)} runs using {workers} workers")
+        log_memory_usage(train_data, "training set")
+
+    return train_data
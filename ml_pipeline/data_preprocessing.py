@@ -4,7 +4,7 @@ import logging
 from sklearn.preprocessing import MinMaxScaler
 
 
-def preprocessing(base_data, N, type_encoder, application_encoder, label_encoder):
+def preprocessing(base_data, N, type_encoder, application_encoder, label_encoder, fit_encoder=True):
 
     ####### descomment when pipeline case 3  ######
     
@@ -15,7 +15,10 @@ def preprocessing(base_data, N, type_encoder, application_encoder, label_encoder
 
     ###############################################
 
-    base_data['systemcall_encoded'] = label_encoder.fit_transform(base_data['systemcall'])
+    if fit_encoder:
+        base_data['systemcall_encoded'] = label_encoder.fit_transform(base_data['systemcall'])
+    else:
+        base_data['systemcall_encoded'] = encode_systemcalls(base_data['systemcall'], label_encoder)
 
 
     ###### comment when pipeline case 3   ########
@@ -39,6 +42,27 @@ def get_next_systemcalls(base_data, num_predictions, idx):
     return ",".join(map(str, next_calls))
 
 
+# Encode systemcalls with an already fitted label encoder, unseen systemcalls are encoded as -1
+def encode_systemcalls(systemcalls, label_encoder):
+    mapping = {systemcall: code for code, systemcall in enumerate(label_encoder.classes_)}
+    return systemcalls.map(mapping).astype(float).fillna(-1).astype(int)
+
+
+# Vectorized version of get_next_systemcalls for every row at once
+def build_next_systemcalls(systemcall_encoded, num_predictions):
+    codes = np.asarray(systemcall_encoded).astype(str)
+    next_calls = np.full(len(codes), '', dtype=object)
+
+    if len(codes) > 1:
+        next_calls[:-1] = codes[1:]
+    for i in range(2, num_predictions + 1):
+        if len(codes) <= i:
+            break
+        next_calls[:-i] = next_calls[:-i] + ',' + codes[i:]
+
+    return pd.Series(next_calls, index=getattr(systemcall_encoded, 'index', None))
+
+
 def build_systemcall_matrix(data, num_predictions):
     
     syscall_seq = data['systemcall_encoded'].tolist()
@@ -54,110 +78,177 @@ def build_systemcall_matrix(data, num_predictions):
     return matrix_df
 
 
-def preprocessing_aggregate(df, window_size_sec, burst_threshold, debug, is_train):
-    
-    if debug:
-        logging.info("Starting preprocessing_aggregate...")
+# Systemcalls whose size field counts the bytes read or written
+READ_SYSTEMCALLS = ['read', 'pread', 'pread64']
+WRITE_SYSTEMCALLS = ['write', 'pwrite', 'pwrite64']
 
-    df = df.copy()
 
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['timestamp'] = df['timestamp'].dt.tz_localize(None)
+def _column_codes(values, categories=None):
+    if categories is None:
+        categories = sorted(values.dropna().unique())
+    # -1 for missing values and for the values outside categories
+    codes = pd.Index(categories).get_indexer(values)
+    return codes, list(categories)
 
-    if debug:
-        logging.info("Grouping by 'run_number' and timestamp windows...")
 
-    aggregated = []
+def _sum_bins(matrix, groups):
+    # Rows of matrix belong to sorted groups, sum each run of equal groups
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    return np.add.reduceat(matrix, starts, axis=0), groups[starts]
 
-    for run_id, run_group in df.groupby('run_number'):
-        run_group = run_group.set_index('timestamp')
 
-        windowed = run_group.resample(f'{window_size_sec}s').agg({
-            'systemcall': 'count',
-        })
+#### Windowed aggregation engine over the columnar trace
+# Additive features (counts by syscall/type, bytes) are computed once per run at the finest granularity
+# (the gcd of all window sizes) and summed up for each window size; distinct files/pids are reduced to
+# unique (bin, value) pairs once and only those pairs are re-binned per window size.
+# Windows are aligned like DataFrame.resample (midnight of the first day) and empty windows are kept.
+def aggregate_windows(df, window_sizes_sec, systemcalls=None, types=None):
+    window_sizes_sec = sorted(set(int(w) for w in window_sizes_sec))
+    base_sec = int(np.gcd.reduce(window_sizes_sec))
 
-        windowed.rename(columns={'systemcall': 'total_syscalls'}, inplace=True)
-        windowed['timestamp'] = windowed.index
-        
-        windowed['run_number'] = run_id
-        windowed['is_burst'] = windowed['total_syscalls'] >= burst_threshold
+    # Events without a timestamp belong to no window (resample drops them too)
+    unstamped = df['timestamp'].isna()
+    if unstamped.any():
+        logging.warning(f"{unstamped.sum()} events without a timestamp left out of the windows")
+        df = df[~unstamped.to_numpy()]
 
-        if is_train:
-            if debug:
-                logging.info(f"Calculating time to next burst for run {run_id}...")
-            next_burst_time = []
-            burst_times = windowed.loc[windowed['is_burst'], 'timestamp'].values
+    systemcall_codes, systemcall_names = _column_codes(df['systemcall'], systemcalls)
+    if 'type' in df.columns:
+        type_codes, type_names = _column_codes(df['type'], types)
+    else:
+        type_codes, type_names = None, []
 
-            for current_time in windowed['timestamp']:
-                future_bursts = burst_times[burst_times > current_time]
-                if len(future_bursts) > 0:
-                    next_burst_time.append(future_bursts[0] - current_time)
-                else:
-                    next_burst_time.append(pd.Timedelta(seconds=9999))  # Ensures dtype consistency
+    file_column = 'file_path' if 'file_path' in df.columns else 'path' if 'path' in df.columns else None
 
-            windowed['seconds_to_next_burst'] = next_burst_time
-            windowed['seconds_to_next_burst'] = pd.to_timedelta(windowed['seconds_to_next_burst']).dt.total_seconds().astype(int)
+    timestamps = df['timestamp']
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_localize(None)
+    timestamps = timestamps.to_numpy(dtype='datetime64[ns]').astype(np.int64)
 
+    if 'size' in df.columns:
+        sizes = pd.to_numeric(df['size'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        systemcall_values = df['systemcall'].astype(object)
+        bytes_read = np.where(systemcall_values.isin(READ_SYSTEMCALLS).to_numpy(), sizes, 0)
+        bytes_written = np.where(systemcall_values.isin(WRITE_SYSTEMCALLS).to_numpy(), sizes, 0)
+    else:
+        bytes_read = bytes_written = None
+
+    feature_columns = (['total_syscalls']
+                       + [f'syscall_{name}' for name in systemcall_names]
+                       + [f'type_{name}' for name in type_names])
+    if bytes_read is not None:
+        feature_columns += ['bytes_read', 'bytes_written']
+
+    results = {window_size: [] for window_size in window_sizes_sec}
+    run_numbers = df['run_number'].to_numpy()
+
+    for run_id in np.unique(run_numbers):
+        rows = np.flatnonzero(run_numbers == run_id)
+        run_timestamps = timestamps[rows]
+
+        # Bins are counted from midnight of the first day, as resample does by default
+        origin = run_timestamps.min() // (86400 * 10**9) * (86400 * 10**9)
+        base_bin = (run_timestamps - origin) // (base_sec * 10**9)
+        bins, inverse = np.unique(base_bin, return_inverse=True)
+
+        # One pass over the events of the run for every additive feature. total_syscalls counts every
+        # event, the syscalls outside the vocabulary only miss their own syscall_ column
+        run_syscalls = systemcall_codes[rows]
+        valid = run_syscalls >= 0
+        columns = [np.bincount(inverse, minlength=len(bins))]
+        columns.append(np.bincount(inverse[valid] * len(systemcall_names) + run_syscalls[valid],
+                                   minlength=len(bins) * len(systemcall_names)).reshape(len(bins), -1))
+        if type_names:
+            run_types = type_codes[rows]
+            valid_types = run_types >= 0
+            columns.append(np.bincount(inverse[valid_types] * len(type_names) + run_types[valid_types],
+                                       minlength=len(bins) * len(type_names)).reshape(len(bins), -1))
+        if bytes_read is not None:
+            columns.append(np.bincount(inverse, weights=bytes_read[rows], minlength=len(bins)))
+            columns.append(np.bincount(inverse, weights=bytes_written[rows], minlength=len(bins)))
+        base_matrix = np.column_stack([c.reshape(len(bins), -1) for c in columns])
+
+        distinct_pairs = {}
+        for name, column in (('distinct_files', file_column), ('distinct_pids', 'pid' if 'pid' in df.columns else None)):
+            if column is None:
+                continue
+            values = pd.factorize(df[column].to_numpy()[rows], use_na_sentinel=True)[0]
+            keep = values >= 0
+            distinct_pairs[name] = np.unique(np.column_stack([base_bin[keep], values[keep]]), axis=0)
+
+        for window_size in window_sizes_sec:
+            ratio = window_size // base_sec
+            matrix, window_bins = _sum_bins(base_matrix, bins // ratio)
+
+            all_bins = np.arange(window_bins[0], window_bins[-1] + 1)
+            windowed = pd.DataFrame(0.0, index=all_bins, columns=feature_columns)
+            windowed.loc[window_bins, feature_columns] = matrix
+
+            for name, pairs in distinct_pairs.items():
+                window_pairs = np.unique(np.column_stack([pairs[:, 0] // ratio, pairs[:, 1]]), axis=0)
+                window_ids, counts = np.unique(window_pairs[:, 0], return_counts=True)
+                windowed[name] = 0
+                windowed.loc[window_ids, name] = counts
+
+            windowed.insert(0, 'timestamp', pd.to_datetime(origin + all_bins * window_size * 10**9))
+            windowed.insert(0, 'run_number', run_id)
+            results[window_size].append(windowed)
+
+    for window_size, frames in results.items():
+        result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['run_number', 'timestamp'] + feature_columns)
+        count_columns = [c for c in result.columns if c not in ('timestamp', 'bytes_read', 'bytes_written')]
+        results[window_size] = result.astype({c: np.int64 for c in count_columns})
+
+    return results
+
+
+# Seconds from each window to the next window at or above the burst threshold (9999 when there is none)
+def seconds_to_next_burst(windowed, burst_threshold):
+    result = np.empty(len(windowed), dtype=np.int64)
+    for run_id, run_windows in windowed.groupby('run_number', sort=False):
+        positions = windowed.index.get_indexer(run_windows.index)
+        window_times = run_windows['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        burst_times = window_times[(run_windows['total_syscalls'] >= burst_threshold).to_numpy()]
+
+        next_burst = np.searchsorted(burst_times, window_times, side='right')
+        has_burst = next_burst < len(burst_times)
+        delta = np.full(len(window_times), 9999 * 10**9, dtype=np.int64)
+        delta[has_burst] = burst_times[next_burst[has_burst]] - window_times[has_burst]
+        result[positions] = delta // 10**9
+    return result
+
+
+def preprocessing_aggregate(df, window_size_sec, burst_threshold, debug, is_train,
+                            extra_features=False, systemcalls=None, types=None):
+    
+    if debug:
+        logging.info("Starting preprocessing_aggregate...")
+        logging.info("Grouping by 'run_number' and timestamp windows...")
 
-        aggregated.append(windowed)
+    result = aggregate_windows(df, [window_size_sec], systemcalls, types)[window_size_sec]
 
-    result = pd.concat(aggregated).reset_index(drop=True)
+    if is_train:
+        if debug:
+            logging.info("Calculating time to next burst...")
+        result['seconds_to_next_burst'] = seconds_to_next_burst(result, burst_threshold)
 
     # Add relative_time column (in seconds), grouped by run_number
     result['relative_time'] = result.groupby('run_number')['timestamp'].transform(
         lambda x: (x - x.min()).dt.total_seconds().astype(int)
     )
 
+    return_columns = ['run_number', 'relative_time', 'total_syscalls']
+    if extra_features:
+        return_columns += [c for c in result.columns if c not in return_columns + ['timestamp', 'seconds_to_next_burst']]
     if is_train:
-        return_columns = ['run_number', 'relative_time', 'total_syscalls', 'seconds_to_next_burst']
-    else:
-        return_columns = ['run_number', 'relative_time', 'total_syscalls']
+        return_columns.append('seconds_to_next_burst')
 
     return result[return_columns]
 
 
 
 def preprocessing_aggregate_online(df, window_size_sec, burst_threshold, debug, is_train):
-    if debug:
-        logging.info("Starting preprocessing_aggregate...")
-
-    df = df.copy()
-    df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)
-
-    aggregated = []
-
-    for run_id, run_group in df.groupby('run_number'):
-        run_group = run_group.set_index('timestamp')
-        windowed = run_group.resample(f'{window_size_sec}s').agg({'systemcall': 'count'})
-        windowed.rename(columns={'systemcall': 'total_syscalls'}, inplace=True)
-        windowed['timestamp'] = windowed.index
-        windowed['run_number'] = run_id
-        windowed['is_burst'] = windowed['total_syscalls'] >= burst_threshold
-
-        if is_train:
-            next_burst_time = []
-            burst_times = windowed.loc[windowed['is_burst'], 'timestamp'].values
-
-            for current_time in windowed['timestamp']:
-                future_bursts = burst_times[burst_times > current_time]
-                delta = future_bursts[0] - current_time if len(future_bursts) else pd.Timedelta(seconds=9999)
-                next_burst_time.append(delta)
-            
-            windowed['seconds_to_next_burst'] = next_burst_time
-            windowed['seconds_to_next_burst'] = pd.to_timedelta(windowed['seconds_to_next_burst']).dt.total_seconds().astype(int)
-
-        aggregated.append(windowed)
-
-    result = pd.concat(aggregated).reset_index(drop=True)
-    result['relative_time'] = result.groupby('run_number')['timestamp'].transform(
-        lambda x: (x - x.min()).dt.total_seconds().astype(int)
-    )
-
-    return_cols = ['run_number', 'relative_time', 'total_syscalls']
-    if is_train:
-        return_cols.append('seconds_to_next_burst')
-
-    return result[return_cols]
+    return preprocessing_aggregate(df, window_size_sec, burst_threshold, debug, is_train)
 
 
 
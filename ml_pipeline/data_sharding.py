@@ -0,0 +1,164 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import logging
+from data_gathering import *
+from data_preprocessing import *
+from clock_alignment import SESSION_METADATA
+
+
+#### Out-of-core assembly of the training set
+# Each (app, case, run) unit is streamed as its own partition: it is loaded once into a raw shard,
+# turned into a training shard (lag features + target) and finally sampled down to a row budget,
+# so only one partition and the sample are ever held in memory.
+
+def partition_name(app, case, run):
+    return f"{app}__{case}__{run}"
+
+
+#### Parquet needs one type per column, categories mixing ints and strings are stored as strings
+def to_parquet_shard(df, path):
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and df[column].cat.categories.dtype == object:
+            df[column] = df[column].cat.rename_categories(str)
+    df.to_parquet(path, index=False)
+
+
+#### Size and mtime of the files a raw partition is loaded from (tracer files and clock offsets)
+def partition_sources(base_dir, app, case, run):
+    run_dir = os.path.join(base_dir, app, case, str(run))
+    tracer_dir = os.path.join(run_dir, 'tracer')
+    paths = [os.path.join(tracer_dir, f) for f in sorted(os.listdir(tracer_dir)) if f.endswith('.json')]
+    paths.append(os.path.join(run_dir, SESSION_METADATA))
+
+    sources = {}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sources[os.path.relpath(path, run_dir)] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+def write_raw_partitions(base_dir, units, shard_dir, debug):
+    raw_dir = os.path.join(shard_dir, 'raw')
+    os.makedirs(raw_dir, exist_ok=True)
+
+    manifest = []
+    for app, case, run in units:
+        path = os.path.join(raw_dir, f"{partition_name(app, case, run)}.parquet")
+        sources_path = os.path.join(raw_dir, f"{partition_name(app, case, run)}.sources.json")
+
+        # Raw partitions do not depend on the encoders, so they are reused across invocations as long as
+        # the files they were loaded from are unchanged (listed next to the shard)
+        sources = partition_sources(base_dir, app, case, run)
+        reused = False
+        if os.path.exists(path) and os.path.exists(sources_path):
+            with open(sources_path, 'r') as f:
+                reused = json.load(f) == sources
+
+        if reused:
+            if debug:
+                logging.info(f"Reusing raw partition {path}")
+        else:
+            if os.path.exists(path):
+                logging.info(f"Rebuilding raw partition {path}: its source files changed")
+            data = load_timeseries_data(base_dir, app, case, run, debug=debug)
+            to_parquet_shard(data, path)
+            del data
+            with open(sources_path, 'w') as f:
+                json.dump(sources, f, indent=4)
+
+        manifest.append({'application': app, 'case': case, 'run': run, 'raw_path': path})
+
+    return manifest
+
+
+#### Fit the label encoder once on the syscall vocabulary of every partition
+def fit_syscall_vocabulary(manifest, label_enc):
+    vocabulary = set()
+    for entry in manifest:
+        systemcalls = pd.read_parquet(entry['raw_path'], columns=['systemcall'])['systemcall']
+        vocabulary.update(systemcalls.dropna().unique())
+    label_enc.fit(sorted(vocabulary))
+    return label_enc
+
+
+def build_training_shards(manifest, shard_dir, N, type_enc, app_enc, label_enc, num_predictions, target_column, debug):
+    train_dir = os.path.join(shard_dir, 'train')
+    os.makedirs(train_dir, exist_ok=True)
+
+    for entry in manifest:
+        data = pd.read_parquet(entry['raw_path'])
+
+        # Lag features and targets are computed per partition, so they never cross run boundaries
+        data = preprocessing(data, N, type_enc, app_enc, label_enc, fit_encoder=False)
+        if target_column:
+            data[target_column] = build_next_systemcalls(data['systemcall_encoded'], num_predictions)
+
+        entry['path'] = os.path.join(train_dir, os.path.basename(entry['raw_path']))
+        entry['rows'] = len(data)
+        to_parquet_shard(data, entry['path'])
+
+        if debug:
+            logging.info(f"Wrote training shard {entry['path']} ({entry['rows']} rows)")
+        del data
+
+    return manifest
+
+
+#### Sample the training shards down to row_budget rows
+# Every row gets a uniform random key and the rows with the smallest keys are kept (a reservoir
+# sample), optionally per stratum so each application (or case, run) gets an equal share.
+def sample_training_shards(manifest, row_budget, stratify_by=None, seed=0):
+    rng = np.random.default_rng(seed)
+
+    if stratify_by:
+        strata = sorted({str(entry[stratify_by]) for entry in manifest})
+    else:
+        strata = ['all']
+    budgets = {stratum: row_budget // len(strata) + (i < row_budget % len(strata))
+               for i, stratum in enumerate(strata)}
+
+    reservoirs = {}
+    for shard_index, entry in enumerate(manifest):
+        stratum = str(entry[stratify_by]) if stratify_by else 'all'
+
+        shard = pd.read_parquet(entry['path'])
+        shard['_sample_key'] = rng.random(len(shard))
+        shard['_shard'] = shard_index
+        shard['_row'] = np.arange(len(shard))
+
+        if stratum in reservoirs:
+            shard = concat_trace_frames([reservoirs[stratum], shard])
+        reservoirs[stratum] = shard.nsmallest(budgets[stratum], '_sample_key')
+
+    if not reservoirs:
+        return pd.DataFrame()
+
+    sample = concat_trace_frames(reservoirs.values())
+    # Keep the sampled rows in trace order
+    sample = sample.sort_values(['_shard', '_row'])
+    return sample.drop(columns=['_sample_key', '_shard', '_row']).reset_index(drop=True)
+
+
+def load_sharded_training_data(base_dir, app_base, case_base, run_base, debug_base, N, ALL_APPLICATIONS,
+                               type_enc, app_enc, label_enc, shard_dir, row_budget, num_predictions=1,
+                               target_column=None, stratify_by='application', seed=0):
+    units = discover_training_units(base_dir, app_base, case_base, run_base, "all", ALL_APPLICATIONS)
+    if not units:
+        return pd.DataFrame()
+
+    manifest = write_raw_partitions(base_dir, units, shard_dir, debug_base)
+    fit_syscall_vocabulary(manifest, label_enc)
+    manifest = build_training_shards(manifest, shard_dir, N, type_enc, app_enc, label_enc,
+                                     num_predictions, target_column, debug_base)
+
+    train_data = sample_training_shards(manifest, row_budget, stratify_by, seed)
+
+    if debug_base:
+        total_rows = sum(entry['rows'] for entry in manifest)
+        logging.info(f"Sampled {len(train_data)} of {total_rows} rows from {len(manifest)} shards")
+        log_memory_usage(train_data, "sharded training set")
+
+    return train_data
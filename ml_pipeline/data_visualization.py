@@ -1,9 +1,16 @@
 import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+# Figures are only ever saved to files, never shown
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from sklearn.metrics import confusion_matrix
 import seaborn as sns
 from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
 import pandas as pd
+from sequence_analysis import *
 
 
 # Function to plot correlation matrix for numeric columns
@@ -62,7 +69,6 @@ def plot_distribution(base_data, output_dir):
         plt.title(f'Distribution of {column}')
         plt.xlabel(column)
         plt.ylabel('Frequency')
-        plt.show()
         plt.savefig(os.path.join(output_dir, f'distribution_of_{column}.png'))
         plt.close()
 
@@ -175,7 +181,7 @@ def plot_metric(output_dir, values, metric_name, N):
     plt.close()
 
 
-def table_results(output_dir, accuracies, precision_scores, recall_scores, f1_scores):
+def table_results(output_dir, accuracies, precision_scores, recall_scores, f1_scores, file_name='metrics_summary.csv'):
     
 
     print(accuracies)
@@ -195,7 +201,7 @@ def table_results(output_dir, accuracies, precision_scores, recall_scores, f1_sc
     print(metrics_table)
 
     # Save as CSV
-    metrics_table_path = os.path.join(output_dir, 'metrics_summary.csv')
+    metrics_table_path = os.path.join(output_dir, file_name)
     metrics_table.to_csv(metrics_table_path, index=False)
 
     # Pretty print to console
@@ -281,28 +287,27 @@ def save_predictions_csv(test_data, predictions, output_dir, label_enc):
     return pred_df
 
 
-def plot_syscall_followups(decoded_matrix, syscall_name, output_folder, matrix):
-    
-    # Filter rows where input is the target syscall
-    filtered = decoded_matrix[decoded_matrix['pred_0'] == syscall_name]
+#### Follow-up distributions of every syscall, read from the transition tensor of the matrix
+# Long table (syscall, position, followup, percentage): for each syscall in pred_0, the share of each
+# syscall seen at every later pred_ column, sorted like value_counts within each (syscall, position).
+def syscall_followup_tables(decoded_matrix, syscall_names=None):
+    return TransitionMatrix.from_matrix(decoded_matrix).followup_table(syscall_names)
 
-    if filtered.empty:
-        print(f"No occurrences of syscall '{syscall_name}' found.")
-        return
 
-    # Collect prediction columns
-    pred_cols = [col for col in decoded_matrix.columns if col.startswith('pred_') and col != 'pred_0']
+def render_syscall_followups(table, syscall_name, output_folder, matrix):
+    positions = list(table['position'].cat.categories) if isinstance(table['position'].dtype, pd.CategoricalDtype) \
+        else list(dict.fromkeys(table['position']))
 
     # Set up plotting
-    num_preds = len(pred_cols)
+    num_preds = len(positions)
     fig, axes = plt.subplots(1, num_preds, figsize=(4 * num_preds, 5), sharey=True)
 
     if num_preds == 1:
         axes = [axes]
 
-    for i, col in enumerate(pred_cols):
-        value_counts = filtered[col].value_counts(normalize=True).sort_values(ascending=False) * 100
-        sns.barplot(x=value_counts.index, y=value_counts.values, ax=axes[i])
+    for i, col in enumerate(positions):
+        value_counts = table[table['position'] == col]
+        sns.barplot(x=value_counts['followup'].astype(str).values, y=value_counts['percentage'].values, ax=axes[i])
         axes[i].set_title(f'{col} after "{syscall_name}"')
         axes[i].set_ylabel('Percentage')
         axes[i].tick_params(axis='x', rotation=90)
@@ -311,26 +316,62 @@ def plot_syscall_followups(decoded_matrix, syscall_name, output_folder, matrix):
     os.makedirs(output_folder, exist_ok=True)
     plot_path = os.path.join(output_folder, f'syscall_followups_{syscall_name}_{matrix}.png')
     plt.savefig(plot_path)
-    plt.close()
+    plt.close(fig)
 
+    return plot_path
+
+
+def plot_syscall_followups(decoded_matrix, syscall_name, output_folder, matrix):
+    table = syscall_followup_tables(decoded_matrix, [syscall_name])
+
+    if table.empty:
+        print(f"No occurrences of syscall '{syscall_name}' found.")
+        return
+
+    plot_path = render_syscall_followups(table, syscall_name, output_folder, matrix)
     print(f"Saved plot to {plot_path}")
 
 
+#### Follow-up tables of all the syscalls, rendered in a pool of headless workers
+# Syscalls that never appear in pred_0 are skipped. With tables_only only the CSV and the tensor are written.
+def plot_all_syscall_followups(decoded_matrix, syscall_names, output_folder, matrix, workers=None, tables_only=False):
+    transitions = TransitionMatrix.from_matrix(decoded_matrix)
+    tables = transitions.followup_table(syscall_names)
+
+    os.makedirs(output_folder, exist_ok=True)
+    transitions.save(os.path.join(output_folder, f'transitions_{matrix}.npz'))
+    tables.to_csv(os.path.join(output_folder, f'syscall_followups_{matrix}.csv'), index=False)
+
+    seen = set(tables['syscall'])
+    present = [name for name in syscall_names if name in seen]
+    logging.info(f"Follow-ups of {matrix}: {len(present)} syscalls with data, {len(syscall_names) - len(present)} skipped")
+    if tables_only or not present:
+        return tables
+
+    jobs = [(tables[tables['syscall'] == name], name, output_folder, matrix) for name in present]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers == 1:
+        paths = [render_syscall_followups(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            paths = list(executor.map(render_syscall_followups, *zip(*jobs)))
+
+    logging.info(f"Saved {len(paths)} follow-up plots to {output_folder}")
+    return tables
+
+
 def get_unique_next10_sequences(decoded_matrix, type_matrix, output_folder):
     # Get all columns starting with 'pred_' except 'pred_0'
     pred_cols = sorted([col for col in decoded_matrix.columns if col.startswith('pred_') and col != 'pred_0'])
-    
-    unique_sequences = set()
 
     res_path = os.path.join(output_folder, f"unique_next10_{type_matrix}.txt")
 
-    for _, row in decoded_matrix.iterrows():
-        # Extract the next 10 system calls as a tuple (or list)
-        next10 = tuple(row[col] for col in pred_cols)
-        unique_sequences.add(next10)
+    # The rows are indexed as integer windows, only the unique ones are turned back into tuples
+    (index,), labels = index_matrices([decoded_matrix], pred_cols)
+    unique_sequences = set(map(tuple, labels[index.sequences].tolist()))
 
     with open(res_path, 'w') as f:
         for seq in sorted(unique_sequences):
             f.write(f"{seq}\n")
     
-    return unique_sequences
\ No newline at end of file
+    return unique_sequences
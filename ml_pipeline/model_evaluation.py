@@ -1,13 +1,113 @@
 from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import numpy as np
+import itertools
 import logging
 import os
 import sys
 
 
+# Metrics of one position computed by sklearn, also used when the vectorized path does not apply
+def _sklearn_position_metrics(y_true, y_pred):
+    precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
+    recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
+    f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
+    accuracy = accuracy_score(y_true, y_pred)
+    return accuracy, precision, recall, f1
+
+
+#### Turn the sequences into a 2-D int array (first num_predictions items) and the length of each row
+# Strings are indexed per character, like the original loop did, through their UCS4 code points.
+# Returns None when the sequences are not all strings or all integer sequences.
+def sequences_to_matrix(seqs, num_predictions):
+    seqs = list(seqs)
+    lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+    if all(isinstance(seq, str) for seq in seqs):
+        strings = np.array(seqs, dtype=str) if seqs else np.empty(0, dtype='U1')
+        width = max(strings.dtype.itemsize // 4, 1)
+        matrix = strings.view(np.uint32).reshape(len(seqs), width)[:, :num_predictions].astype(np.int64)
+    elif all(isinstance(seq, (list, tuple, np.ndarray)) for seq in seqs):
+        kept = np.minimum(lengths, num_predictions)
+        if len(seqs) and (kept == kept[0]).all():
+            items = np.array([seq[:num_predictions] for seq in seqs])
+        else:
+            items = np.array(list(itertools.chain.from_iterable(seq[:num_predictions] for seq in seqs)))
+        if items.size and items.dtype.kind not in 'iu':
+            return None
+        matrix = np.zeros((len(seqs), num_predictions), dtype=np.int64)
+        matrix[np.arange(num_predictions) < kept[:, None]] = items.ravel()
+    else:
+        return None
+
+    if matrix.shape[1] < num_predictions:
+        matrix = np.pad(matrix, ((0, 0), (0, num_predictions - matrix.shape[1])))
+    return matrix, lengths
+
+
+# Sorted distinct values and the index of each value among them (np.unique without the sort when the range is small)
+def _dense_codes(values):
+    if not values.size:
+        return values, values
+    low, high = values.min(), values.max()
+    if high - low >= 1 << 24:
+        return np.unique(values, return_inverse=True)
+    present = np.bincount(values - low, minlength=high - low + 1) > 0
+    lookup = np.cumsum(present) - 1
+    return np.flatnonzero(present) + low, lookup[values - low]
+
+
+#### Accuracy and macro precision/recall/F1 of every position at once
+# true and pred are (rows, positions) int arrays, valid marks the compared cells. Per position and label
+# the true/predicted/correct counts come from one bincount, then the per-label scores are averaged the
+# same way sklearn does (labels seen in true or pred, zero_division=0), so the floats are identical.
+def evaluate_positions(true, pred, valid):
+    num_positions = true.shape[1]
+    positions = np.broadcast_to(np.arange(num_positions), true.shape)[valid]
+    labels, codes = _dense_codes(np.concatenate([true[valid], pred[valid]]))
+    true_codes, pred_codes = codes[:len(positions)], codes[len(positions):]
+
+    size = num_positions * len(labels)
+    true_count = np.bincount(positions * len(labels) + true_codes, minlength=size).reshape(num_positions, -1)
+    pred_count = np.bincount(positions * len(labels) + pred_codes, minlength=size).reshape(num_positions, -1)
+    correct = true_codes == pred_codes
+    tp = np.bincount(positions[correct] * len(labels) + true_codes[correct], minlength=size).reshape(num_positions, -1)
+
+    accuracy_scores, precision_scores, recall_scores, f1_scores = [], [], [], []
+    for i in range(num_positions):
+        present = (true_count[i] + pred_count[i]) > 0
+        tp_i, true_i, pred_i = tp[i][present], true_count[i][present], pred_count[i][present]
+
+        precision = np.where(pred_i > 0, tp_i / np.where(pred_i > 0, pred_i, 1), 0.0)
+        recall = np.where(true_i > 0, tp_i / np.where(true_i > 0, true_i, 1), 0.0)
+        denominator = true_i.astype(np.float64) + pred_i.astype(np.float64)
+        f1 = np.where(denominator > 0, 2.0 * tp_i / np.where(denominator > 0, denominator, 1), 0.0)
+
+        # Same value as np.average over the compared pairs: a count of exact ones divided by the pair count
+        accuracy_scores.append(float(tp[i].sum() / valid[:, i].sum()))
+        precision_scores.append(float(np.nanmean(precision)))
+        recall_scores.append(float(np.nanmean(recall)))
+        f1_scores.append(float(np.nanmean(f1)))
+
+    return accuracy_scores, precision_scores, recall_scores, f1_scores
+
+
 def evaluate_model(num_predictions, true_seqs, pred_seqs):
-    # Store metric values per position
+    true_seqs = list(true_seqs)
+    pred_seqs = list(pred_seqs)
+
+    true_matrix = sequences_to_matrix(true_seqs, num_predictions)
+    pred_matrix = sequences_to_matrix(pred_seqs, num_predictions)
+
+    if true_matrix is not None and pred_matrix is not None and len(true_seqs) == len(pred_seqs):
+        (true, true_lengths), (pred, pred_lengths) = true_matrix, pred_matrix
+        valid = np.arange(num_predictions) < np.minimum(true_lengths, pred_lengths)[:, None]
+
+        # Strings and integer sequences can not be compared, positions without any pair are left to sklearn
+        same_kind = isinstance(true_seqs[0], str) == isinstance(pred_seqs[0], str) if true_seqs else True
+        if same_kind and valid.any(axis=0).all():
+            return evaluate_positions(true, pred, valid)
+
+    # Fallback: the original per-position loop over sklearn
     precision_scores = []
     recall_scores = []
     f1_scores = []
@@ -25,13 +125,7 @@ def evaluate_model(num_predictions, true_seqs, pred_seqs):
 
     # Calculate metrics
     for i in range(num_predictions):
-        y_true = true_by_pos[i]
-        y_pred = pred_by_pos[i]
-
-        precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-        recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-        f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-        accuracy = accuracy_score(y_true, y_pred)
+        accuracy, precision, recall, f1 = _sklearn_position_metrics(true_by_pos[i], pred_by_pos[i])
 
         accuracy_scores.append(accuracy)
         precision_scores.append(precision)
@@ -62,3 +156,28 @@ def evaluate_burst(true_values, predictions, output_folder, debug):
         f.write(f"R2: {r2:.4f}\n")
 
     # Plot true vs predicted
+
+
+
+#### Latency reports for the online and streaming loops (latencies in seconds)
+def latency_summary(latencies):
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if latencies.size == 0:
+        return {'count': 0, 'mean_ms': 0.0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    return {
+        'count': int(latencies.size),
+        'mean_ms': float(latencies.mean() * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'max_ms': float(latencies.max() * 1000),
+    }
+
+
+def save_latency_report(output_folder, summaries, file_name='latency_report.txt'):
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, file_name), 'w') as f:
+        for name, summary in summaries.items():
+            line = f"{name}: " + ", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                                           for key, value in summary.items())
+            logging.info(line)
+            f.write(line + "\n")
@@ -0,0 +1,71 @@
+import time
+import numpy as np
+import pandas as pd
+from model_evaluation import *
+
+
+#### Micro-batching prediction driver
+# Feature rows are copied into a preallocated buffer and predicted together once the batch is full,
+# or once the oldest queued row has waited max_latency seconds. The same buffer is reused for every
+# batch, so no per-row DataFrame is ever built.
+class MicroBatchPredictor:
+
+    def __init__(self, predictor, feature_columns, batch_size=256, max_latency=None, dtype=np.float64):
+        self.predictor = predictor
+        self.feature_columns = list(feature_columns)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.buffer = np.empty((batch_size, len(self.feature_columns)), dtype=dtype)
+        self.pending = 0
+        self.arrivals = []
+        self.latencies = []
+        self.predict_time = 0.0
+        self.rows = 0
+
+    # Queue one feature row, returns the predictions of the batch it flushed (empty if none)
+    def submit(self, values, arrival=None):
+        self.buffer[self.pending] = values
+        self.arrivals.append(time.perf_counter() if arrival is None else arrival)
+        self.pending += 1
+        if self.pending == self.batch_size:
+            return self.flush()
+        return self.poll()
+
+    # Flush the queued rows once the oldest one reached the deadline
+    def poll(self):
+        if self.pending and self.max_latency is not None and time.perf_counter() - self.arrivals[0] >= self.max_latency:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self.pending:
+            return []
+
+        batch = pd.DataFrame(self.buffer[:self.pending], columns=self.feature_columns, copy=False)
+        start = time.perf_counter()
+        predictions = np.asarray(self.predictor.predict(batch))
+        end = time.perf_counter()
+
+        self.predict_time += end - start
+        self.rows += self.pending
+        self.latencies.extend(end - arrival for arrival in self.arrivals)
+        self.pending = 0
+        self.arrivals = []
+        return list(predictions)
+
+    # Replay a whole frame through the buffer, returns the predictions in row order
+    def predict_frame(self, X):
+        values = X[self.feature_columns].to_numpy(dtype=self.buffer.dtype)
+        predictions = []
+        for start in range(0, len(values), self.batch_size):
+            chunk = values[start:start + self.batch_size]
+            self.buffer[:len(chunk)] = chunk
+            self.pending = len(chunk)
+            self.arrivals = [time.perf_counter()] * len(chunk)
+            predictions.extend(self.flush())
+        return predictions
+
+    def report(self):
+        summary = latency_summary(self.latencies)
+        summary['throughput_rows_per_s'] = self.rows / self.predict_time if self.predict_time else 0.0
+        return summary
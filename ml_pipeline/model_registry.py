@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import logging
+import joblib
+import pandas as pd
+from datetime import datetime
+
+
+#### Registry of inference-only model artifacts
+# Each artifact is a folder with the deployment clone of the predictor (only the best model, no
+# training data or intermediate models), the fitted encoders and a feature schema:
+#   <registry_dir>/<name>/predictor/      TabularPredictor.clone_for_deployment
+#   <registry_dir>/<name>/encoders.joblib {'type': ..., 'application': ..., 'label': ...}
+#   <registry_dir>/<name>/schema.json     features (name, dtype), target, metadata
+
+REGISTRY_DIR = "model_registry/"
+
+
+def artifact_path(name, registry_dir=REGISTRY_DIR):
+    return os.path.join(registry_dir, name)
+
+
+def register_model(predictor, name, encoders, feature_data, target_column, metadata=None, registry_dir=REGISTRY_DIR):
+    path = artifact_path(name, registry_dir)
+    os.makedirs(path, exist_ok=True)
+
+    start = time.perf_counter()
+    predictor.clone_for_deployment(path=os.path.join(path, 'predictor'), dirs_exist_ok=True)
+    joblib.dump(encoders, os.path.join(path, 'encoders.joblib'))
+
+    schema = {
+        'name': name,
+        'target_column': target_column,
+        'features': [{'name': column, 'dtype': str(dtype)} for column, dtype in feature_data.dtypes.items()],
+        'source_path': predictor.path,
+        'created': datetime.now().isoformat(),
+        'metadata': metadata or {},
+    }
+    with open(os.path.join(path, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=4)
+
+    logging.info(f"Registered model {name} in {path} ({time.perf_counter() - start:.1f}s)")
+    return path
+
+
+class ModelArtifact:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'schema.json')) as f:
+            self.schema = json.load(f)
+        self._predictor = None
+        self._encoders = None
+
+    @property
+    def feature_columns(self):
+        return [feature['name'] for feature in self.schema['features']]
+
+    @property
+    def target_column(self):
+        return self.schema['target_column']
+
+    @property
+    def metadata(self):
+        return self.schema['metadata']
+
+    # The predictor and the encoders are only read from disk on first use
+    @property
+    def predictor(self):
+        if self._predictor is None:
+            from autogluon.tabular import TabularPredictor
+            start = time.perf_counter()
+            self._predictor = TabularPredictor.load(os.path.join(self.path, 'predictor'))
+            # Keep the models in memory, the artifact is reused for every prediction of the process
+            self._predictor.persist()
+            logging.info(f"Loaded predictor {self.schema['name']} in {time.perf_counter() - start:.1f}s")
+        return self._predictor
+
+    @property
+    def encoders(self):
+        if self._encoders is None:
+            self._encoders = joblib.load(os.path.join(self.path, 'encoders.joblib'))
+        return self._encoders
+
+    # Columns of the schema in training order, the ones missing from data are added empty
+    def prepare(self, data):
+        missing = [column for column in self.feature_columns if column not in data.columns]
+        if missing:
+            logging.info(f"Adding missing feature columns {missing}")
+        return data.reindex(columns=self.feature_columns)
+
+    def predict(self, data):
+        return self.predictor.predict(self.prepare(data))
+
+
+# Loaded artifacts are cached per process, keyed by folder and schema modification time
+_ARTIFACTS = {}
+
+
+def is_registered(name, registry_dir=REGISTRY_DIR):
+    return os.path.exists(os.path.join(artifact_path(name, registry_dir), 'schema.json'))
+
+
+def load_model(name, registry_dir=REGISTRY_DIR):
+    path = os.path.abspath(artifact_path(name, registry_dir))
+    schema_path = os.path.join(path, 'schema.json')
+    if not os.path.exists(schema_path):
+        raise FileNotFoundError(f"Model {name} is not registered in {registry_dir}")
+
+    key = (path, os.path.getmtime(schema_path))
+    if key not in _ARTIFACTS:
+        _ARTIFACTS[key] = ModelArtifact(path)
+    return _ARTIFACTS[key]
+
+
+def list_models(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return pd.DataFrame(columns=['name', 'created', 'target_column', 'features'])
+
+    rows = []
+    for name in sorted(os.listdir(registry_dir)):
+        if is_registered(name, registry_dir):
+            schema = load_model(name, registry_dir).schema
+            rows.append({'name': name, 'created': schema['created'], 'target_column': schema['target_column'],
+                         'features': len(schema['features'])})
+    return pd.DataFrame(rows)
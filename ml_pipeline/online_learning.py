@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from autogluon.tabular import TabularPredictor
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.preprocessing import StandardScaler
+
+
+#### Online regressors for the burst prediction
+# All of them share the same interface: fit(train_df) once, predict(X) per window and
+# partial_fit(new_df) with the windows seen since the last update.
+
+
+# Original behaviour: a new TabularPredictor is trained on all the data seen so far
+class AutoGluonRefitRegressor:
+
+    def __init__(self, label, time_limit):
+        self.label = label
+        self.time_limit = time_limit
+        self.train_data = None
+        self.predictor = None
+
+    def fit(self, train_data):
+        self.train_data = train_data
+        self.predictor = TabularPredictor(label=self.label, problem_type='regression').fit(
+            train_data=self.train_data,
+            time_limit=self.time_limit
+        )
+        return self
+
+    def partial_fit(self, new_data):
+        return self.fit(pd.concat([self.train_data, new_data]))
+
+    def predict(self, X):
+        return self.predictor.predict(X)
+
+
+# Linear model updated in place with partial_fit, features and target scaled with running statistics
+class IncrementalBurstRegressor:
+
+    def __init__(self, label, random_state=0):
+        self.label = label
+        self.feature_columns = None
+        self.x_scaler = StandardScaler()
+        self.y_scaler = StandardScaler()
+        self.model = SGDRegressor(learning_rate='adaptive', eta0=0.01, random_state=random_state)
+
+    def _features(self, data):
+        return data[self.feature_columns].to_numpy(dtype=np.float64)
+
+    def fit(self, train_data, epochs=5):
+        self.feature_columns = [c for c in train_data.columns if c != self.label]
+        X = self.x_scaler.fit_transform(self._features(train_data))
+        y = self.y_scaler.fit_transform(train_data[[self.label]].to_numpy(dtype=np.float64)).ravel()
+        for _ in range(epochs):
+            self.model.partial_fit(X, y)
+        return self
+
+    def partial_fit(self, new_data):
+        X = self._features(new_data)
+        y = new_data[[self.label]].to_numpy(dtype=np.float64)
+        self.x_scaler.partial_fit(X)
+        self.y_scaler.partial_fit(y)
+        self.model.partial_fit(self.x_scaler.transform(X), self.y_scaler.transform(y).ravel())
+        return self
+
+    def predict(self, X):
+        scaled = self.model.predict(self.x_scaler.transform(self._features(X)))
+        return pd.Series(self.y_scaler.inverse_transform(scaled.reshape(-1, 1)).ravel(), index=X.index)
+
+
+# Gradient-boosted model refitted on the last window_size samples only, with a bounded number of trees
+class SlidingWindowBurstRegressor:
+
+    def __init__(self, label, window_size=2000, max_iter=100, random_state=0):
+        self.label = label
+        self.window_size = window_size
+        self.feature_columns = None
+        self.window = None
+        self.model = HistGradientBoostingRegressor(max_iter=max_iter, random_state=random_state)
+
+    def fit(self, train_data):
+        self.feature_columns = [c for c in train_data.columns if c != self.label]
+        self.window = train_data.tail(self.window_size)
+        self.model.fit(self.window[self.feature_columns], self.window[self.label])
+        return self
+
+    def partial_fit(self, new_data):
+        return self.fit(pd.concat([self.window, new_data]))
+
+    def predict(self, X):
+        return pd.Series(self.model.predict(X[self.feature_columns]), index=X.index)
+
+
+ONLINE_MODELS = ['autogluon', 'sgd', 'window']
+
+
+def create_online_regressor(name, label, time_limit):
+    if name == 'autogluon':
+        return AutoGluonRefitRegressor(label, time_limit)
+    if name == 'sgd':
+        return IncrementalBurstRegressor(label)
+    if name == 'window':
+        return SlidingWindowBurstRegressor(label)
+    raise ValueError(f"Unknown online model '{name}', expected one of {ONLINE_MODELS}")
@@ -2,6 +2,7 @@ from setup_environment import *
 from data_gathering import *
 from data_preprocessing import *
 from data_visualization import *
+from data_sharding import *
 
 from category_encoders import BinaryEncoder
 import argparse
@@ -9,6 +10,9 @@ from sklearn.preprocessing import LabelEncoder, OneHotEncoder, OrdinalEncoder
 import sys
 from autogluon.tabular import TabularPredictor
 from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import time
 
 ############ Setup global variables ############
 
@@ -40,134 +44,183 @@ num_predictions = 1
 n_values = range(25, 101, 25)
 len_n_values = len(n_values)
 
-############ Setup logging ############
+############ Lag features ############
 
+# Lag features and targets are computed once at the largest N, each configuration only reads the
+# prev_systemcall_1..N columns it needs
+def build_lag_features(data, max_N, fit_encoder):
+    data = preprocessing(data, max_N, type_encoder, application_encoder, label_encoder, fit_encoder)
+    data[target_column] = build_next_systemcalls(data['systemcall_encoded'], num_predictions)
+    return data
 
-# Set up argument parser
-parser = argparse.ArgumentParser(description='System Call Prediction Script')
-parser.add_argument('-a', '--application', type=str, required=True, help='Application name to test')
-parser.add_argument('-c', '--case', type=str, required=True, help='Case name to test')
-parser.add_argument('-r', '--run', type=int, required=True, help='Run number to test (1, 2, or 3)')
-parser.add_argument('-o', '--output', type=str, required=True, help='Output folder')
-parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
-args = parser.parse_args()
 
-# Define case of test
-app_base = args.application
-case_base = args.case
-run_base = args.run
-debug_base = args.debug
-output_dir = args.output
-
-configure_logging(output_dir, debug_base)
-
-
-# Redirect stdout and stderr
-sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO)
-sys.stderr = StreamToLogger(logging.getLogger('STDERR'), logging.ERROR)
-
-
-
-############ Training Data ############
-
-# Note: Load training data from all cases and all runs except the specified test run
-
-# Initialize an empty DataFrame for training data
-train_data = pd.DataFrame()
-
-# Dynamically get the list of all case names from the base_app directory
-main_folder = base_dir + app_base
-all_cases = [d for d in os.listdir(main_folder) if os.path.isdir(os.path.join(main_folder, d))]
-
-# Iterate through all cases
-for case in all_cases:
-    for run in range(1, 4):  # Runs 1, 2, and 3
-        if str(case) == case_base and int(run) == int(run_base):
-            print("Skip test run")
-            continue  # Skip the test case and run
-        if str(case) != case_base:
-            print("SKIP case " + str(case) + " run " + str(run))
-            continue
-        train_data = pd.concat([train_data, load_timeseries_data(base_dir, app_base, case, run, debug=debug_base)], ignore_index=True)
-
-
-############ Test Data ############
-
-# Note: Load test data from the specified case and run
-
-test_data = load_timeseries_data(base_dir, app_base, case_base, run_base, debug=debug_base)
+def columns_for_n(columns, Nv, max_N):
+    dropped = {f'prev_systemcall_{i}' for i in range(Nv + 1, max_N + 1)}
+    return [c for c in columns if c not in dropped]
 
 
 ############ Model Training and Predicting ############
 
-scores = []
-
-for Nv in n_values:
+# Runs in a worker process: the thread budget comes from the environment set before the pool started
+def train_and_evaluate(Nv, train_path, test_path, columns, sweep_dir, cpus_per_worker, debug):
+    run_dir = os.path.join(sweep_dir, f"N_{Nv}")
+    configure_logging(run_dir, debug)
+    sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO)
+    sys.stderr = StreamToLogger(logging.getLogger('STDERR'), logging.ERROR)
 
-    logging.info(f"Training with N={Nv}...")
+    start = time.perf_counter()
+    logging.info(f"Training with N={Nv} on {cpus_per_worker} CPUs...")
 
-    # ---- Preprocess training data ----
-    logging.debug("Preprocessing training data...")
-    processed_train = preprocessing(train_data.copy(), Nv, type_encoder, application_encoder, label_encoder)
-
-    # Generate target labels (future system calls)
-    processed_train[target_column] = [get_next_systemcalls(processed_train, num_predictions, idx)
-                                      for idx in processed_train.index]
-    
-    
-    print(processed_train.columns)
-    print(processed_train.info())
+    processed_train = pd.read_parquet(train_path, columns=columns)
+    processed_test = pd.read_parquet(test_path, columns=columns)
     first_rows(processed_train)
 
     # ---- Train the model ----
-    logging.info("Training model...")
-    predictor = TabularPredictor(label=target_column).fit(
+    predictor = TabularPredictor(label=target_column, path=os.path.join(run_dir, 'model')).fit(
         train_data=processed_train,
         excluded_model_types=['CAT', 'XGB', 'RF', 'GBM', 'XT', 'NN_TORCH', 'KNN'],
-        time_limit=5000
+        time_limit=5000,
+        num_cpus=cpus_per_worker
     )
 
-    # ---- Preprocess test data ----
-    logging.debug("Preprocessing test data...")
-    processed_test = preprocessing(test_data.copy(), Nv, type_encoder, application_encoder, label_encoder)
-    processed_test[target_column] = [get_next_systemcalls(processed_test, num_predictions, idx)
-                                     for idx in processed_test.index]
-    
-    print(processed_test.columns)
-    print(processed_test.info())
-    first_rows(processed_test)
-
     # ---- Predict and evaluate ----
-    logging.debug("Making predictions on test data...")
     test_features = processed_test.drop(columns=[target_column], errors='ignore')
     test_labels = processed_test[target_column]
-
     test_predictions = predictor.predict(test_features)
 
-    # Evaluate
     acc = accuracy_score(test_labels, test_predictions)
     prec = precision_score(test_labels, test_predictions, average='macro', zero_division=0)
     rec = recall_score(test_labels, test_predictions, average='macro', zero_division=0)
     f1 = f1_score(test_labels, test_predictions, average='macro', zero_division=0)
 
     logging.info(f"N={Nv} => Accuracy: {acc:.4f}, Precision: {prec:.4f}, Recall: {rec:.4f}, F1: {f1:.4f}")
-    scores.append({
+    return {
         'N': Nv,
         'accuracy': acc,
         'precision': prec,
         'recall': rec,
-        'f1_score': f1
-    })
-
-# Plot and save figures
-# Extract individual metric lists and N values
-accuracies = [m['accuracy'] for m in scores]
-precisions = [m['precision'] for m in scores]
-recalls = [m['recall'] for m in scores]
-f1s = [m['f1_score'] for m in scores]
-
-# Use your updated function
-plot_metric(output_dir, accuracies, "Accuracy", len_n_values)
-plot_metric(output_dir, precisions, "Precision", len_n_values)
-plot_metric(output_dir, recalls, "Recall", len_n_values)
-plot_metric(output_dir, f1s, "F1-Score", len_n_values)
\ No newline at end of file
+        'f1_score': f1,
+        'train_time_s': time.perf_counter() - start,
+        'model_path': predictor.path
+    }
+
+
+############ Main function ############
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='System Call Prediction Script')
+    parser.add_argument('-a', '--application', type=str, required=True, help='Application name to test')
+    parser.add_argument('-c', '--case', type=str, required=True, help='Case name to test')
+    parser.add_argument('-r', '--run', type=int, required=True, help='Run number to test (1, 2, or 3)')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output folder')
+    parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='N configurations trained in parallel (default: one per N, up to the CPU budget)')
+    parser.add_argument('--cpus', type=int, default=None, help='Total CPU budget shared by the workers (default: all CPUs)')
+    args = parser.parse_args()
+
+    # Define case of test
+    app_base = args.application
+    case_base = args.case
+    run_base = args.run
+    debug_base = args.debug
+    output_dir = args.output
+
+    configure_logging(output_dir, debug_base)
+
+    # Redirect stdout and stderr
+    sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO)
+    sys.stderr = StreamToLogger(logging.getLogger('STDERR'), logging.ERROR)
+
+
+    ############ Training Data ############
+
+    # Note: Load training data from all cases and all runs except the specified test run
+    train_frames = []
+
+    # Dynamically get the list of all case names from the base_app directory
+    main_folder = base_dir + app_base
+    all_cases = [d for d in os.listdir(main_folder) if os.path.isdir(os.path.join(main_folder, d))]
+
+    # Iterate through all cases
+    for case in all_cases:
+        for run in range(1, 4):  # Runs 1, 2, and 3
+            if str(case) == case_base and int(run) == int(run_base):
+                print("Skip test run")
+                continue  # Skip the test case and run
+            if str(case) != case_base:
+                print("SKIP case " + str(case) + " run " + str(run))
+                continue
+            train_frames.append(load_timeseries_data(base_dir, app_base, case, run, debug=debug_base))
+
+    train_data = concat_trace_frames(train_frames)
+
+
+    ############ Test Data ############
+
+    # Note: Load test data from the specified case and run
+    test_data = load_timeseries_data(base_dir, app_base, case_base, run_base, debug=debug_base)
+
+
+    ############ Lag features at the largest N ############
+
+    max_N = max(n_values)
+    sweep_dir = os.path.join(output_dir, 'n_sweep')
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    # The test set is encoded with the training vocabulary (unknown syscalls become -1)
+    processed_train = build_lag_features(train_data, max_N, fit_encoder=True)
+    processed_test = build_lag_features(test_data, max_N, fit_encoder=False)
+    del train_data, test_data
+
+    # Workers read their columns from these files instead of receiving a pickled copy of the frames
+    train_path = os.path.join(sweep_dir, 'train_lags.parquet')
+    test_path = os.path.join(sweep_dir, 'test_lags.parquet')
+    to_parquet_shard(processed_train, train_path)
+    to_parquet_shard(processed_test, test_path)
+    columns = list(processed_train.columns)
+    del processed_train, processed_test
+
+
+    ############ Parallel N sweep ############
+
+    cpus = args.cpus or os.cpu_count() or 1
+    workers = max(1, min(args.workers or cpus, len_n_values, cpus))
+    cpus_per_worker = max(1, cpus // workers)
+
+    # Spawned workers inherit these before numpy/torch start their thread pools
+    for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[variable] = str(cpus_per_worker)
+    logging.info(f"Training {len_n_values} configurations with {workers} workers, {cpus_per_worker} CPUs each")
+
+    scores = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(train_and_evaluate, Nv, train_path, test_path, columns_for_n(columns, Nv, max_N),
+                                   sweep_dir, cpus_per_worker, debug_base)
+                   for Nv in n_values]
+        for future in as_completed(futures):
+            score = future.result()
+            logging.info(f"N={score['N']} done in {score['train_time_s']:.1f}s => F1: {score['f1_score']:.4f}")
+            scores.append(score)
+
+    scores = sorted(scores, key=lambda m: m['N'])
+    metrics_table = pd.DataFrame(scores)
+    metrics_table.to_csv(os.path.join(output_dir, 'n_sweep_metrics.csv'), index=False)
+    logging.info(f"\n{metrics_table.to_string(index=False)}")
+
+    # Plot and save figures
+    # Extract individual metric lists and N values
+    accuracies = [m['accuracy'] for m in scores]
+    precisions = [m['precision'] for m in scores]
+    recalls = [m['recall'] for m in scores]
+    f1s = [m['f1_score'] for m in scores]
+
+    # Use your updated function
+    plot_metric(output_dir, accuracies, "Accuracy", len_n_values)
+    plot_metric(output_dir, precisions, "Precision", len_n_values)
+    plot_metric(output_dir, recalls, "Recall", len_n_values)
+    plot_metric(output_dir, f1s, "F1-Score", len_n_values)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,15 @@ from data_gathering import *
 from data_preprocessing import *
 from data_visualization import *
 from model_evaluation import *
+from data_sharding import *
+from sequence_models import *
+from model_registry import *
 
 import argparse
+import copy
 import sys
 import logging
+import time
 from autogluon.tabular import TabularPredictor
 from autogluon.multimodal import MultiModalPredictor
 
@@ -17,18 +22,26 @@ target_column = 'next_systemcalls'
 ############ Data loading and preprocessing ############
 
 def load_and_preprocess_data(base_dir, app, case, run, situation, debug,
-                             type_enc, app_enc, label_enc, num_predictions, is_train=True):
-    if is_train:
+                             type_enc, app_enc, label_enc, num_predictions, is_train=True,
+                             row_budget=None, shard_dir=None):
+    # With a row budget the "all" training set is built out-of-core from per-run shards
+    sharded = situation == "all" and row_budget is not None
+
+    if is_train and sharded:
+        data = load_sharded_training_data(base_dir, app, case, run, debug, N, ALL_APPLICATIONS, type_enc, app_enc, label_enc,
+                                          shard_dir, row_budget, num_predictions, target_column)
+    elif is_train:
         data = load_training_data(base_dir, app, case, run, situation, debug, N, ALL_APPLICATIONS, type_enc, app_enc, label_enc)
     else:
         data = load_timeseries_data(base_dir, app, case, run, debug)
-        data = preprocessing(data, N, type_enc, app_enc, label_enc)
+        # The sharded training set fits the label encoder on every run, so the test run reuses it
+        data = preprocessing(data, N, type_enc, app_enc, label_enc, fit_encoder=not sharded)
 
     print(data.columns)
     print(data.info())
     first_rows(data)  
 
-    if is_train:
+    if is_train and not sharded:
         data[target_column] = [get_next_systemcalls(data, num_predictions, idx) for idx in range(len(data))]
     else:
         if 'new_path' not in data.columns:
@@ -55,21 +68,30 @@ def train_model(train_data, target_column, situation):
 
 ############ Model evaluation ############
 
-def evaluate_and_plot(predictor, test_data, feature_cols, output_folder, num_predictions):
-    predictions = predictor.predict(test_data[feature_cols])
-    test_data[target_column] = [get_next_systemcalls(test_data, num_predictions, idx) for idx in range(len(test_data))]
+def evaluate_and_plot(predictions, test_data, output_folder, num_predictions, file_name='metrics_summary.csv', plot=True):
+    test_data[target_column] = build_next_systemcalls(test_data['systemcall_encoded'], num_predictions)
 
     true_seqs = test_data[target_column]
     pred_seqs = predictions
 
     accuracy_scores, precision_scores, recall_scores, f1_scores = evaluate_model(num_predictions, true_seqs, pred_seqs)
 
-    plot_metric(output_folder, accuracy_scores, "Accuracy", num_predictions)
-    plot_metric(output_folder, precision_scores, "Precision", num_predictions)
-    plot_metric(output_folder, recall_scores, "Recall", num_predictions)
-    plot_metric(output_folder, f1_scores, "F1-Score", num_predictions)
+    if plot:
+        plot_metric(output_folder, accuracy_scores, "Accuracy", num_predictions)
+        plot_metric(output_folder, precision_scores, "Precision", num_predictions)
+        plot_metric(output_folder, recall_scores, "Recall", num_predictions)
+        plot_metric(output_folder, f1_scores, "F1-Score", num_predictions)
 
-    table_results(output_folder, accuracy_scores, precision_scores, recall_scores, f1_scores)
+    table_results(output_folder, accuracy_scores, precision_scores, recall_scores, f1_scores, file_name)
+
+
+# Training and prediction cost of a model, to compare the n-gram baseline with AutoGluon
+def model_cost(fit_seconds, predict_seconds, rows):
+    return {
+        'fit_s': float(fit_seconds),
+        'predict_s': float(predict_seconds),
+        'predict_us_per_row': float(predict_seconds / rows * 1e6) if rows else 0.0,
+    }
 
 
 ############ Main function ############
@@ -83,6 +105,11 @@ def main():
     parser.add_argument('-n', '--num_predictions', type=int, required=True, help='Number of the next systemcalls to predict')
     parser.add_argument('-o', '--output', type=str, required=True, help='Output folder')
     parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('-b', '--row_budget', type=int, default=None, help='Rows sampled from the out-of-core "all" training set')
+    parser.add_argument('--shard_dir', type=str, default=None, help='Folder for the training shards (default: <output>/shards)')
+    parser.add_argument('-g', '--ngram_order', type=int, default=None, help='Also evaluate an n-gram (variable-order Markov) baseline of this order')
+    parser.add_argument('--baseline_only', action='store_true', help='Only evaluate the n-gram baseline, skip AutoGluon')
+    parser.add_argument('--model_name', type=str, default=None, help='Name of the model in the registry (default: case2_<app>_<case>_<run>_<situation>_next<n>)')
     args = parser.parse_args()
 
     app_base = args.application
@@ -92,6 +119,8 @@ def main():
     situation_base = args.situation
     output_folder = args.output
     num_predictions = args.num_predictions
+    row_budget = args.row_budget
+    shard_dir = args.shard_dir or os.path.join(output_folder, 'shards')
 
     configure_logging(output_folder, debug_base)
     sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO)
@@ -100,9 +129,13 @@ def main():
     type_enc, app_enc, label_enc = create_encoders()
 
     train_data = load_and_preprocess_data(base_dir, app_base, case_base, run_base, situation_base, debug_base,
-                                          type_enc, app_enc, label_enc, num_predictions, is_train=True)
+                                          type_enc, app_enc, label_enc, num_predictions, is_train=True,
+                                          row_budget=row_budget, shard_dir=shard_dir)
+    # The test run may refit the label encoder, the registry keeps the one of the training data
+    train_label_enc = copy.deepcopy(label_enc)
     test_data = load_and_preprocess_data(base_dir, app_base, case_base, run_base, situation_base, debug_base,
-                                         type_enc, app_enc, label_enc, num_predictions, is_train=False)
+                                         type_enc, app_enc, label_enc, num_predictions, is_train=False,
+                                         row_budget=row_budget, shard_dir=shard_dir)
 
     print(train_data.columns)
     print(train_data.info())
@@ -117,8 +150,39 @@ def main():
     # plot_correlation_matrix(train_data, output_folder)
     filter_columns_by_missing_values(train_data, threshold=85)
 
-    predictor, feature_columns = train_model(train_data, target_column, situation_base)
-    evaluate_and_plot(predictor, test_data, feature_columns, output_folder, num_predictions)
+    costs = {}
+
+    if args.ngram_order:
+        start = time.perf_counter()
+        baseline = NGramPredictor(args.ngram_order, num_predictions).fit_frame(train_data, target_column)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictions = baseline.predict(test_data)
+        costs['ngram'] = model_cost(fit_seconds, time.perf_counter() - start, len(test_data))
+
+        baseline.save(os.path.join(output_folder, 'ngram_model.npz'))
+        evaluate_and_plot(predictions, test_data, output_folder, num_predictions, 'metrics_summary_ngram.csv', plot=False)
+
+    if not args.baseline_only:
+        start = time.perf_counter()
+        predictor, feature_columns = train_model(train_data, target_column, situation_base)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictions = predictor.predict(test_data[feature_columns])
+        costs['autogluon'] = model_cost(fit_seconds, time.perf_counter() - start, len(test_data))
+
+        # Inference-only copy with its encoders, loaded by start_from_load_model_pipeline_case2.py
+        model_name = args.model_name or f"case2_{app_base}_{case_base}_{run_base}_{situation_base}_next{num_predictions}"
+        register_model(predictor, model_name, {'type': type_enc, 'application': app_enc, 'label': train_label_enc},
+                       train_data[feature_columns].head(0), target_column,
+                       {'application': app_base, 'case': case_base, 'run': run_base, 'situation': situation_base,
+                        'num_predictions': num_predictions, 'N': N})
+
+        evaluate_and_plot(predictions, test_data, output_folder, num_predictions)
+
+    save_latency_report(output_folder, costs, 'model_cost.txt')
 
 
 if __name__ == "__main__":
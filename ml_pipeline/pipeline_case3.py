@@ -39,12 +39,12 @@ def train_model(train_data, target_column, situation, debug):
 
 ############ Model Evaluation ############
 
-def offline_testing(predictor, full_data, burst_threshold, TIME_THRESHOLD, debug):
+def offline_testing(predictor, full_data, burst_threshold, TIME_THRESHOLD, debug, **aggregate_options):
     if debug:
         logging.info("Started offline testing...")
 
     # Aggregate full data (not in training mode)
-    X = preprocessing_aggregate(full_data, TIME_THRESHOLD, burst_threshold, debug, is_train=False)
+    X = preprocessing_aggregate(full_data, TIME_THRESHOLD, burst_threshold, debug, is_train=False, **aggregate_options)
 
     # Make prediction
     y_pred = predictor.predict(X)
@@ -62,6 +62,8 @@ def main():
     parser.add_argument('-r', '--run', type=int, required=True)
     parser.add_argument('-o', '--output', type=str, required=True)
     parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('-x', '--extra_features', action='store_true',
+                        help='Add per-window syscall/type counts, bytes and distinct files/pids to the features')
     args = parser.parse_args()
 
     app_base = args.application
@@ -84,8 +86,17 @@ def main():
     # Compute thresholds dynamically
     burst_threshold = compute_thresholds(raw_train_data, debug_base, TIME_THRESHOLD)
 
+    # Train and test windows share the syscall and type vocabulary of the training data
+    aggregate_options = {}
+    if args.extra_features:
+        aggregate_options = {
+            'extra_features': True,
+            'systemcalls': sorted(raw_train_data['systemcall'].dropna().unique()),
+            'types': sorted(raw_train_data['type'].dropna().unique()),
+        }
+
     # Preprocess train
-    train_data = preprocessing_aggregate(raw_train_data, TIME_THRESHOLD, burst_threshold, debug_base, is_train=True)
+    train_data = preprocessing_aggregate(raw_train_data, TIME_THRESHOLD, burst_threshold, debug_base, is_train=True, **aggregate_options)
 
     # Load and preprocess test
     test_data_raw = load_timeseries_data(base_dir, app_base, case_base, run_base, debug_base)
@@ -95,9 +106,9 @@ def main():
 
     predictor, feature_columns = train_model(train_data, target_column, situation_base, debug_base)
 
-    predictions = offline_testing(predictor, test_data, burst_threshold, TIME_THRESHOLD, debug_base)
+    predictions = offline_testing(predictor, test_data, burst_threshold, TIME_THRESHOLD, debug_base, **aggregate_options)
 
-    test_data_agg = preprocessing_aggregate(test_data, TIME_THRESHOLD, burst_threshold, debug_base, True)
+    test_data_agg = preprocessing_aggregate(test_data, TIME_THRESHOLD, burst_threshold, debug_base, True, **aggregate_options)
     true_values = test_data_agg[target_column].tolist()
 
     save_decoded_matrix(test_data_agg, output_folder, "true_values")
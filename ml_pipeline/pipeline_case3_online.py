@@ -3,6 +3,8 @@ from data_gathering import *
 from data_preprocessing import *
 from data_visualization import *
 from model_evaluation import *
+from online_learning import *
+from model_inference import *
 
 from category_encoders import BinaryEncoder
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder, OrdinalEncoder
@@ -13,12 +15,15 @@ import os
 import sys
 import pandas as pd
 import logging
+import time
 
 
 TARGET_COLUMN = 'seconds_to_next_burst'
 BURST_THRESHOLD = 10000
 RETRAIN_EVERY_N = 500  # Retrain after accumulating this many new samples
 TIME_LIMIT_PER_TRAIN = 5000  # seconds per retrain
+# Default number of new samples between updates for each online model
+UPDATE_EVERY_N = {'autogluon': RETRAIN_EVERY_N, 'sgd': 1, 'window': 50}
 
 
 def load_and_preprocess_data(base_dir, app, case, run, situation, debug,
@@ -66,6 +71,10 @@ def main(debug=True):
     parser.add_argument('-r', '--run', type=int, required=True, help='Run number to test (1, 2, or 3)')
     parser.add_argument('-o', '--output', type=str, required=True, help='Output folder')
     parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('-m', '--online_model', type=str, default='autogluon', choices=ONLINE_MODELS,
+                        help='autogluon (full refit), sgd (partial_fit per sample) or window (bounded sliding-window refit)')
+    parser.add_argument('-u', '--update_every', type=int, default=None, help='New samples between model updates')
+    parser.add_argument('-B', '--batch_size', type=int, default=256, help='Windows predicted per micro-batch')
     args = parser.parse_args()
 
     app_base = args.application
@@ -74,6 +83,9 @@ def main(debug=True):
     debug_base = args.debug
     situation_base = args.situation
     output_folder = args.output
+    online_model = args.online_model
+    update_every = args.update_every or UPDATE_EVERY_N[online_model]
+    batch_size = args.batch_size
 
     configure_logging(args.output, args.debug)
     sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO)
@@ -97,46 +109,38 @@ def main(debug=True):
     save_decoded_matrix(train_df, output_folder, "train")
 
     # Initialize predictor
-    predictor = TabularPredictor(label=TARGET_COLUMN, problem_type='regression').fit(
-        train_data=train_df,
-        time_limit=TIME_LIMIT_PER_TRAIN
-    )
+    predictor = create_online_regressor(online_model, TARGET_COLUMN, TIME_LIMIT_PER_TRAIN).fit(train_df)
 
     # Load run 3 for online testing
     test_df_full = load_and_preprocess_data(base_dir, app_base, case_base, run_base, situation_base, debug_base,
                                          type_enc, app_enc, label_enc, is_train=False)
 
-    # Online loop
-    accumulated_new_samples = []
+    # Online loop: the windows between two updates are predicted in micro-batches, a batch never
+    # crosses an update boundary so every prediction sees the same model as the per-row loop did
+    feature_columns = [c for c in test_df_full.columns if c != TARGET_COLUMN]
+    batcher = MicroBatchPredictor(predictor, feature_columns, batch_size,
+                                  dtype=np.result_type(*test_df_full[feature_columns].dtypes))
     all_predictions = []
     true_values = []
+    update_latencies = []
 
-    for idx, row in test_df_full.iterrows():
-        X_row = row.drop(TARGET_COLUMN).to_frame().T
-        y_true = row[TARGET_COLUMN]
-
-        # Predict
-        y_pred = predictor.predict(X_row).values[0]
-
-        # Store for evaluation
-        all_predictions.append(y_pred)
-        true_values.append(y_true)
-
-        # Add this new sample to retrain later
-        accumulated_new_samples.append(row)
-
-        if (len(accumulated_new_samples) >= RETRAIN_EVERY_N) or (idx == len(test_df_full) - 1):
-            new_df = pd.DataFrame(accumulated_new_samples)
-            if debug:
-                logging.info(f"Retraining with {len(new_df)} new samples (step {idx})...")
-            # Retrain predictor incrementally
-            predictor = TabularPredictor(label=TARGET_COLUMN, problem_type='regression').fit(
-                train_data=pd.concat([train_df, new_df]),
-                time_limit=TIME_LIMIT_PER_TRAIN
-            )
-            # Append to training data
-            train_df = pd.concat([train_df, new_df])
-            accumulated_new_samples = []
+    for start_idx in range(0, len(test_df_full), update_every):
+        new_df = test_df_full.iloc[start_idx:start_idx + update_every]
+
+        all_predictions.extend(batcher.predict_frame(new_df))
+        true_values.extend(new_df[TARGET_COLUMN].tolist())
+
+        if debug:
+            logging.info(f"Updating {online_model} model with {len(new_df)} new samples (step {start_idx + len(new_df) - 1})...")
+        # Update the predictor incrementally, the latency is amortized over the new samples
+        start = time.perf_counter()
+        predictor.partial_fit(new_df)
+        update_latencies.extend([(time.perf_counter() - start) / len(new_df)] * len(new_df))
+
+    save_latency_report(output_folder, {
+        'predict_per_sample': batcher.report(),
+        'update_per_sample': latency_summary(update_latencies),
+    }, 'online_latency.txt')
 
 
     time_windows = [i * TIME_THRESHOLD for i in range(len(all_predictions))]
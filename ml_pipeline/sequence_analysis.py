@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+#### Length-k windows over an encoded syscall array, as a (n - k + 1, k) view (no copy)
+def window_view(codes, k):
+    codes = np.asarray(codes)
+    if len(codes) < k:
+        return np.empty((0, k), dtype=codes.dtype)
+    return sliding_window_view(codes, k)
+
+
+# Each window becomes one opaque fixed-size key, so numpy can sort, unique and match whole windows
+def _window_keys(windows):
+    windows = np.ascontiguousarray(windows)
+    return windows.view(np.dtype((np.void, windows.dtype.itemsize * windows.shape[1]))).ravel()
+
+
+#### Index of the unique length-k syscall sequences and their frequencies
+# Windows are collected from whole arrays at once (one array per run, so no window crosses two runs),
+# reduced with np.unique over their byte keys and merged with the sequences already indexed.
+class SequenceIndex:
+
+    def __init__(self, k, dtype=np.int64):
+        self.k = k
+        self.dtype = dtype
+        self.sequences = np.empty((0, k), dtype=dtype)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def add(self, codes):
+        return self.add_windows(window_view(np.asarray(codes, dtype=self.dtype), self.k))
+
+    def add_windows(self, windows, counts=None):
+        windows = np.asarray(windows, dtype=self.dtype).reshape(-1, self.k)
+        if counts is None:
+            counts = np.ones(len(windows), dtype=np.int64)
+
+        all_windows = np.concatenate([self.sequences, windows])
+        all_counts = np.concatenate([self.counts, counts])
+        if not len(all_windows):
+            return self
+
+        _, first, inverse = np.unique(_window_keys(all_windows), return_index=True, return_inverse=True)
+        self.sequences = all_windows[first]
+        self.counts = np.bincount(inverse.ravel(), weights=all_counts, minlength=len(first)).astype(np.int64)
+        return self
+
+    # Boolean mask of the given windows that are in the index
+    def contains(self, windows):
+        windows = np.asarray(windows, dtype=self.dtype).reshape(-1, self.k)
+        if not len(self) or not len(windows):
+            return np.zeros(len(windows), dtype=bool)
+        return np.isin(_window_keys(windows), _window_keys(self.sequences))
+
+    # Sequences (and their counts) of this index that never appear in other
+    def difference(self, other):
+        missing = ~other.contains(self.sequences)
+        return self.sequences[missing], self.counts[missing]
+
+    # Fraction of the windows of this index (weighted by frequency) that also appear in other
+    def coverage(self, other):
+        total = self.counts.sum()
+        return float(self.counts[other.contains(self.sequences)].sum() / total) if total else 0.0
+
+    def to_frame(self, labels=None):
+        values = self.sequences if labels is None else np.asarray(labels, dtype=object)[self.sequences]
+        frame = pd.DataFrame(values, columns=[f'pos_{i + 1}' for i in range(self.k)])
+        frame['count'] = self.counts
+        return frame.sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+
+#### Index the rows of several matrices (e.g. decoded train/test matrices) with one shared vocabulary
+def index_matrices(matrices, columns):
+    values = [matrix[columns].to_numpy().ravel() for matrix in matrices]
+    codes, labels = pd.factorize(np.concatenate(values) if values else np.empty(0, dtype=object), use_na_sentinel=False)
+
+    indexes = []
+    start = 0
+    for matrix in matrices:
+        end = start + len(matrix) * len(columns)
+        indexes.append(SequenceIndex(len(columns)).add_windows(codes[start:end].reshape(len(matrix), len(columns))))
+        start = end
+    return indexes, np.asarray(labels, dtype=object)
+
+
+#### Transition statistics: how often syscall b follows syscall a at lag j, for every lag at once
+# counts[j - 1, a, b] over a vocabulary of labels. All the (lag, a, b) pairs are packed into one integer
+# key and counted with a single bincount. The tensor is stored sparse (non-zero cells only) with np.savez.
+class TransitionMatrix:
+
+    def __init__(self, labels, counts, lag_names=None):
+        self.labels = np.asarray(labels)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.max_lag = self.counts.shape[0]
+        self.lag_names = list(lag_names) if lag_names is not None else [f'lag_{j}' for j in range(1, self.max_lag + 1)]
+
+    @staticmethod
+    def _count(sources, targets, valid, vocabulary_size):
+        # sources: (rows,), targets/valid: (rows, max_lag)
+        max_lag = targets.shape[1]
+        lags = np.broadcast_to(np.arange(max_lag), targets.shape)
+        sources = np.broadcast_to(sources[:, None], targets.shape)
+        keys = (lags[valid] * vocabulary_size + sources[valid]) * vocabulary_size + targets[valid]
+        counts = np.bincount(keys, minlength=max_lag * vocabulary_size * vocabulary_size)
+        return counts.reshape(max_lag, vocabulary_size, vocabulary_size)
+
+    # From an encoded syscall array (codes 0..V-1, negative codes are ignored), every pair at lags 1..max_lag
+    @classmethod
+    def from_codes(cls, codes, max_lag, labels=None):
+        codes = np.asarray(codes, dtype=np.int64)
+        if labels is None:
+            labels = np.arange(codes.max() + 1 if codes.size else 0)
+        vocabulary_size = len(labels)
+
+        # Pad the end so that the last syscalls still count at the lags they have
+        padded = np.concatenate([codes, np.full(max_lag, -1, dtype=np.int64)])
+        windows = window_view(padded, max_lag + 1)[:len(codes)]
+        sources, targets = windows[:, 0], windows[:, 1:]
+        valid = (sources[:, None] >= 0) & (targets >= 0)
+        return cls(labels, cls._count(sources, np.maximum(targets, 0), valid, vocabulary_size))
+
+    # From a (decoded) prediction matrix: the first column against each of the following ones
+    @classmethod
+    def from_matrix(cls, matrix, source_column='pred_0', target_columns=None):
+        if target_columns is None:
+            target_columns = [col for col in matrix.columns if col.startswith('pred_') and col != source_column]
+        columns = [source_column] + list(target_columns)
+
+        codes, labels = pd.factorize(matrix[columns].to_numpy().ravel(), sort=True)
+        codes = codes.reshape(len(matrix), len(columns))
+        sources, targets = codes[:, 0], codes[:, 1:]
+        valid = (sources[:, None] >= 0) & (targets >= 0)
+        counts = cls._count(sources, np.maximum(targets, 0), valid, len(labels))
+        return cls(np.asarray(labels), counts, target_columns)
+
+    def __add__(self, other):
+        if not np.array_equal(self.labels, other.labels) or self.max_lag != other.max_lag:
+            raise ValueError("Transition matrices must share labels and lags to be added")
+        return TransitionMatrix(self.labels, self.counts + other.counts, self.lag_names)
+
+    # Share (in %) of each follow-up per (syscall, lag), as a long table sorted like value_counts
+    def followup_table(self, syscall_names=None):
+        lag, source, target = np.nonzero(self.counts)
+        count = self.counts[lag, source, target]
+        totals = self.counts.sum(axis=2)[lag, source]
+
+        table = pd.DataFrame({
+            'syscall': self.labels[source],
+            'position': pd.Categorical.from_codes(lag, categories=self.lag_names, ordered=True),
+            'followup': self.labels[target],
+            'percentage': count / totals * 100,
+        })
+        if syscall_names is not None:
+            table = table[table['syscall'].isin(syscall_names)]
+        table = table.sort_values(['syscall', 'position', 'percentage'], ascending=[True, True, False], kind='stable')
+        return table.reset_index(drop=True)
+
+    # Most frequent follow-up of every syscall at a lag (-1 if it was never followed), ties to the first label
+    def most_likely_next(self, lag=1):
+        counts = self.counts[lag - 1]
+        return np.where(counts.sum(axis=1) > 0, counts.argmax(axis=1), -1)
+
+    def save(self, path):
+        lag, source, target = np.nonzero(self.counts)
+        labels = self.labels.astype(str) if self.labels.dtype == object else self.labels
+        np.savez_compressed(path, labels=labels, lag_names=np.asarray(self.lag_names), shape=np.asarray(self.counts.shape),
+                            lag=lag.astype(np.uint16), source=source.astype(np.uint32), target=target.astype(np.uint32),
+                            count=self.counts[lag, source, target])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as stored:
+            counts = np.zeros(tuple(stored['shape']), dtype=np.int64)
+            counts[stored['lag'], stored['source'], stored['target']] = stored['count']
+            return cls(stored['labels'], counts, stored['lag_names'].tolist())
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+
+#### Variable-order Markov (n-gram) next-syscall predictor
+# For every context length k = 1..order the training pass keeps one sorted table of context keys with
+# the most frequent next syscall. A context of k codes is packed into a single int64 key (base-`base`
+# digits, code + 1 so that the unknown code -1 is a valid digit), lookups are a searchsorted per order.
+# Predictions back off from the longest known context to the most frequent syscall overall, and the
+# next num_predictions syscalls are produced greedily, returned as "a,b" strings like the targets.
+class NGramPredictor:
+
+    def __init__(self, order=4, num_predictions=1):
+        self.order = order
+        self.num_predictions = num_predictions
+        self.base = None
+        self.keys = {}
+        self.next_codes = {}
+        self.fallback = -1
+
+    # Context columns of the lag matrix, the current syscall first
+    @staticmethod
+    def context_columns(order):
+        return ['systemcall_encoded'] + [f'prev_systemcall_{i}' for i in range(1, order)]
+
+    def _digits(self, codes):
+        codes = np.asarray(codes, dtype=np.float64)
+        missing = np.isnan(codes)
+        digits = np.where(missing, 0, codes + 1).astype(np.int64)
+        # Codes the model never saw are treated as unknown
+        digits[(digits < 0) | (digits >= self.base)] = 0
+        return digits, missing
+
+    def _pack(self, contexts, k):
+        # contexts[:, 0] is the current syscall, contexts[:, j] the j-th previous one
+        digits, missing = self._digits(contexts[:, :k])
+        keys = np.zeros(len(digits), dtype=np.int64)
+        for j in range(k):
+            keys = keys * self.base + digits[:, j]
+        return keys, ~missing.any(axis=1)
+
+    # contexts: (rows, order) codes, next_codes: the syscall that followed each context (NaN if none)
+    def fit_contexts(self, contexts, next_codes):
+        contexts = np.asarray(contexts, dtype=np.float64)
+        next_codes = np.asarray(next_codes, dtype=np.float64)
+
+        observed = np.concatenate([contexts[~np.isnan(contexts)], next_codes[~np.isnan(next_codes)]])
+        self.base = int(observed.max()) + 2 if observed.size else 2
+        if float(self.base) ** (self.order + 1) >= 2 ** 62:
+            raise ValueError(f"Order {self.order} is too large for a vocabulary of {self.base - 2} syscalls")
+
+        has_next = ~np.isnan(next_codes)
+        next_digits, _ = self._digits(next_codes)
+        if has_next.any():
+            self.fallback = int(np.bincount(next_digits[has_next]).argmax()) - 1
+
+        for k in range(1, self.order + 1):
+            keys, valid = self._pack(contexts, k)
+            valid &= has_next
+            pairs, counts = np.unique(keys[valid] * self.base + next_digits[valid], return_counts=True)
+            context_keys, nexts = pairs // self.base, pairs % self.base
+
+            # Most frequent next syscall per context, ties go to the smallest code
+            ranking = np.lexsort((nexts, -counts, context_keys))
+            first = np.r_[True, context_keys[ranking][1:] != context_keys[ranking][:-1]]
+            self.keys[k] = context_keys[ranking][first]
+            self.next_codes[k] = nexts[ranking][first] - 1
+
+        return self
+
+    # One pass over the encoded syscall array of a single trace
+    def fit(self, systemcall_encoded):
+        codes = np.asarray(systemcall_encoded, dtype=np.float64)
+        contexts = np.full((len(codes), self.order), np.nan)
+        for j in range(self.order):
+            contexts[j:, j] = codes[:len(codes) - j]
+        next_codes = np.r_[codes[1:], np.nan]
+        return self.fit_contexts(contexts, next_codes)
+
+    # Fit from a preprocessed frame (lag columns + target), also valid for sampled or concatenated runs
+    def fit_frame(self, data, target_column):
+        contexts = data[self.context_columns(self.order)].to_numpy(dtype=np.float64)
+        first_next = data[target_column].astype(str).str.split(',', n=1).str[0]
+        next_codes = pd.to_numeric(first_next, errors='coerce').to_numpy(dtype=np.float64)
+        return self.fit_contexts(contexts, next_codes)
+
+    def _predict_next(self, contexts):
+        predictions = np.full(len(contexts), self.fallback, dtype=np.int64)
+        resolved = np.zeros(len(contexts), dtype=bool)
+        for k in range(self.order, 0, -1):
+            keys, valid = self._pack(contexts, k)
+            table = self.keys[k]
+            if not len(table):
+                continue
+            positions = np.minimum(np.searchsorted(table, keys), len(table) - 1)
+            found = valid & ~resolved & (table[positions] == keys)
+            predictions[found] = self.next_codes[k][positions[found]]
+            resolved |= found
+        return predictions
+
+    def predict_codes(self, contexts):
+        contexts = np.array(contexts, dtype=np.float64)
+        steps = []
+        for _ in range(self.num_predictions):
+            predicted = self._predict_next(contexts)
+            steps.append(predicted)
+            # The prediction becomes the current syscall of the next step
+            contexts = np.column_stack([predicted.astype(np.float64), contexts[:, :-1]])
+        return np.column_stack(steps)
+
+    def predict(self, data):
+        codes = self.predict_codes(data[self.context_columns(self.order)].to_numpy(dtype=np.float64))
+        strings = codes[:, 0].astype(str).astype(object)
+        for i in range(1, codes.shape[1]):
+            strings = strings + ',' + codes[:, i].astype(str)
+        return pd.Series(strings, index=data.index)
+
+    # First-order model read from the lag-1 counts of a TransitionMatrix built over encoded syscalls
+    @classmethod
+    def from_transition_matrix(cls, transitions, num_predictions=1):
+        counts = transitions.counts[0]
+        model = cls(1, num_predictions)
+        model.base = len(transitions.labels) + 1
+        followed = np.flatnonzero(counts.sum(axis=1) > 0)
+        model.keys[1] = followed + 1
+        model.next_codes[1] = transitions.most_likely_next(1)[followed]
+        if counts.any():
+            model.fallback = int(counts.sum(axis=0).argmax())
+        return model
+
+    def save(self, path):
+        arrays = {f'keys_{k}': keys for k, keys in self.keys.items()}
+        arrays.update({f'next_{k}': codes for k, codes in self.next_codes.items()})
+        np.savez(path, meta=np.array([self.order, self.num_predictions, self.base, self.fallback]), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            order, num_predictions, base, fallback = (int(v) for v in stored['meta'])
+            model = cls(order, num_predictions)
+            model.base, model.fallback = base, fallback
+            for k in range(1, order + 1):
+                model.keys[k] = stored[f'keys_{k}']
+                model.next_codes[k] = stored[f'next_{k}']
+        return model
@@ -3,11 +3,13 @@ from data_gathering import *
 from data_preprocessing import *
 from data_visualization import *
 from model_evaluation import *
+from model_registry import *
 
 import argparse
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 import sys
 import logging
+import time
 from autogluon.tabular import TabularPredictor
 from autogluon.multimodal import MultiModalPredictor
 from fastai.learner import load_learner
@@ -20,31 +22,31 @@ target_column = 'next_systemcalls'
 
 ############ Data loading and preprocessing ############
 
-def load_and_preprocess_data(base_dir, app, case, run, situation, debug,
-                             type_enc, app_enc, label_enc, num_predictions, is_train=True):
-    if is_train:
-        data = load_training_data(base_dir, app, case, run, situation, debug, ALL_APPLICATIONS)
-    else:
-        data = load_timeseries_data(base_dir, app, case, run, debug)
+# Only the test run is needed: the registered model carries the encoders fitted on the training data
+def load_and_preprocess_test_data(base_dir, app, case, run, debug, type_enc, app_enc, label_enc, fit_encoder):
+    data = load_timeseries_data(base_dir, app, case, run, debug)
 
     first_rows(data)
 
-    data = preprocessing(data, N, type_enc, app_enc, label_enc)
+    data = preprocessing(data, N, type_enc, app_enc, label_enc, fit_encoder=fit_encoder)
 
-    if is_train:
-        data[target_column] = [get_next_systemcalls(data, num_predictions, idx) for idx in range(len(data))]
-    else:
-        if 'new_path' not in data.columns:
-            data['new_path'] = None
+    # Add relative_time column (in seconds), grouped by run_number
+    data['relative_time'] = data.groupby('run_number')['timestamp'].transform(
+        lambda x: (x - x.min()).dt.total_seconds().astype(int)
+    )
+
+    if 'new_path' not in data.columns:
+        data['new_path'] = None
     return data
 
 
 ############ Model evaluation ############
 
-def evaluate_and_plot(predictor, test_data, feature_cols, output_folder, num_predictions, label_enc):
+def evaluate_and_plot(predictor, test_data, feature_cols, output_folder, num_predictions, label_enc,
+                      plot_workers=None, tables_only=False):
     predictions = predictor.predict(test_data[feature_cols])
     #predictions = learner.get_preds(dl=test_data[feature_cols])
-    test_data[target_column] = [get_next_systemcalls(test_data, num_predictions, idx) for idx in range(len(test_data))]
+    test_data[target_column] = build_next_systemcalls(test_data['systemcall_encoded'], num_predictions)
 
     true_seqs = test_data[target_column]
     pred_seqs = predictions
@@ -60,8 +62,8 @@ def evaluate_and_plot(predictor, test_data, feature_cols, output_folder, num_pre
     
     pred_df = save_predictions_csv(test_data, predictions, output_folder, label_enc)
     type_matrix =  "predictions"
-    for call in ALL_SYSTEMCALLS:
-        plot_syscall_followups(pred_df, call, output_folder, type_matrix)
+    plot_all_syscall_followups(pred_df, ALL_SYSTEMCALLS, output_folder, type_matrix,
+                               workers=plot_workers, tables_only=tables_only)
 
     print("Get unique next 10 sequences")
     unique_next10_seqs = get_unique_next10_sequences(pred_df, type_matrix, output_folder)
@@ -75,10 +77,12 @@ def main():
     parser.add_argument('-r', '--run', type=int, required=True, help='Run number to test (1, 2, or 3)')
     parser.add_argument('-s', '--situation', type=str, required=True, help='only/app/all')
     parser.add_argument('-n', '--num_predictions', type=int, required=True, help='Number of the next systemcalls to predict')
-    parser.add_argument('-m', '--model', type=str, required=True, help='Model to load')
+    parser.add_argument('-m', '--model', type=str, required=True, help='Registered model name (or folder under AutogluonModels/)')
     parser.add_argument('-w',  '--warm_up', type=int, required=True, help='Warm up time to be disconsidered on the test dataset (in seconds)')
     parser.add_argument('-o', '--output', type=str, required=True, help='Output folder')
     parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('-t', '--tables_only', action='store_true', help='Only write the follow-up tables, no plots')
+    parser.add_argument('--plot_workers', type=int, default=None, help='Processes rendering the plots (default: all CPUs)')
     args = parser.parse_args()
 
     app_base = args.application
@@ -95,23 +99,38 @@ def main():
     sys.stdout = StreamToLogger(logging.getLogger('STDOUT'), logging.INFO)
     sys.stderr = StreamToLogger(logging.getLogger('STDERR'), logging.ERROR)
 
-    type_enc, app_enc, label_enc = create_encoders()
-    
-    test_data = load_and_preprocess_data(base_dir, app_base, case_base, run_base, situation_base, debug_base,
-                                         type_enc, app_enc, label_enc, num_predictions, is_train=False)
+    start = time.perf_counter()
+    if is_registered(model_base):
+        artifact = load_model(model_base)
+        encoders = artifact.encoders
+        type_enc, app_enc, label_enc = encoders['type'], encoders['application'], encoders['label']
+        predictor = artifact.predictor
+        feature_columns = artifact.feature_columns
+        fit_encoder = False
+    else:
+        # Models trained before the registry: full training folder, encoders refitted on the test run
+        logging.info(f"{model_base} is not registered, loading {models_dir + model_base}")
+        type_enc, app_enc, label_enc = create_encoders()
+        predictor = TabularPredictor.load(models_dir+model_base)
+        feature_columns = None
+        fit_encoder = True
+    logging.info(f"Model ready in {time.perf_counter() - start:.1f}s")
 
-    train_data = load_and_preprocess_data(base_dir, app_base, case_base, run_base, situation_base, debug_base,
-                                          type_enc, app_enc, label_enc, num_predictions, is_train=True)
+    test_data = load_and_preprocess_test_data(base_dir, app_base, case_base, run_base, debug_base,
+                                              type_enc, app_enc, label_enc, fit_encoder)
 
     print(test_data.isnull().sum())
 
-    feature_columns = [col for col in test_data.columns if col != target_column]
-    predictor = TabularPredictor.load(models_dir+model_base)
+    if feature_columns is None:
+        feature_columns = [col for col in test_data.columns if col not in (target_column, 'relative_time')]
+    else:
+        test_data = test_data.assign(**{column: None for column in feature_columns if column not in test_data.columns})
 
     # Filter out the warm-up period using relative_time
     df_filtered = test_data[test_data['relative_time'] >= warm_up]
 
-    evaluate_and_plot(predictor, test_data, feature_columns, output_folder, num_predictions, label_enc)
+    evaluate_and_plot(predictor, test_data, feature_columns, output_folder, num_predictions, label_enc,
+                      args.plot_workers, args.tables_only)
         
 
 
@@ -0,0 +1,269 @@
+from setup_environment import *
+from data_preprocessing import *
+from model_evaluation import *
+from model_inference import *
+
+from collections import Counter
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import logging
+
+
+############ Setup ############
+
+TRACE_FILE_PATTERN = re.compile(r'(\d+)_(\d+)$')
+NS_PER_SECOND = 1_000_000_000
+NS_PER_DAY = 86400 * NS_PER_SECOND
+
+# The live trace has no type column, the categories are the ones convert_tracer_to_json.py writes offline
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from convert_tracer_to_json import CATEGORIES
+SYSTEMCALL_TYPES = {systemcall: call_type for call_type, systemcalls in CATEGORIES.items() for systemcall in systemcalls}
+
+
+def to_iso(timestamp_ns):
+    return datetime.fromtimestamp(timestamp_ns / NS_PER_SECOND, tz=timezone.utc).isoformat()
+
+
+############ Trace tailing ############
+
+# Follows the <pid>_<tid> files written by BufferedWriter::flushBuffer. The collector appends whole
+# buffers, so only complete lines are consumed and a trailing partial line waits for the next poll.
+class TraceTailer:
+
+    def __init__(self, trace_dir, idle_timeout):
+        self.trace_dir = trace_dir
+        self.idle_timeout = idle_timeout
+        self.offsets = {}
+        self.partial = {}
+        self.last_timestamp = {}
+        self.last_activity = {}
+
+    def poll(self):
+        events = []
+        now = time.monotonic()
+        for entry in os.scandir(self.trace_dir):
+            if not entry.is_file() or not TRACE_FILE_PATTERN.search(entry.name):
+                continue
+
+            offset = self.offsets.get(entry.path, 0)
+            size = entry.stat().st_size
+            if size < offset:
+                # The file was truncated or replaced, start over
+                offset = 0
+                self.partial[entry.path] = b''
+            if size == offset:
+                continue
+
+            with open(entry.path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+            self.offsets[entry.path] = offset + len(chunk)
+            self.last_activity[entry.path] = now
+
+            lines = (self.partial.get(entry.path, b'') + chunk).split(b'\n')
+            self.partial[entry.path] = lines.pop()
+
+            for line in lines:
+                fields = line.decode('utf-8', errors='replace').strip().split(',')
+                if len(fields) != 11 or not fields[1].isdigit():
+                    continue
+                events.append(fields)
+                self.last_timestamp[entry.path] = max(self.last_timestamp.get(entry.path, 0), int(fields[1]))
+
+        return events
+
+    # Event time up to which every active file has been read. Files idle for longer than idle_timeout
+    # no longer hold the watermark back, when all of them are idle the wall clock is used.
+    def watermark(self, allowed_lateness_ns):
+        now = time.monotonic()
+        active = [self.last_timestamp[path] for path, seen in self.last_activity.items()
+                  if now - seen < self.idle_timeout and path in self.last_timestamp]
+        if active:
+            return min(active) - allowed_lateness_ns
+        return time.time_ns() - allowed_lateness_ns
+
+
+############ Rolling windows ############
+
+class WindowState:
+
+    def __init__(self):
+        self.total_syscalls = 0
+        self.systemcalls = Counter()
+        self.types = Counter()
+        self.bytes_read = 0.0
+        self.bytes_written = 0.0
+        self.files = set()
+        self.pids = set()
+
+
+# Windows are aligned like preprocessing_aggregate (midnight of the first day) so the features
+# of a closed window match the offline ones, empty windows are emitted as well.
+class StreamingWindowAggregator:
+
+    def __init__(self, window_size_sec, run_number):
+        self.window_ns = window_size_sec * NS_PER_SECOND
+        self.run_number = run_number
+        self.origin = None
+        self.first_bin = None
+        self.next_bin = None
+        self.windows = {}
+        self.late_events = 0
+
+    def add(self, events):
+        for systemcall, timestamp, tid, pid, node, descriptor, path, new_path, offset, size, return_value in events:
+            timestamp = int(timestamp)
+            if self.origin is None:
+                self.origin = timestamp // NS_PER_DAY * NS_PER_DAY
+
+            window_bin = (timestamp - self.origin) // self.window_ns
+            if self.next_bin is not None and window_bin < self.next_bin:
+                self.late_events += 1
+                continue
+
+            window = self.windows.get(window_bin)
+            if window is None:
+                window = self.windows[window_bin] = WindowState()
+            window.total_syscalls += 1
+            window.systemcalls[systemcall] += 1
+            window.types[SYSTEMCALL_TYPES.get(systemcall, 'unknown')] += 1
+            if size.strip().isdigit():
+                if systemcall in READ_SYSTEMCALLS:
+                    window.bytes_read += int(size)
+                elif systemcall in WRITE_SYSTEMCALLS:
+                    window.bytes_written += int(size)
+            if path.strip():
+                window.files.add(path)
+            window.pids.add(pid)
+
+    # Close every window that ends at or before the watermark, returns (start_ns, WindowState) in order
+    def advance(self, watermark_ns):
+        if self.origin is None:
+            return []
+        if self.next_bin is None:
+            if not self.windows:
+                return []
+            self.next_bin = self.first_bin = min(self.windows)
+
+        closed = []
+        while self.origin + (self.next_bin + 1) * self.window_ns <= watermark_ns:
+            closed.append((self.origin + self.next_bin * self.window_ns, self.windows.pop(self.next_bin, WindowState())))
+            self.next_bin += 1
+        return closed
+
+    def close_all(self):
+        if not self.windows:
+            return []
+        last_bin = max(self.windows)
+        return self.advance(self.origin + (last_bin + 1) * self.window_ns)
+
+    def features(self, start_ns, window, feature_columns):
+        values = {
+            'run_number': self.run_number,
+            'relative_time': (start_ns - self.origin - self.first_bin * self.window_ns) // NS_PER_SECOND,
+            'total_syscalls': window.total_syscalls,
+            'bytes_read': window.bytes_read,
+            'bytes_written': window.bytes_written,
+            'distinct_files': len(window.files),
+            'distinct_pids': len(window.pids),
+        }
+        row = []
+        for column in feature_columns:
+            if column in values:
+                row.append(values[column])
+            elif column.startswith('syscall_'):
+                row.append(window.systemcalls[column[len('syscall_'):]])
+            elif column.startswith('type_'):
+                row.append(window.types[column[len('type_'):]])
+            else:
+                row.append(0)
+        return row
+
+
+############ Streaming loop ############
+
+def emit_predictions(out, closed, predictions, window_ns):
+    latencies = []
+    for (start_ns, window), prediction in zip(closed, predictions):
+        now_ns = time.time_ns()
+        # End-to-end latency: from the end of the window (trace clock) to the moment its prediction is out
+        latency = (now_ns - (start_ns + window_ns)) / NS_PER_SECOND
+        latencies.append(latency)
+        out.write(json.dumps({
+            'window_start': to_iso(start_ns),
+            'window_end': to_iso(start_ns + window_ns),
+            'total_syscalls': window.total_syscalls,
+            'seconds_to_next_burst': float(prediction),
+            'predicted_burst_at': to_iso(start_ns + int(float(prediction) * NS_PER_SECOND)),
+            'latency_ms': latency * 1000,
+        }) + "\n")
+    out.flush()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Live System Call Burst Prediction from the trace collector output')
+    parser.add_argument('-t', '--trace_dir', type=str, required=True, help='Folder where the collector writes the <pid>_<tid> files')
+    parser.add_argument('-m', '--model', type=str, required=True, help='Burst model to load (trained by pipeline_case3.py)')
+    parser.add_argument('-r', '--run', type=int, default=1, help='Run number given to the model')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output folder')
+    parser.add_argument('-w', '--window', type=int, default=TIME_THRESHOLD, help='Window size in seconds')
+    parser.add_argument('-p', '--poll_interval', type=float, default=0.5, help='Seconds between two scans of the trace files')
+    parser.add_argument('-l', '--allowed_lateness', type=float, default=1.0, help='Seconds a window stays open after the watermark passes its end')
+    parser.add_argument('-i', '--idle_timeout', type=float, default=5.0, help='Seconds without new lines before a file stops holding the watermark')
+    parser.add_argument('--once', action='store_true', help='Consume the files already written, close every window and exit')
+    parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
+    args = parser.parse_args()
+
+    configure_logging(args.output, args.debug)
+
+    from autogluon.tabular import TabularPredictor
+    predictor = TabularPredictor.load(os.path.join(models_dir, args.model))
+    feature_columns = predictor.features()
+    if args.debug:
+        logging.info(f"Loaded {args.model}, features: {feature_columns}")
+
+    tailer = TraceTailer(args.trace_dir, args.idle_timeout)
+    aggregator = StreamingWindowAggregator(args.window, args.run)
+    batcher = MicroBatchPredictor(predictor, feature_columns, batch_size=64)
+    allowed_lateness_ns = int(args.allowed_lateness * NS_PER_SECOND)
+    end_to_end_latencies = []
+
+    with open(os.path.join(args.output, 'stream_predictions.ndjson'), 'a') as out:
+        try:
+            while True:
+                aggregator.add(tailer.poll())
+                if args.once:
+                    closed = aggregator.close_all()
+                else:
+                    closed = aggregator.advance(tailer.watermark(allowed_lateness_ns))
+
+                # Windows closing in the same poll are predicted together
+                predictions = []
+                for start_ns, window in closed:
+                    predictions.extend(batcher.submit(aggregator.features(start_ns, window, feature_columns)))
+                predictions.extend(batcher.flush())
+                end_to_end_latencies.extend(emit_predictions(out, closed, predictions, aggregator.window_ns))
+
+                if args.debug and closed:
+                    logging.info(f"Closed {len(closed)} windows, {aggregator.late_events} late events dropped so far")
+                if args.once:
+                    break
+                time.sleep(args.poll_interval)
+        except KeyboardInterrupt:
+            logging.info("Stopping the stream")
+
+    save_latency_report(args.output, {
+        'predict_per_window': batcher.report(),
+        'end_to_end_per_window': latency_summary(end_to_end_latencies),
+    }, 'stream_latency.txt')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules import each other by name (from data_gathering import *), as when run from ml_pipeline/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+import numpy as np
+from clock_alignment import estimate_clock_offsets
+
+T0 = 1_700_000_000 * 10**9
+
+
+def barrier_events(rng, skew_ns, bursts):
+    # 50 syscalls within a few ms of every barrier, stamped by a clock skew_ns ahead
+    events = np.repeat(bursts, 50) + rng.exponential(3e6, len(bursts) * 50).astype(np.int64)
+    return np.sort(events + skew_ns)
+
+
+def test_periodic_bursts_take_the_period_nearest_the_start_markers():
+    rng = np.random.default_rng(0)
+    # A barrier every second for 5 min: lags of +1300 ms and -700 ms line up the bursts equally well
+    bursts = T0 + np.arange(300) * 10**9
+    events = {'a': barrier_events(rng, 0, bursts), 'b': barrier_events(rng, 1_300_000_000, bursts)}
+
+    # srun starts the nodes within some tens of ms
+    offsets = estimate_clock_offsets(events, starts={'a': T0, 'b': T0 + 1_340_000_000})['offsets']
+
+    assert offsets['b']['method'] == 'bursts'
+    assert abs(offsets['b']['offset_ns'] - 1_300_000_000) < 10_000_000
+
+
+def test_start_markers_are_used_when_no_burst_agrees_with_them():
+    rng = np.random.default_rng(1)
+    bursts = T0 + np.sort(rng.uniform(0, 300e9, 300)).astype(np.int64)
+    events = {'a': barrier_events(rng, 0, bursts), 'b': barrier_events(rng, 1_300_000_000, bursts)}
+
+    # Start markers 2 s away from the burst offset
+    offsets = estimate_clock_offsets(events, starts={'a': T0, 'b': T0 + 3_300_000_000})['offsets']
+    assert offsets['b']['method'] == 'start'
+    assert offsets['b']['offset_ns'] == 3_300_000_000
+
+    # Without start markers of their own the nodes start at their first event, the bursts decide
+    offsets = estimate_clock_offsets(events)['offsets']
+    assert offsets['b']['method'] == 'bursts'
+    assert abs(offsets['b']['offset_ns'] - 1_300_000_000) < 10_000_000
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from data_alignment import align_events, align_windows
+
+
+def test_rows_without_timestamp_are_left_out_of_the_join():
+    events = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:01.5', None, '2025-02-27 09:00:02.5', '2025-02-27 09:00:00.5']),
+        'node': ['c101', 'c101', 'c101', 'c101'],
+        'systemcall': ['read', 'write', 'read', 'openat'],
+    }, index=[10, 11, 12, 13])
+    dstat = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:01', None, '2025-02-27 09:00:02']),
+        'node': ['c101.frontera.tacc.utexas.edu'] * 3,
+        'cpu_usr': [1.0, 99.0, 2.0],
+    })
+
+    aligned = align_events(events, dstat=dstat)
+
+    assert aligned.index.tolist() == [10, 11, 12, 13]
+    np.testing.assert_array_equal(aligned['dstat_cpu_usr'], [1.0, np.nan, 2.0, np.nan])
+    np.testing.assert_array_equal(aligned['dstat_age_s'], [0.5, np.nan, 0.5, np.nan])
+
+
+def _dstat_two_nodes():
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:03', '2025-02-27 09:00:08', '2025-02-27 09:00:09', '2025-02-27 09:00:12']),
+        'node': ['c101', 'c101', 'c102', 'c101'],
+        'cpu_usr': [10.0, 20.0, 30.0, 40.0],
+    })
+
+
+def test_windows_get_the_mean_over_the_nodes_of_their_last_sample():
+    windows = pd.DataFrame({
+        'run_number': 1,
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:00', '2025-02-27 09:00:10']),
+        'total_syscalls': [5, 7],
+    })
+
+    # Window [09:00:00, 09:00:10): c101 at 09:00:08 (20, 2 s old), c102 at 09:00:09 (30, 1 s old)
+    # Window [09:00:10, 09:00:20): c101 at 09:00:12 is 8 s old and c102 at 09:00:09 11 s old, both stale at 5 s
+    aligned = align_windows(windows, 10, dstat=_dstat_two_nodes())
+    np.testing.assert_allclose(aligned['dstat_cpu_usr'], [25.0, np.nan])
+    np.testing.assert_allclose(aligned['dstat_age_s'], [1.5 - 1e-9, np.nan])
+    assert aligned['total_syscalls'].tolist() == [5, 7]
+
+    # With a 10 s tolerance only c102 is still stale in the second window
+    aligned = align_windows(windows, 10, dstat=_dstat_two_nodes(), tolerance=pd.Timedelta(seconds=10))
+    np.testing.assert_allclose(aligned['dstat_cpu_usr'], [25.0, 40.0])
+    np.testing.assert_allclose(aligned['dstat_age_s'], [1.5 - 1e-9, 8.0 - 1e-9])
+
+
+def test_windows_shorter_than_a_second():
+    windows = pd.DataFrame({
+        'run_number': 1,
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:08.0', '2025-02-27 09:00:08.5']),
+    })
+
+    # Only c101 has a sample before 09:00:09
+    aligned = align_windows(windows, 0.5, dstat=_dstat_two_nodes())
+    np.testing.assert_allclose(aligned['dstat_cpu_usr'], [20.0, 20.0])
+    np.testing.assert_allclose(aligned['dstat_age_s'], [0.5 - 1e-9, 1.0 - 1e-9])
+
+
+def test_event_samples_older_than_the_tolerance_are_not_attached():
+    events = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:08.25', '2025-02-27 09:00:19.00', '2025-02-27 09:00:19.00']),
+        'node': ['c101', 'c101', 'c102'],
+    })
+
+    aligned = align_events(events, dstat=_dstat_two_nodes())
+    np.testing.assert_allclose(aligned['dstat_cpu_usr'], [20.0, np.nan, np.nan])
+    np.testing.assert_allclose(aligned['dstat_age_s'], [0.25, np.nan, np.nan])
+
+    aligned = align_events(events, dstat=_dstat_two_nodes(), tolerance=pd.Timedelta(seconds=10))
+    np.testing.assert_allclose(aligned['dstat_cpu_usr'], [20.0, 40.0, 30.0])
+    np.testing.assert_allclose(aligned['dstat_age_s'], [0.25, 7.0, 10.0])
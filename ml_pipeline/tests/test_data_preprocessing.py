@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from data_preprocessing import aggregate_windows
+
+
+def test_total_syscalls_counts_syscalls_outside_the_vocabulary():
+    timestamps = pd.date_range('2025-02-27 09:00:00', periods=30, freq='100ms')
+    df = pd.DataFrame({
+        'timestamp': timestamps,
+        'systemcall': ['read', 'write', 'ioctl'] * 10,
+        'type': ['datacall'] * 30,
+        'run_number': 1,
+    })
+
+    # ioctl was not seen in training
+    windows = aggregate_windows(df, [1], systemcalls=['read', 'write'])[1]
+
+    assert windows['total_syscalls'].tolist() == [10, 10, 10]
+    assert windows['syscall_read'].tolist() == [4, 3, 3]
+    assert windows['syscall_write'].tolist() == [3, 4, 3]
+    assert 'syscall_ioctl' not in windows.columns
+
+    without_vocabulary = aggregate_windows(df, [1])[1]
+    np.testing.assert_array_equal(windows['total_syscalls'], without_vocabulary['total_syscalls'])
+
+
+def test_events_without_timestamp_are_left_out_of_the_windows():
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2025-02-27 09:00:01', None, '2025-02-27 09:00:31', '2025-02-27 09:00:32']),
+        'systemcall': ['read', 'write', 'read', 'read'],
+        'type': ['datacall'] * 4,
+        'run_number': 1,
+    })
+
+    windows = aggregate_windows(df, [30])[30]
+
+    assert windows['timestamp'].tolist() == list(pd.to_datetime(['2025-02-27 09:00:00', '2025-02-27 09:00:30']))
+    assert windows['total_syscalls'].tolist() == [1, 2]
+    assert 'syscall_write' not in windows.columns
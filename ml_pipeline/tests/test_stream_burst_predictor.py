@@ -0,0 +1,38 @@
+from stream_burst_predictor import TraceTailer, StreamingWindowAggregator, NS_PER_SECOND
+
+# 2025-02-27 09:00:00 UTC
+START_NS = 1740646800 * NS_PER_SECOND
+
+
+def collector_line(systemcall, timestamp_ns, path='', size=''):
+    return f"{systemcall},{timestamp_ns},7,42,c101,3,{path},,,{size},0\n"
+
+
+def test_collector_lines_are_counted_in_their_windows(tmp_path):
+    lines = [
+        collector_line('openat', START_NS + 1 * NS_PER_SECOND, path='/data/a'),
+        collector_line('read', START_NS + 2 * NS_PER_SECOND, path='/data/a', size='4096'),
+        collector_line('write', START_NS + 12 * NS_PER_SECOND, path='/data/b', size='100'),
+        collector_line('read', START_NS + 31 * NS_PER_SECOND, path='/data/a', size='10'),
+    ]
+    # The last line is still being written by the collector
+    (tmp_path / '42_7').write_text(''.join(lines) + 'read,17406468')
+
+    tailer = TraceTailer(str(tmp_path), idle_timeout=5.0)
+    aggregator = StreamingWindowAggregator(10, run_number=1)
+    aggregator.add(tailer.poll())
+
+    # The watermark at 30 s closes the windows [0, 10), [10, 20) and the empty [20, 30)
+    closed = aggregator.advance(START_NS + 30 * NS_PER_SECOND)
+    assert [start for start, _ in closed] == [START_NS, START_NS + 10 * NS_PER_SECOND, START_NS + 20 * NS_PER_SECOND]
+    assert [window.total_syscalls for _, window in closed] == [2, 1, 0]
+
+    columns = ['relative_time', 'total_syscalls', 'syscall_read', 'type_metadatacall', 'type_datacall',
+               'bytes_read', 'bytes_written', 'distinct_files']
+    assert aggregator.features(*closed[0], columns) == [0, 2, 1, 1, 1, 4096.0, 0.0, 1]
+    assert aggregator.features(*closed[1], columns) == [10, 1, 0, 0, 1, 0.0, 100.0, 1]
+
+    # Events behind the closed windows are counted as late, the open window closes at the end
+    aggregator.add([collector_line('read', START_NS + 5 * NS_PER_SECOND).strip().split(',')])
+    assert aggregator.late_events == 1
+    assert [window.total_syscalls for _, window in aggregator.close_all()] == [1]
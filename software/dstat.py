@@ -24,12 +24,14 @@ import fnmatch
 import getopt
 import getpass
 import glob
-import linecache
+import json
 import os
 import re
 import resource
 import sched
+import signal
 import six
+import struct
 import sys
 import time
 
@@ -59,6 +61,8 @@ class Options:
         self.disklist = None
         self.full = False
         self.float = False
+        self.gpubackend = None
+        self.gpureplay = None
         self.integer = False
         self.intlist = None
         self.netlist = None
@@ -66,8 +70,14 @@ class Options:
         self.color = None
         self.update = True
         self.header = True
+        self.headless = False
+        self.interval = None
         self.output = False
+        self.outputbin = False
         self.pidfile = False
+        self.pidioppid = None
+        self.pidiopidfile = None
+        self.pidiooutput = None
         self.profile = ''
 
         ### List of available plugins
@@ -92,9 +102,9 @@ class Options:
         try:
             opts, args = getopt.getopt(args, 'acdfghilmno:prstTvyC:D:I:M:N:S:V',
                 ['all', 'all-plugins', 'bits', 'bw', 'black-on-white', 'color',
-                 'debug', 'filesystem', 'float', 'full', 'help', 'integer',
-                 'list', 'mods', 'modules', 'nocolor', 'noheaders', 'noupdate',
-                 'output=', 'pidfile=', 'profile', 'version', 'vmstat'] + allplugins)
+                 'debug', 'filesystem', 'float', 'full', 'gpu-backend=', 'gpu-replay=', 'headless', 'help', 'integer',
+                 'interval=', 'list', 'mods', 'modules', 'nocolor', 'noheaders', 'noupdate',
+                 'output=', 'output-bin=', 'pidfile=', 'pidio-output=', 'pidio-pidfile=', 'pidio-ppid=', 'profile', 'version', 'vmstat'] + allplugins)
         except getopt.error as exc:
             print('dstat: %s, try dstat -h for a list of all the options' % exc)
             sys.exit(1)
@@ -112,6 +122,14 @@ class Options:
                 self.plugins.append('fs')
             elif opt in ['-g']:
                 self.plugins.append('page')
+            elif opt in ['--gpu-backend']:
+                if arg not in gpubackends:
+                    print('dstat: unknown gpu backend %s, choose from %s' % (arg, ', '.join(gpubackends)))
+                    sys.exit(1)
+                self.gpubackend = arg
+            elif opt in ['--gpu-replay']:
+                self.gpubackend = 'replay'
+                self.gpureplay = arg
             elif opt in ['-i']:
                 self.plugins.append('int')
             elif opt in ['-I']:
@@ -129,6 +147,16 @@ class Options:
                 self.netlist = arg.split(',')
             elif opt in ['-p']:
                 self.plugins.append('proc')
+            elif opt in ['--pidio-output']:
+                self.pidiooutput = arg
+            elif opt in ['--pidio-pidfile']:
+                self.pidiopidfile = arg
+            elif opt in ['--pidio-ppid']:
+                try:
+                    self.pidioppid = int(arg)
+                except ValueError:
+                    print('dstat: --pidio-ppid must be a process id')
+                    sys.exit(1)
             elif opt in ['-r']:
                 self.plugins.append('io')
             elif opt in ['-s']:
@@ -168,8 +196,19 @@ class Options:
                 self.debug = self.debug + 1
             elif opt in ['--float']:
                 self.float = True
+            elif opt in ['--headless']:
+                self.headless = True
             elif opt in ['--integer']:
                 self.integer = True
+            elif opt in ['--interval']:
+                try:
+                    self.interval = int(arg)
+                except ValueError:
+                    self.interval = 0
+                if self.interval <= 0:
+                    print('dstat: interval must be an integer number of milliseconds, greater than zero')
+                    sys.exit(1)
+                self.headless = True
             elif opt in ['--list']:
                 showplugins()
                 sys.exit(0)
@@ -181,6 +220,8 @@ class Options:
                 self.update = False
             elif opt in ['-o', '--output']:
                 self.output = arg
+            elif opt in ['--output-bin']:
+                self.outputbin = arg
             elif opt in ['--pidfile']:
                 self.pidfile = arg
             elif opt in ['--profile']:
@@ -217,6 +258,15 @@ class Options:
             print('dstat: delay must be an integer, greater than zero')
             sys.exit(1)
 
+        ### Headless mode samples every interval ms (default: delay) and only writes CSV records
+        if self.headless:
+            if self.interval is None:
+                self.interval = self.delay * 1000
+            self.delay = 1
+            self.color = False
+            self.header = False
+            self.update = False
+
         if self.debug:
             print('Plugins: %s' % self.plugins)
 
@@ -274,8 +324,15 @@ Dstat options:
 
   --aio                    enable aio stats
   --fs, --filesystem       enable fs stats
+  --gpu                    enable gpu stats (temperature, utilization, memory in MiB)
+     --gpu-backend nvml       sample through nvml, nvidia-smi, replay or fake (default: nvml, else nvidia-smi)
+     --gpu-replay file        replay the samples of a srun_nvidia log (implies --gpu-backend replay)
   --ipc                    enable ipc stats
   --lock                   enable lock stats
+  --pidio                  enable per-process io stats of a process tree
+     --pidio-ppid 1234        watch process 1234 and its descendants
+     --pidio-pidfile file     watch the processes listed in file and their descendants
+     --pidio-output file      write one CSV row per process and sample to file
   --raw                    enable raw stats
   --socket                 enable socket stats
   --tcp                    enable tcp stats
@@ -302,6 +359,9 @@ Dstat options:
   --noheaders              disable repetitive headers
   --noupdate               disable intermediate updates
   --output file            write CSV output to file
+  --output-bin file        write unrounded values to file as binary records
+  --headless               only collect and write CSV records (to --output file or stdout)
+  --interval ms            sample every ms milliseconds, implies --headless
   --profile                show profiling statistics when exiting dstat
 
 delay is the delay in seconds between each update (default: 1)
@@ -362,10 +422,9 @@ class dstat:
         self.fd = []
         for filename in filenames:
             try:
-                fd = dopen(filename)
-                if fd:
-                    self.file.append(filename)
-                    self.fd.append(fd)
+                fd = procreader.open(filename)
+                self.file.append(filename)
+                self.fd.append(fd)
             except:
                 pass
         if not self.fd:
@@ -373,44 +432,19 @@ class dstat:
 
     def readlines(self):
         "Return lines from any file descriptor"
-        for fd in self.fd:
-            fd.seek(0)
-            for line in fd.readlines():
+        for filename in self.file:
+            for line in procreader.readlines(filename):
                yield line
-        ### Implemented linecache (for top-plugins) but slows down normal plugins
-#        for fd in self.fd:
-#            i = 1
-#            while True:
-#                line = linecache.getline(fd.name, i);
-#                if not line: break
-#                yield line
-#                i += 1
 
     def splitline(self, sep=None):
-        for fd in self.fd:
-            fd.seek(0)
-            return fd.read().split(sep)
+        for filename in self.file:
+            return procreader.read(filename).split(sep)
 
     def splitlines(self, sep=None, replace=None):
         "Return split lines from any file descriptor"
-        for fd in self.fd:
-            fd.seek(0)
-            for line in fd.readlines():
-                if replace and sep:
-                    yield line.replace(replace, sep).split(sep)
-                elif replace:
-                    yield line.replace(replace, ' ').split()
-                else:
-                    yield line.split(sep)
-#        ### Implemented linecache (for top-plugins) but slows down normal plugins
-#        for fd in self.fd:
-#                if replace and sep:
-#                    yield line.replace(replace, sep).split(sep)
-#                elif replace:
-#                    yield line.replace(replace, ' ').split()
-#                else:
-#                    yield line.split(sep)
-#                i += 1
+        for filename in self.file:
+            for l in procreader.splitlines(filename, sep, replace):
+                yield l
 
     def statwidth(self):
         "Return complete stat width"
@@ -557,6 +591,50 @@ class dstat:
                 line = line + char['sep']
         return line
 
+    def binvars(self):
+        "Return the indexes and names of the numeric variables (string and time types are left out)"
+        ret = []
+        for i, name in enumerate(self.vars):
+            if i < len(self.types):
+                ctype = self.types[i]
+            else:
+                ctype = self.type
+            if ctype not in ('s', 't'):
+                ret.append((i, name))
+        return ret
+
+    def bincolumns(self):
+        "Return the (group, nick) of every numeric value, in record order"
+        ret = []
+        for i, name in self.binvars():
+            val = self.val[name]
+            if isinstance(self.name, six.string_types):
+                group = self.name
+            else:
+                group = self.name[i]
+            if isinstance(val, (tuple, list)):
+                for j in range(len(val)):
+                    ret.append((group, self.nick[j]))
+            elif i < len(self.nick):
+                ret.append((group, self.nick[i]))
+            else:
+                ret.append((group, name))
+        return ret
+
+    def binvalues(self):
+        "Return the numeric values as floats, in the order of bincolumns()"
+        ret = []
+        for i, name in self.binvars():
+            val = self.val[name]
+            if not isinstance(val, (tuple, list)):
+                val = (val,)
+            for v in val:
+                try:
+                    ret.append(float(v))
+                except (TypeError, ValueError):
+                    ret.append(float('nan'))
+        return ret
+
     def showcsvend(self, totlist, vislist):
         if vislist and self is not vislist[-1]:
             return char['sep']
@@ -1026,12 +1104,10 @@ class dstat_fs(dstat):
         self.scale = 1000
 
     def extract(self):
-        for line in dopen('/proc/sys/fs/file-nr'):
-            l = line.split()
+        for l in proc_splitlines('/proc/sys/fs/file-nr'):
             if len(l) < 1: continue
             self.val['files'] = int(l[0])
-        for line in dopen('/proc/sys/fs/inode-nr'):
-            l = line.split()
+        for l in proc_splitlines('/proc/sys/fs/inode-nr'):
             if len(l) < 2: continue
             self.val['inodes'] = int(l[0]) - int(l[1])
 
@@ -1046,7 +1122,7 @@ class dstat_int(dstat):
 
     def intmap(self):
         ret = {}
-        for line in dopen('/proc/interrupts'):
+        for line in proc_readlines('/proc/interrupts'):
             l = line.split()
             if len(l) <= cpunr: continue
             l1 = l[0].split(':')[0]
@@ -1252,7 +1328,7 @@ class dstat_ipc(dstat):
 
     def extract(self):
         for name in self.vars:
-            self.val[name] = len(dopen('/proc/sysvipc/'+name).readlines()) - 1
+            self.val[name] = len(procreader.readlines('/proc/sysvipc/'+name)) - 1
 
 class dstat_load(dstat):
     def __init__(self):
@@ -1427,6 +1503,123 @@ class dstat_page24(dstat):
         if step == op.delay:
             self.set1.update(self.set2)
 
+class dstat_pidio(dstat):
+    """
+    I/O of a watched process tree, from /proc/<pid>/io
+    Usage:
+        dstat --pidio --pidio-ppid <pid>
+        dstat --pidio --pidio-pidfile <file> --pidio-output <file>
+
+    The roots are the parent pid or the pids in the pidfile (read again every tick, so the
+    tree can start after dstat), descendants are followed through /proc/<pid>/task/*/children.
+    Columns are the rates summed over the tree: bytes read and written through syscalls
+    (rchar, wchar), bytes fetched from and sent to the block layer (read_bytes, write_bytes),
+    read and write syscalls (syscr, syscw) and the number of watched processes.
+    With --pidio-output every sample adds one CSV row per process with its raw counters.
+    """
+    iofields = ('rchar', 'wchar', 'read_bytes', 'write_bytes', 'syscr', 'syscw')
+
+    def __init__(self):
+        self.name = 'pid io'
+        self.nick = ('read', 'writ', 'dsk-r', 'dsk-w', 'sysr', 'sysw', 'pids')
+        self.vars = self.iofields + ('pids',)
+        self.types = ('b', 'b', 'b', 'b', 'd', 'd', 'd')
+        self.scales = (1024, 1024, 1024, 1024, 1000, 1000, 1000)
+        self.width = 5
+        if op.pidioppid is None and not op.pidiopidfile:
+            raise Exception('No process tree to watch, use --pidio-ppid or --pidio-pidfile')
+        self.haschildren = os.path.exists('/proc/%d/task/%d/children' % (os.getpid(), os.getpid()))
+        self.counters1 = {}
+        self.pidiofile = None
+        if op.pidiooutput:
+            self.pidiofile = open(op.pidiooutput, 'a')
+            if self.pidiofile.tell() == 0:
+                self.pidiofile.write('epoch_ns,pid,ppid,comm,' + ','.join(self.iofields) + '\n')
+
+    def roots(self):
+        if not op.pidiopidfile:
+            return [op.pidioppid]
+        try:
+            return [int(pid) for pid in open(op.pidiopidfile).read().split()]
+        except (EnvironmentError, ValueError):
+            return []
+
+    def children(self, pid, ppids):
+        "Return the children of a process, None if it is gone"
+        if not self.haschildren:
+            return ppids.get(pid, [])
+        try:
+            tids = os.listdir('/proc/%d/task' % pid)
+        except OSError:
+            return None
+        ret = []
+        for tid in tids:
+            for l in proc_splitlines('/proc/%d/task/%s/children' % (pid, tid)):
+                ret.extend(int(child) for child in l)
+        return ret
+
+    def parent(self, pid):
+        "Return the parent of a process, from /proc/<pid>/stat"
+        line = proc_readline('/proc/%s/stat' % pid)
+        ### The process name may contain spaces and parentheses
+        l = line[line.rfind(')') + 1:].split()
+        if len(l) < 2:
+            return None
+        return int(l[1])
+
+    def ppids(self):
+        "Return the children of every process (kernels without children files)"
+        ret = {}
+        for pid in proc_pidlist():
+            ppid = self.parent(pid)
+            if ppid is None: continue
+            ret.setdefault(ppid, []).append(int(pid))
+        return ret
+
+    def tree(self):
+        "Return the parent of every watched process"
+        ret = {}
+        ppids = {}
+        if not self.haschildren:
+            ppids = self.ppids()
+        todo = [(pid, self.parent(pid)) for pid in self.roots()]
+        while todo:
+            pid, ppid = todo.pop()
+            if pid in ret: continue
+            children = self.children(pid, ppids)
+            if children is None: continue
+            ret[pid] = ppid
+            todo.extend((child, pid) for child in children)
+        return ret
+
+    def extract(self):
+        tree = self.tree()
+        counters2 = {}
+        for pid in tree:
+            counters = {}
+            for l in proc_splitlines('/proc/%d/io' % pid, ':'):
+                if len(l) < 2 or l[0] not in self.iofields: continue
+                counters[l[0]] = int(l[1])
+            ### Exited processes and processes of other users give no counters
+            if counters:
+                counters2[pid] = counters
+
+        ### New processes count from zero, the last counts of exited processes are lost
+        for name in self.iofields:
+            delta = 0
+            for pid, counters in counters2.items():
+                delta = delta + counters.get(name, 0) - self.counters1.get(pid, {}).get(name, 0)
+            self.val[name] = delta * 1.0 / elapsed
+        self.val['pids'] = len(counters2)
+
+        if step == op.delay:
+            self.counters1 = counters2
+            if self.pidiofile:
+                for pid, counters in sorted(counters2.items()):
+                    comm = proc_readline('/proc/%d/comm' % pid).strip().replace(',', ' ')
+                    values = [str(counters.get(name, 0)) for name in self.iofields]
+                    self.pidiofile.write('%d,%d,%d,%s,%s\n' % (starttime_ns, pid, tree[pid], comm, ','.join(values)))
+
 class dstat_proc(dstat):
     def __init__(self):
         self.name = 'procs'
@@ -1616,9 +1809,8 @@ class dstat_time(dstat):
         self.vars = ('time',)
 
     def extract(self):
-        # Calculate timestamp in nanoseconds since epoch
-        timestamp_ns = int(starttime * 1e9)
-        self.val['time'] = str(timestamp_ns)
+        # Timestamp in nanoseconds since epoch, taken when the sample started
+        self.val['time'] = str(starttime_ns)
 
         
 class dstat_udp(dstat):
@@ -1770,18 +1962,26 @@ class dstat_ib(dstat):
     def name(self):
         return ['ib/'+name for name in self.vars]
 
-    def extract(self):
-        self.set2['total'] = [0, 0]
-        ifaces = self.discover
-        for name in self.vars: self.set2[name] = [0, 0]
-        for name in ifaces:
+    def counters(self):
+        "Return the receive and transmit counter files of every port, they stay open between ticks"
+        ret = []
+        for name in self.discover:
             l=name.split(':');
             if len(l) < 2:
                  continue
-            rcv_counter_name=os.path.join('/sys/class/infiniband', l[0], 'ports', l[1], 'counters/port_rcv_data')
-            xmit_counter_name=os.path.join('/sys/class/infiniband', l[0], 'ports', l[1], 'counters/port_xmit_data')
-            rcv_lines = dopen(rcv_counter_name).readlines()
-            xmit_lines = dopen(xmit_counter_name).readlines()
+            rcv_counter_name=os.path.join(self.ibdirname, l[0], 'ports', l[1], 'counters/port_rcv_data')
+            xmit_counter_name=os.path.join(self.ibdirname, l[0], 'ports', l[1], 'counters/port_xmit_data')
+            ret.append((name, rcv_counter_name, xmit_counter_name))
+        return ret
+
+    def extract(self):
+        self.set2['total'] = [0, 0]
+        if callable(self.counters):
+            self.counters = self.counters()
+        for name in self.vars: self.set2[name] = [0, 0]
+        for name, rcv_counter_name, xmit_counter_name in self.counters:
+            rcv_lines = procreader.readlines(rcv_counter_name)
+            xmit_lines = procreader.readlines(xmit_counter_name)
             if len(rcv_lines) < 1 or len(xmit_lines) < 1:
                 continue
             rcv_value = int(rcv_lines[0])
@@ -1800,6 +2000,149 @@ class dstat_ib(dstat):
         if step == op.delay:
             self.set1.update(self.set2)
 
+### GPU backends, sample() returns one tuple of gpufields per GPU index
+gpufields = ('temperature.gpu', 'utilization.gpu', 'utilization.memory', 'memory.total', 'memory.free', 'memory.used')
+
+class gpu_nvml:
+    "Sample through the NVIDIA management library (pynvml)"
+    def __init__(self):
+        import pynvml
+        self.nvml = pynvml
+        pynvml.nvmlInit()
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+
+    def sample(self):
+        ret = []
+        mib = 1024.0 * 1024.0
+        for handle in self.handles:
+            utilization = self.nvml.nvmlDeviceGetUtilizationRates(handle)
+            memory = self.nvml.nvmlDeviceGetMemoryInfo(handle)
+            ret.append((self.nvml.nvmlDeviceGetTemperature(handle, self.nvml.NVML_TEMPERATURE_GPU),
+                        utilization.gpu, utilization.memory,
+                        memory.total / mib, memory.free / mib, memory.used / mib))
+        return ret
+
+class gpu_smi:
+    "Sample by running nvidia-smi once per tick"
+    def __init__(self):
+        import subprocess
+        self.subprocess = subprocess
+        self.cmd = ['nvidia-smi', '--query-gpu=' + ','.join(gpufields), '--format=csv,nounits,noheader']
+        if not self.sample():
+            raise Exception('nvidia-smi found no GPUs')
+
+    def sample(self):
+        ret = []
+        for line in self.subprocess.check_output(self.cmd, universal_newlines=True).splitlines():
+            l = [value.strip() for value in line.split(',')]
+            if len(l) != len(gpufields): continue
+            ret.append(tuple(gpuvalue(value) for value in l))
+        return ret
+
+class gpu_replay:
+    """
+    Replay a srun_nvidia log: header line, then one line per GPU and timestamp
+    (timestamp [ms], then gpufields). Each tick returns the GPUs of the next timestamp,
+    starting over at the end of the file.
+    """
+    def __init__(self, filename):
+        self.samples = []
+        timestamp = None
+        for line in open(filename).readlines()[1:]:
+            l = [value.strip() for value in line.split(',')]
+            if len(l) != len(gpufields) + 1: continue
+            if l[0] != timestamp:
+                self.samples.append([])
+                timestamp = l[0]
+            self.samples[-1].append(tuple(gpuvalue(value) for value in l[1:]))
+        if not self.samples:
+            raise Exception('No GPU samples found in %s' % filename)
+        self.index = 0
+
+    def sample(self):
+        ret = self.samples[self.index % len(self.samples)]
+        self.index = self.index + 1
+        return ret
+
+class gpu_fake:
+    "Synthetic GPUs with deterministic, changing values"
+    def __init__(self, gpus=2):
+        self.gpus = gpus
+        self.index = 0
+
+    def sample(self):
+        ret = []
+        for i in range(self.gpus):
+            utilization = (self.index * 7 + i * 13) % 101
+            used = 1024.0 * ((self.index + i) % 16)
+            ret.append((35 + utilization // 5, utilization, utilization // 2, 16384.0, 16384.0 - used, used))
+        self.index = self.index + 1
+        return ret
+
+gpubackends = ('nvml', 'nvidia-smi', 'replay', 'fake')
+
+def gpuvalue(value):
+    "Return a number of a nvidia-smi field, -1 when it is not available ([N/A], [Not Supported])"
+    try:
+        return float(value)
+    except ValueError:
+        return -1
+
+class dstat_gpu(dstat):
+    """
+    Temperature, utilization and memory (MiB) of every GPU, sampled in the same tick as the
+    other plugins so they share the epoch_ns timestamp and the output file.
+    Usage:
+        dstat -t --gpu [--gpu-backend nvml|nvidia-smi|replay|fake] [--gpu-replay srun_nvidia_<host>.log]
+    """
+    def __init__(self):
+        self.nick = ('temp', 'util', 'mutl', 'total', 'free', 'used')
+        self.type = 'd'
+        self.width = 5
+        self.scale = 1000
+        self.cols = len(gpufields)
+        self.backend = self.openbackend()
+
+    def openbackend(self):
+        if op.gpubackend == 'replay':
+            if not op.gpureplay:
+                raise Exception('The replay backend needs --gpu-replay <file>')
+            return gpu_replay(op.gpureplay)
+        if op.gpubackend == 'fake':
+            return gpu_fake()
+        if op.gpubackend == 'nvidia-smi':
+            return gpu_smi()
+        try:
+            return gpu_nvml()
+        except Exception:
+            if op.gpubackend == 'nvml':
+                raise
+        return gpu_smi()
+
+    def discover(self, *objlist):
+        ### The sample used to count the GPUs is the one of the first tick
+        self.pending = self.backend.sample()
+        ret = ['gpu%d' % i for i in range(len(self.pending))]
+        for item in objlist: ret.append(item)
+        return ret
+
+    def vars(self):
+        return self.discover
+
+    def name(self):
+        return ['gpu/' + name[3:] for name in self.vars]
+
+    def extract(self):
+        if self.pending is not None:
+            gpus, self.pending = self.pending, None
+        else:
+            gpus = self.backend.sample()
+        for i, name in enumerate(self.vars):
+            if i < len(gpus):
+                self.val[name] = list(gpus[i])
+            else:
+                self.val[name] = [-1] * self.cols
+
 ### END STATS DEFINITIONS ###
 
 color = {
@@ -1920,8 +2263,7 @@ def ticks():
             if len(l) < 2: continue
             return float(l[0])
     except:
-        for line in dopen('/proc/stat').readlines():
-            l = line.split()
+        for l in proc_splitlines('/proc/stat'):
             if len(l) < 2: continue
             if l[0] == 'btime':
                 return time.time() - int(l[1])
@@ -1934,6 +2276,92 @@ def improve(devname):
         devname = devname.split('/')[2]
     return devname
 
+class ProcReader:
+    """
+    Keep /proc and /sys files open and read each of them with a single pread per tick.
+    The content, its lines and split lines are cached until the next clear(), so plugins
+    reading the same file in the same tick share one read and one parse (the cached lists
+    are shared, plugins must not modify them). Files that were not read for a few ticks
+    (e.g. of processes that exited) are closed.
+    """
+    def __init__(self, maxfds=512, keepticks=2):
+        self.maxfds = maxfds
+        self.keepticks = keepticks
+        self.fds = {}
+        self.sizes = {}
+        self.used = {}
+        self.contents = {}
+        self.parsed = {}
+        self.tick = 0
+
+    def open(self, filename):
+        "Return the persistent file descriptor of a file, opening it if needed"
+        if filename not in self.fds:
+            fd = os.open(filename, os.O_RDONLY)
+            if len(self.fds) >= self.maxfds:
+                return fd
+            self.fds[filename] = fd
+        self.used[filename] = self.tick
+        return self.fds[filename]
+
+    def close(self, filename):
+        if filename in self.fds:
+            os.close(self.fds.pop(filename))
+        self.used.pop(filename, None)
+
+    def read(self, filename):
+        "Return the content of a file as read in this tick"
+        if filename in self.contents:
+            return self.contents[filename]
+        fd = self.open(filename)
+        persistent = filename in self.fds
+        try:
+            ### A short read is the end of the file, a full buffer is read again with a bigger one
+            size = self.sizes.get(filename, 4096)
+            while True:
+                data = os.pread(fd, size, 0)
+                if len(data) < size: break
+                size = size * 2
+            self.sizes[filename] = size
+        except OSError:
+            ### The file went away (e.g. /proc/<pid> of an exited process)
+            if persistent:
+                self.close(filename)
+            raise
+        finally:
+            if not persistent:
+                os.close(fd)
+        self.contents[filename] = data.decode('utf-8', 'replace')
+        return self.contents[filename]
+
+    def readlines(self, filename):
+        key = (filename, )
+        if key not in self.parsed:
+            self.parsed[key] = self.read(filename).splitlines(True)
+        return self.parsed[key]
+
+    def splitlines(self, filename, sep=None, replace=None):
+        key = (filename, sep, replace)
+        if key not in self.parsed:
+            if replace and sep:
+                self.parsed[key] = [line.replace(replace, sep).split(sep) for line in self.readlines(filename)]
+            elif replace:
+                self.parsed[key] = [line.replace(replace, ' ').split() for line in self.readlines(filename)]
+            else:
+                self.parsed[key] = [line.split(sep) for line in self.readlines(filename)]
+        return self.parsed[key]
+
+    def clear(self):
+        "Start a new tick, forget the cached contents and close the stale files"
+        self.tick = self.tick + 1
+        self.contents = {}
+        self.parsed = {}
+        for filename, used in list(self.used.items()):
+            if self.tick - used > self.keepticks:
+                self.close(filename)
+
+procreader = ProcReader()
+
 def dopen(filename):
     "Open a file for reuse, if already opened, return file descriptor"
     global fds
@@ -2029,41 +2457,37 @@ def cmd_splitlines(cmd, sep=None):
     for line in pipes[1].readlines():
        yield line.split(sep)
 
+### Like linecache before, files that cannot be read give no lines
+def proc_lines(filename):
+    try:
+        return procreader.readlines(filename)
+    except EnvironmentError:
+        return []
+
 def proc_readlines(filename):
     "Return the lines of a file, one by one"
-#    for line in open(filename).readlines():
-#       yield line
-
-    ### Implemented linecache (for top-plugins)
-    i = 1
-    while True:
-        line = linecache.getline(filename, i);
-        if not line: break
+    for line in proc_lines(filename):
         yield line
-        i += 1
 
 def proc_splitlines(filename, sep=None):
     "Return the splitted lines of a file, one by one"
-#    for line in open(filename).readlines():
-#       yield line.split(sep)
-
-    ### Implemented linecache (for top-plugins)
-    i = 1
-    while True:
-        line = linecache.getline(filename, i);
-        if not line: break
-        yield line.split(sep)
-        i += 1
+    try:
+        lines = procreader.splitlines(filename, sep)
+    except EnvironmentError:
+        return
+    for l in lines:
+        yield l
 
 def proc_readline(filename):
     "Return the first line of a file"
-#    return open(filename).read()
-    return linecache.getline(filename, 1)
+    lines = proc_lines(filename)
+    if lines:
+        return lines[0]
+    return ''
 
 def proc_splitline(filename, sep=None):
     "Return the first line of a file splitted"
-#    return open(filename).read().split(sep)
-    return linecache.getline(filename, 1).split(sep)
+    return proc_readline(filename).split(sep)
 
 ### FIXME: Should we cache this within every step ?
 def proc_pidlist():
@@ -2286,6 +2710,50 @@ def csvheader(totlist):
             line = line + char['sep']
     return line + '\n'
 
+### Binary output: 8 byte magic, 4 byte header length, JSON header, then one record per sample.
+### A record is the sample timestamp (int64 ns) followed by every numeric value as a float64,
+### little-endian, in the column order of the header (see read_dstat_binary in convert_dstat_log.py).
+BINMAGIC = b'DSTATBIN'
+
+### Plugins already reported for writing a different number of values than in the binary header
+binmismatch = set()
+
+def binheader(totlist, hostname, user):
+    "Return the binary header, the struct to pack records with and the number of values of every plugin"
+    columns = []
+    widths = []
+    for o in totlist:
+        plugincolumns = o.bincolumns()
+        widths.append(len(plugincolumns))
+        for group, nick in plugincolumns:
+            columns.append({'plugin': o.__class__.__name__, 'group': group, 'nick': nick})
+    recordstruct = struct.Struct('<q' + 'd' * len(columns))
+    header = json.dumps({
+        'version': 1,
+        'host': hostname,
+        'user': user,
+        'cmdline': 'dstat %s' % ' '.join(op.args),
+        'date': time.strftime('%d %b %Y %H:%M:%S %Z', time.localtime()),
+        'format': recordstruct.format,
+        'columns': columns,
+    }).encode('utf-8')
+    return BINMAGIC + struct.pack('<I', len(header)) + header, recordstruct, widths
+
+def binrecord(totlist):
+    "Return the packed record of the current sample"
+    values = []
+    for o, width in zip(totlist, binwidths):
+        pluginvalues = o.binvalues()
+        ### A plugin whose number of values changed since the header is padded or cut to its own
+        ### columns, so the values of the plugins after it stay under their header columns
+        if len(pluginvalues) != width:
+            if o not in binmismatch:
+                binmismatch.add(o)
+                info(1, 'Plugin %s has %d values instead of the %d of the binary header, padding or cutting them' % (o.name, len(pluginvalues), width))
+            pluginvalues = (list(pluginvalues) + [float('nan')] * width)[:width]
+        values.extend(pluginvalues)
+    return binstruct.pack(starttime_ns, *values)
+
 def info(level, msg):
     "Output info message"
 #   if level <= op.verbose:
@@ -2369,7 +2837,7 @@ def getnamebypid(pid, name):
     try:
         #### man proc tells me there should be nulls in here, but sometimes it seems like spaces (esp google chrome)
 #        cmdline = open('/proc/%s/cmdline' % pid).read().split(('\0', ' '))
-        cmdline = linecache.getline('/proc/%s/cmdline' % pid, 1).split(('\0', ' '))
+        cmdline = proc_readline('/proc/%s/cmdline' % pid).split(('\0', ' '))
         ret = basename(cmdline[0])
         if ret in ('bash', 'csh', 'ksh', 'perl', 'python', 'ruby', 'sh'):
             ret = basename(cmdline[1])
@@ -2570,6 +3038,9 @@ def exit(ret):
     if op.pidfile and os.path.exists(op.pidfile):
         os.remove(op.pidfile)
 
+    if op.outputbin and 'binfile' in globals():
+        binfile.flush()
+
     if op.profile and os.path.exists(op.profile):
         rows, cols = gettermsize()
         import pstats
@@ -2592,6 +3063,7 @@ def main():
     global ansi, theme, outputfile
     global totlist, inittime
     global update, missed
+    global binfile, binstruct, binwidths
 
     cpunr = getcpunr()
     hz = os.sysconf('SC_CLK_TCK')
@@ -2749,6 +3221,16 @@ def main():
     if op.output:
         outputfile.write(csvheader(totlist))
 
+    ### Prepare binary output file, the header fixes the record layout for this plugin set
+    if op.outputbin:
+        binfile = open(op.outputbin, 'wb')
+        header, binstruct, binwidths = binheader(totlist, hostname, user)
+        binfile.write(header)
+
+    if op.headless:
+        headless(totlist)
+        return
+
     scheduler = sched.scheduler(time.time, time.sleep)
     inittime = time.time()
 
@@ -2762,7 +3244,7 @@ def main():
         scheduler.run()
         sys.stdout.flush()
         update = update + interval
-        linecache.clearcache()
+        procreader.clear()
 
     if op.update:
         sys.stdout.write('\n')
@@ -2770,10 +3252,11 @@ def main():
 def perform(update):
         "Inner loop that calculates counters and constructs output"
         global totlist, oldvislist, vislist, showheader, rows, cols
-        global elapsed, totaltime, starttime
+        global elapsed, totaltime, starttime, starttime_ns
         global loop, step, missed
 
-        starttime = time.time()
+        starttime_ns = time.time_ns()
+        starttime = starttime_ns / 1e9
 
         loop = (update - 1 + op.delay) / op.delay
         step = ((update - 1) % op.delay) + 1
@@ -2885,6 +3368,8 @@ def perform(update):
         if op.output and step == op.delay:
             outputfile.write(oline + '\n')
 #            outputfile.flush()
+        if op.outputbin and step == op.delay:
+            binfile.write(binrecord(totlist))
 
         ### Print debugging output
         if op.debug:
@@ -2907,6 +3392,79 @@ def perform(update):
         if not op.update:
             sys.stdout.write('\n')
 
+def headless(totlist):
+    "Collection loop without display, one record per interval"
+    global update, elapsed, starttime, starttime_ns
+    global loop, step, missed
+
+    ### Without an output file the CSV records go to stdout, preceded by the CSV header,
+    ### unless only binary records were asked for
+    if op.output:
+        out = outputfile
+    elif op.outputbin:
+        out = None
+    else:
+        out = sys.stdout
+        out.write(csvheader(totlist))
+
+    ### Every sample is a complete step, plugins roll their counters over on each one
+    loop = step = 1
+    interval_ns = op.interval * 1000000
+    nexttick = time.monotonic_ns()
+    previous = None
+    update = 0
+    missed = 0
+
+    ### Batch schedulers stop the collector with SIGTERM, unwind so the buffered records are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while op.count == -1 or update < op.count:
+            ### Absolute deadlines on the monotonic clock, so sleeping late never accumulates drift
+            delay = nexttick - time.monotonic_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+
+            sampled = time.monotonic_ns()
+            starttime_ns = time.time_ns()
+            starttime = starttime_ns / 1e9
+            if previous is None:
+                elapsed = ticks()
+            else:
+                elapsed = (sampled - previous) / 1e9
+            previous = sampled
+
+            oline = ''
+            for o in totlist:
+                try:
+                    o.extract()
+                except Exception as err:
+                    print('* Exception in plugin %s: %s' % (o.name, err), file=sys.stderr)
+                if out:
+                    oline = oline + o.showcsv() + o.showcsvend(totlist, totlist)
+            if out:
+                out.write(oline + '\n')
+            if op.outputbin:
+                binfile.write(binrecord(totlist))
+
+            procreader.clear()
+            update = update + 1
+
+            ### Ticks that were overrun are skipped, not sampled in a burst to catch up
+            nexttick = nexttick + interval_ns
+            now = time.monotonic_ns()
+            if now >= nexttick:
+                skipped = (now - nexttick) // interval_ns + 1
+                missed = missed + skipped
+                nexttick = nexttick + skipped * interval_ns
+    finally:
+        if out:
+            out.flush()
+        if op.outputbin:
+            binfile.flush()
+        if missed and op.debug:
+            info(1, 'Missed %d ticks of %d ms' % (missed, op.interval))
+
 ### Main entrance
 if __name__ == '__main__':
     try: